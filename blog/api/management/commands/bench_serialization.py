@@ -0,0 +1,79 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from api.v1.renderers import ORJSONRenderer
+from api.v1.serializers import BikeRowSerializer, BikesSerializer, CategorySerializer
+from bike_app.models import Bike, Category, Tags
+
+
+class LegacyBikesSerializer(BikesSerializer):
+    """Прежний вывод: CategorySerializer на каждую строку"""
+
+    def to_representation(self, instance):
+        rep = super(BikesSerializer, self).to_representation(instance)
+        rep['cat'] = CategorySerializer(instance.cat).data['name']
+        return rep
+
+
+class Command(BaseCommand):
+    """Сравнение скорости сериализации списка постов API: объекты модели и строки values()"""
+
+    help = 'Заполняет базу тестовыми постами в откатываемой транзакции и выводит строк в секунду для каждого способа'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000, help='Количество постов')
+        parser.add_argument('--repeat', type=int, default=5, help='Количество повторов, берется лучший')
+        parser.add_argument('--fields', default='title,slug,created,cat,count_likes,rating',
+                            help='Поля для варианта с ?fields=')
+
+    def seed(self, rows: int) -> None:
+        cat = Category.objects.create(name='bench category')
+        tags = [Tags.objects.create(tag=f'bench tag {i}') for i in range(5)]
+        posts = Bike.objects.bulk_create(
+            Bike(title=f'bench post {i}', slug=f'bench-post-{i}', content='Текст поста. ' * 200, cat=cat,
+                 like_count=i % 50, rating_sum=i % 3 * (1 + i % 5), rating_count=i % 3)
+            for i in range(rows)
+        )
+        Bike.tags.through.objects.bulk_create(
+            Bike.tags.through(bike_id=post.pk, tags_id=tags[(post.pk + shift) % len(tags)].pk)
+            for post in posts for shift in range(2)
+        )
+
+    def measure(self, repeat: int, render) -> tuple:
+        """Лучшее время из repeat прогонов и число запросов в одном прогоне"""
+
+        best = None
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                render()
+                elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, len(queries)
+
+    def handle(self, *args, **options):
+        request = RequestFactory().get('/api/v1/bikes/')
+        queryset = Bike.objects.all().with_counters().select_related('cat').order_by('-created')
+        cases = {
+            'ModelSerializer + JSONRenderer (до)': lambda: JSONRenderer().render(
+                LegacyBikesSerializer(queryset.all(), many=True, context={'request': request}).data),
+            'ModelSerializer + prefetch tags': lambda: JSONRenderer().render(
+                BikesSerializer(queryset.prefetch_related('tags'), many=True, context={'request': request}).data),
+            'values() + ORJSONRenderer (после)': lambda: ORJSONRenderer().render(
+                (lambda serializer: serializer.serialize(serializer.select(queryset)))(BikeRowSerializer(request))),
+            f'values() + ORJSONRenderer, fields={options["fields"]}': lambda: ORJSONRenderer().render(
+                (lambda serializer: serializer.serialize(serializer.select(queryset)))(
+                    BikeRowSerializer(request, options['fields']))),
+        }
+
+        with transaction.atomic():
+            self.seed(options['rows'])
+            for name, render in cases.items():
+                elapsed, queries = self.measure(max(options['repeat'], 1), render)
+                self.stdout.write(f'{name}: {options["rows"] / elapsed:,.0f} строк/с, запросов: {queries}')
+            transaction.set_rollback(True)
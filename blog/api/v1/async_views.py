@@ -0,0 +1,98 @@
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+
+from bike_app.caching import aget_list_generation
+from bike_app.conditional import POST_VERSION_FIELDS, make_etag
+from bike_app.pagination import InvalidCursor, KeysetPaginator
+
+from .pagination import KeysetPagination
+from .renderers import ORJSONRenderer
+from .serializers import BikeRowSerializer
+from .views import BikesViewSet
+
+# параметры, которые асинхронный путь обрабатывает сам; с остальными (фильтры, поиск, format) запрос идет в BikesViewSet
+ROW_QUERY_PARAMS = {'cursor', 'page_size', 'with_total', 'ordering', 'fields'}
+
+sync_list = BikesViewSet.as_view({'get': 'list', 'post': 'create'}, basename='bike', detail=False)
+sync_detail = BikesViewSet.as_view({'get': 'retrieve', 'put': 'update', 'patch': 'partial_update',
+                                    'delete': 'destroy'}, basename='bike', detail=True)
+
+
+def is_plain_read(request) -> bool:
+    """
+    GET без заголовка Authorization, без параметров фильтрации и не для браузера: ответ не зависит от пользователя,
+    ошибок аутентификации быть не может. Все остальное обрабатывает BikesViewSet.
+    """
+
+    return (request.method == 'GET' and 'HTTP_AUTHORIZATION' not in request.META
+            and 'text/html' not in request.META.get('HTTP_ACCEPT', '') and set(request.GET) <= ROW_QUERY_PARAMS)
+
+
+def json_response(data, etag: str) -> HttpResponse:
+    response = HttpResponse(ORJSONRenderer().render(data), content_type=ORJSONRenderer.media_type)
+    response['ETag'] = etag
+    patch_vary_headers(response, ('Accept', 'Cookie'))
+    return response
+
+
+async def bike_list(request):
+    """Асинхронный список постов API в формате BikesViewSet.list"""
+
+    if not is_plain_read(request):
+        return await sync_to_async(sync_list)(request)
+    try:
+        serializer = BikeRowSerializer(request, request.GET.get('fields'))
+    except ValidationError:
+        return await sync_to_async(sync_list)(request)
+
+    etag = make_etag('api-list', await aget_list_generation(), request.build_absolute_uri(), ORJSONRenderer.format)
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        return response
+
+    pagination, query = KeysetPagination(), Request(request)
+    field, descending = pagination.get_ordering(query, BikesViewSet)
+    paginator = KeysetPaginator(serializer.select(BikesViewSet.queryset.all()), pagination.get_page_size(query),
+                                field=field, descending=descending,
+                                with_total=request.GET.get(pagination.total_query_param) in ('1', 'true'))
+    try:
+        pagination.page = await paginator.apage(request.GET.get(pagination.cursor_query_param))
+    except InvalidCursor:
+        return await sync_to_async(sync_list)(request)
+    pagination.request = query
+    return json_response(pagination.get_paginated_data(await serializer.aserialize(pagination.page)), etag)
+
+
+async def bike_detail(request, pk: str):
+    """Асинхронное чтение поста API в формате BikesViewSet.retrieve"""
+
+    if not is_plain_read(request) or 'cursor' in request.GET:
+        return await sync_to_async(sync_detail)(request, pk=pk)
+    try:
+        serializer = BikeRowSerializer(request, request.GET.get('fields'))
+    except ValidationError:
+        return await sync_to_async(sync_detail)(request, pk=pk)
+
+    queryset = BikesViewSet.queryset.filter(pk=pk).prefetch_related(None)
+    version = await queryset.values_list(*POST_VERSION_FIELDS).afirst()
+    if version is None:
+        return await sync_to_async(sync_detail)(request, pk=pk)
+    etag = make_etag('api-object', pk, *version, request.build_absolute_uri(), ORJSONRenderer.format)
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        return response
+
+    row = await serializer.select(queryset).afirst()
+    if row is None:
+        return await sync_to_async(sync_detail)(request, pk=pk)
+    return json_response((await serializer.aserialize([row]))[0], etag)
+
+
+# запись передается BikesViewSet, который, как все представления DRF, освобожден от CsrfViewMiddleware и проверяет
+# CSRF сам только для входа по сессии. Атрибут вместо csrf_exempt: в Django 4.2 декоратор делает из корутины
+# синхронную функцию
+bike_list.csrf_exempt = True
+bike_detail.csrf_exempt = True
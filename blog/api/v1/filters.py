@@ -0,0 +1,24 @@
+from rest_framework.filters import BaseFilterBackend
+
+from bike_app.search import search_posts
+
+
+class FullTextSearchFilter(BaseFilterBackend):
+    """Фильтр по параметру search через поисковый индекс постов вместо регулярных выражений"""
+
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        return search_posts(queryset, query)
+
+    def get_schema_operation_parameters(self, view) -> list:
+        return [{
+            'name': self.search_param,
+            'required': False,
+            'in': 'query',
+            'description': 'Полнотекстовый поиск по заголовку, тексту и категории',
+            'schema': {'type': 'string'},
+        }]
@@ -0,0 +1,79 @@
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from bike_app.pagination import InvalidCursor, KeysetPaginator
+
+
+class KeysetPagination(BasePagination):
+    """Пагинация API по курсору (created, id) без COUNT(*) и OFFSET"""
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    total_query_param = 'with_total'
+    page_size = 5
+    max_page_size = 100
+    ordering_query_param = 'ordering'
+    ordering_fields = ('created', 'modified')
+
+    def get_page_size(self, request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_ordering(self, request, view=None) -> tuple:
+        """Поле и направление ключа из параметра ordering, по умолчанию -created"""
+
+        ordering_fields = getattr(view, 'ordering_fields', self.ordering_fields)
+        ordering = request.query_params.get(self.ordering_query_param, '').split(',')[0].strip()
+        if ordering.lstrip('-') in ordering_fields:
+            return ordering.lstrip('-'), ordering.startswith('-')
+        return 'created', True
+
+    def paginate_queryset(self, queryset, request, view=None) -> list:
+        field, descending = self.get_ordering(request, view)
+        if 'search_rank' in queryset.query.annotations and self.ordering_query_param not in request.query_params:
+            # результаты поиска без явного ordering - по релевантности, как в search_posts
+            field, descending = 'search_rank', True
+        with_total = request.query_params.get(self.total_query_param) in ('1', 'true')
+        paginator = KeysetPaginator(queryset, self.get_page_size(request), field=field, descending=descending,
+                                    with_total=with_total)
+        try:
+            self.page = paginator.page(request.query_params.get(self.cursor_query_param))
+        except InvalidCursor:
+            raise NotFound('Неверный курсор страницы')
+        self.request = request
+        return list(self.page)
+
+    def get_link(self, cursor: str):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_data(self, data) -> dict:
+        response = {
+            'next': self.get_link(self.page.next_cursor),
+            'previous': self.get_link(self.page.previous_cursor),
+            'results': data,
+        }
+        if self.page.approximate_total is not None:
+            response['approximate_total'] = self.page.approximate_total
+        return response
+
+    def get_paginated_response(self, data) -> Response:
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema) -> dict:
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'approximate_total': {'type': 'integer'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,18 @@
+import orjson
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class ORJSONRenderer(BaseRenderer):
+    """JSON-рендерер на orjson: тот же компактный UTF-8 вывод, что у JSONRenderer, но без json.dumps на Python"""
+
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+    encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None) -> bytes:
+        if data is None:
+            return b''
+        # Decimal, ленивые строки и прочие типы, которых не знает orjson, - как в JSONEncoder DRF
+        return orjson.dumps(data, default=self.encoder.default, option=orjson.OPT_NON_STR_KEYS)
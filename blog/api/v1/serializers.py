@@ -1,6 +1,8 @@
 from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
 
 from bike_app.models import *
+from bike_blog.images import variant_urls
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -17,24 +19,155 @@ class BikesSerializer(serializers.ModelSerializer):
     auth_user = serializers.HiddenField(default=serializers.CurrentUserDefault())
     count_likes = serializers.IntegerField(read_only=True)
     rating = serializers.DecimalField(max_digits=3, decimal_places=2, read_only=True)
+    images = serializers.SerializerMethodField()
 
     class Meta:
         model = Bike
         ordering = ['-created']
         fields = ('title', 'slug', 'content', 'created', 'modified', 'cat', 'tags', 'is_published', 'count_likes',
-                  'rating', 'auth_user')
+                  'rating', 'auth_user', 'photo', 'images')
+
+    def get_images(self, instance) -> dict:
+        """URL уменьшенных копий фото в WebP и JPEG по вариантам и ширинам"""
+
+        request = self.context.get('request')
+        return variant_urls(instance.photo, instance.photo_variants,
+                            request.build_absolute_uri if request is not None else None)
 
     def to_representation(self, instance):
         """Вывод названия категории вместо id"""
 
         rep = super().to_representation(instance)
-        rep['cat'] = CategorySerializer(instance.cat).data['name']
+        rep['cat'] = instance.cat.name
         return rep
 
 
+class BikeRowSerializer:
+    """
+    Сериализация строк values() в формат BikesSerializer для чтения списка и поста без полей DRF на каждый объект.
+    Параметр fields (title,slug,...) сужает и ответ, и SELECT: content выбирается, только если запрошен.
+    """
+
+    fields = tuple(name for name in BikesSerializer.Meta.fields if name != 'auth_user')
+    # поле ответа -> столбцы выборки; id и ключи пагинации выбираются всегда
+    columns = {
+        'title': ('title',), 'slug': ('slug',), 'content': ('content',), 'created': (), 'modified': (),
+        'cat': ('cat__name',), 'tags': (), 'is_published': ('is_published',), 'count_likes': ('count_likes',),
+        'rating': ('rating',), 'photo': ('photo',), 'images': ('photo', 'photo_variants'),
+    }
+    key_columns = ('id', 'created', 'modified')
+    datetime_field = serializers.DateTimeField()
+    rating_field = BikesSerializer._declared_fields['rating']
+
+    def __init__(self, request=None, fields: str = None):
+        self.request = request
+        self.fields = self.parse_fields(fields) if fields else self.fields
+        self.photo_field = Bike._meta.get_field('photo')
+
+    @classmethod
+    def parse_fields(cls, value: str) -> tuple:
+        requested = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in requested if name not in cls.fields]
+        if unknown or not requested:
+            raise ValidationError({'fields': f"Доступные поля: {', '.join(cls.fields)}"})
+        return tuple(name for name in cls.fields if name in requested)
+
+    def select(self, queryset):
+        """Выборка только нужных столбцов в виде словарей"""
+
+        columns = dict.fromkeys(self.key_columns)
+        if 'search_rank' in queryset.query.annotations:
+            # ключ пагинации результатов поиска
+            columns['search_rank'] = None
+        for name in self.fields:
+            columns.update(dict.fromkeys(self.columns[name]))
+        return queryset.prefetch_related(None).values(*columns)
+
+    def _tags_query(self, rows: list) -> tuple:
+        tags = {row['id']: [] for row in rows}
+        through = Bike.tags.through.objects.filter(bike_id__in=tags).order_by('pk')
+        return tags, through.values_list('bike_id', 'tags_id')
+
+    def _tags(self, rows: list) -> dict:
+        """id тегов всех постов страницы одним запросом"""
+
+        tags, links = self._tags_query(rows)
+        for bike_id, tag_id in links:
+            tags[bike_id].append(tag_id)
+        return tags
+
+    async def _atags(self, rows: list) -> dict:
+        tags, links = self._tags_query(rows)
+        async for bike_id, tag_id in links:
+            tags[bike_id].append(tag_id)
+        return tags
+
+    def _url(self, path: str) -> str:
+        return self.request.build_absolute_uri(path) if self.request is not None else path
+
+    def to_representation(self, row: dict, tags: dict) -> dict:
+        data = {}
+        for name in self.fields:
+            if name == 'created' or name == 'modified':
+                data[name] = self.datetime_field.to_representation(row[name])
+            elif name == 'cat':
+                data[name] = row['cat__name']
+            elif name == 'tags':
+                data[name] = tags[row['id']]
+            elif name == 'rating':
+                rating = row['rating']
+                data[name] = None if rating is None else self.rating_field.to_representation(rating)
+            elif name == 'photo':
+                data[name] = self._url(self.photo_field.storage.url(row['photo'])) if row['photo'] else None
+            elif name == 'images':
+                photo = self.photo_field.attr_class(None, self.photo_field, row['photo'])
+                data[name] = variant_urls(photo, row['photo_variants'], self._url if self.request else None)
+            else:
+                data[name] = row[name]
+        return data
+
+    def serialize(self, rows) -> list:
+        rows = list(rows)
+        tags = self._tags(rows) if 'tags' in self.fields else {}
+        return [self.to_representation(row, tags) for row in rows]
+
+    async def aserialize(self, rows) -> list:
+        """serialize() для асинхронных представлений: теги читаются асинхронным ORM"""
+
+        rows = list(rows)
+        tags = await self._atags(rows) if 'tags' in self.fields else {}
+        return [self.to_representation(row, tags) for row in rows]
+
+
 class UserPostRelationSerializer(serializers.ModelSerializer):
     """Сериализатор для модели UserPostRelation"""
 
     class Meta:
         model = UserPostRelation
         fields = ('bike', 'like', 'rate')
+
+
+class BikeBulkItemSerializer(serializers.Serializer):
+    """Элемент пакетной записи постов: с id - изменение существующего поста, без id - создание"""
+
+    id = serializers.IntegerField(required=False)
+    title = serializers.CharField(max_length=255, required=False)
+    content = serializers.CharField(required=False, allow_blank=True)
+    cat = serializers.IntegerField(required=False)
+    tags = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=50)
+    is_published = serializers.ChoiceField(choices=Bike.Status.choices, required=False)
+
+    def validate(self, attrs: dict) -> dict:
+        if 'id' not in attrs:
+            missing = {name: 'Обязательное поле.' for name in ('title', 'cat') if name not in attrs}
+            if missing:
+                raise ValidationError(missing)
+        return attrs
+
+
+class RelationBulkItemSerializer(serializers.Serializer):
+    """Элемент пакетной записи лайков и оценок текущего пользователя"""
+
+    bike = serializers.IntegerField()
+    like = serializers.BooleanField(required=False)
+    rate = serializers.ChoiceField(choices=UserPostRelation.RATE_CHOICES, required=False, allow_null=True)
@@ -1,12 +1,26 @@
 import json
 from http import HTTPStatus
+from unittest import mock
 
+import orjson
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import connection
 from django.db.models import Avg, Case, Count, Q, When
-from django.test import TestCase
+from django.test import AsyncRequestFactory, Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APITestCase
 
+from api.v1.async_views import bike_detail, bike_list
 from api.v1.serializers import BikesSerializer
+from api.v1.urls import async_urlpatterns
+from bike_blog import urls as site_urls
+from bike_app.caching import get_list_generation
+from bike_app.search import search_posts
 from bike_app.models import *
+from users.authentication import get_cached_user
 
 
 class MyApiTestCase(APITestCase):
@@ -50,6 +64,24 @@ class MyApiTestCase(APITestCase):
         self.assertEqual(serializer_data[1]['rating'], '5.00')
         self.assertEqual(serializer_data[1]['count_likes'], 1)
 
+    def test_cursor_pagination(self):
+        """Тест пагинации по курсору"""
+
+        path = reverse('bike-list')
+        response = self.client.get(path, data={'page_size': 1, 'with_total': 'true'})
+        self.assertEqual(HTTPStatus.OK, response.status_code)
+        self.assertEqual(['post2'], [post['title'] for post in response.data['results']])
+        self.assertEqual(2, response.data['approximate_total'])
+        self.assertIsNone(response.data['previous'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(['post1'], [post['title'] for post in response.data['results']])
+        self.assertIsNone(response.data['next'])
+        self.assertIsNotNone(response.data['previous'])
+
+        response = self.client.get(path, data={'cursor': 'wrong'})
+        self.assertEqual(HTTPStatus.NOT_FOUND, response.status_code)
+
     def test_create(self):
         """Тест создания объекта"""
 
@@ -138,6 +170,69 @@ class MyApiTestCase(APITestCase):
         self.assertEqual(HTTPStatus.OK, response.status_code)
         self.assertEqual(serializer_data, response.data['results'])
 
+    def test_get_search_rank(self):
+        """Тест сортировки результатов ?search= по релевантности, а не по дате"""
+
+        Bike.published.create(title='post3', content='post1 post1', cat_id=self.c_1.id)
+        response = self.client.get(reverse('bike-list'), data={'search': 'post1'})
+        self.assertEqual(HTTPStatus.OK, response.status_code)
+        self.assertEqual(['post1', 'post3'], [post['title'] for post in response.data['results']])
+
+        response = self.client.get(reverse('bike-list'), data={'search': 'post1', 'page_size': 1})
+        self.assertEqual(['post1'], [post['title'] for post in response.data['results']])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(['post3'], [post['title'] for post in response.data['results']])
+
+    def test_search_action(self):
+        """Тест полнотекстового поиска с ранжированием"""
+
+        Bike.published.create(title='post3', content='post1 post1', cat_id=self.c_1.id)
+        url = reverse('bike-search')
+        response = self.client.get(url, data={'q': 'post1'})
+        self.assertEqual(HTTPStatus.OK, response.status_code)
+        self.assertEqual(['post1', 'post3'], [post['title'] for post in response.data])
+        listed = self.client.get(reverse('bike-list'), data={'title': 'post1'}).data['results'][0]
+        self.assertEqual(listed, response.data[0])
+
+        response = self.client.get(url, data={'q': 'post1', 'fields': 'title,tags'})
+        self.assertEqual([{'title': 'post1', 'tags': []}, {'title': 'post3', 'tags': []}], response.data)
+
+
+class RowSerializationTestCase(APITestCase):
+    """Тест чтения постов через строки values() и параметра fields"""
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        cache.clear()
+        self.c_1 = Category.objects.create(name='cat1')
+        self.b_1 = Bike.published.create(title='post1', content='cont1', cat_id=self.c_1.id)
+        self.b_1.tags.add(Tags.objects.create(tag='tag1'), Tags.objects.create(tag='tag2'))
+
+    def test_same_as_model_serializer(self):
+        """Тест совпадения ответа с BikesSerializer и числа запросов для списка"""
+
+        post = Bike.objects.with_counters().select_related('cat').get(pk=self.b_1.pk)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('bike-list'))
+        self.assertEqual(BikesSerializer(post).data, response.data['results'][0])
+        self.assertEqual('application/json', response['Content-Type'])
+
+        response = self.client.get(reverse('bike-detail', args=(self.b_1.id,)))
+        self.assertEqual(BikesSerializer(post).data, response.data)
+
+    def test_sparse_fields(self):
+        """Тест выборки только запрошенных полей без текста поста"""
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('bike-list'), data={'fields': 'slug,cat'})
+        self.assertEqual([{'slug': 'post1', 'cat': 'cat1'}], response.data['results'])
+        self.assertEqual(1, len(queries))
+        self.assertNotIn('content', queries[0]['sql'])
+
+        response = self.client.get(reverse('bike-list'), data={'fields': 'slug,password'})
+        self.assertEqual(HTTPStatus.BAD_REQUEST, response.status_code)
+
 
 class RelationTestCase(APITestCase):
     """Тест отношения пользователей к постам"""
@@ -184,6 +279,19 @@ class RelationTestCase(APITestCase):
                                                 bike=self.b_1)
         self.assertEqual(5, relation.rate)
 
+    def test_like_and_rate_counters(self):
+        """Тест повторной установки лайка и оценки: одна строка и счетчики без двойного учета"""
+
+        path = reverse('userpostrelation-detail', args=(self.b_1.id,))
+        self.client.force_login(self.user)
+        for data in ({'like': True}, {'like': True, 'rate': 4}, {'rate': 2}):
+            response = self.client.patch(path, data=json.dumps(data), content_type='application/json')
+            self.assertEqual(HTTPStatus.OK, response.status_code)
+        self.assertEqual({'bike': self.b_1.id, 'like': True, 'rate': 2}, response.data)
+        self.assertEqual(1, UserPostRelation.objects.filter(auth_user=self.user, bike=self.b_1).count())
+        self.b_1.refresh_from_db()
+        self.assertEqual((1, 2, 1), (self.b_1.like_count, self.b_1.rating_sum, self.b_1.rating_count))
+
     def test_rate_wrong(self):
         """Тест неверного значения рейтинга"""
 
@@ -198,6 +306,116 @@ class RelationTestCase(APITestCase):
         self.assertEqual(HTTPStatus.BAD_REQUEST, response.status_code, response.data)
 
 
+class BulkTestCase(APITestCase):
+    """Тест пакетной записи постов и оценок"""
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        cache.clear()
+        self.user = get_user_model().objects.create(username='test_username')
+        self.user2 = get_user_model().objects.create(username='test_username2')
+        self.c_1 = Category.objects.create(name='cat1')
+        self.tags = [Tags.objects.create(tag='tag1'), Tags.objects.create(tag='tag2')]
+        self.b_1 = Bike.published.create(title='post1', content='cont1', cat_id=self.c_1.id, auth_user=self.user2)
+        self.client.force_login(self.user)
+        # пользователь сессии в кэше, как после первого запроса
+        get_cached_user(self.user.pk)
+
+    def post_items(self, size: int, start: int = 0):
+        items = [{'title': f'Горный велосипед {i}', 'content': 'обзор', 'cat': self.c_1.id,
+                  'tags': [tag.id for tag in self.tags]} for i in range(start, start + size)]
+        return self.client.post(reverse('bike-bulk'), data=items, format='json')
+
+    def test_create_posts(self):
+        """Тест создания постов с тегами и поисковым индексом и числа запросов, не зависящего от размера пакета"""
+
+        generation = get_list_generation()
+        with CaptureQueriesContext(connection) as small:
+            response = self.post_items(2)
+        self.assertEqual(HTTPStatus.OK, response.status_code)
+        self.assertEqual(['created', 'created'], [result['status'] for result in response.data['results']])
+        post = Bike.objects.get(slug=response.data['results'][0]['slug'])
+        self.assertEqual((self.user, 2), (post.auth_user, post.tags.count()))
+        self.assertEqual(2, search_posts(Bike.objects.all(), 'горные велосипеды').count())
+        self.assertNotEqual(generation, get_list_generation())
+
+        with CaptureQueriesContext(connection) as large:
+            self.post_items(20, start=2)
+        self.assertEqual(len(small), len(large))
+
+    def test_item_errors(self):
+        """Тест ошибок отдельных элементов: остальные элементы записываются"""
+
+        items = [
+            {'title': 'post new', 'cat': self.c_1.id},
+            {'title': 'post1', 'cat': self.c_1.id},
+            {'title': 'post other', 'cat': 0},
+            {'content': 'без заголовка'},
+            {'id': self.b_1.id, 'title': 'post1 renamed'},
+        ]
+        response = self.client.post(reverse('bike-bulk'), data=items, format='json')
+        self.assertEqual(HTTPStatus.OK, response.status_code)
+        statuses = [result['status'] for result in response.data['results']]
+        self.assertEqual(['created', 'error', 'error', 'error', 'error'], statuses)
+        self.assertEqual({'title', 'cat'}, set(response.data['results'][3]['errors']))
+        self.assertTrue(Bike.objects.filter(title='post new').exists())
+        self.assertFalse(Bike.objects.filter(title='post1 renamed').exists())
+
+    def test_update_posts(self):
+        """Тест изменения постов автором с редиректом со старого адреса и смены тегов"""
+
+        self.client.force_login(self.user2)
+        items = [{'id': self.b_1.id, 'title': 'post1 renamed', 'tags': [self.tags[0].id]}]
+        response = self.client.post(reverse('bike-bulk'), data=items, format='json')
+        self.assertEqual('updated', response.data['results'][0]['status'])
+        self.b_1.refresh_from_db()
+        self.assertEqual(('post1-renamed', [self.tags[0]]), (self.b_1.slug, list(self.b_1.tags.all())))
+        self.assertTrue(SlugRedirect.objects.filter(old_slug='post1', bike=self.b_1).exists())
+
+    def test_size_limit(self):
+        """Тест ограничения размера пакета"""
+
+        with self.settings(BULK_MAX_POSTS=1):
+            self.assertEqual(HTTPStatus.BAD_REQUEST, self.post_items(2).status_code)
+        response = self.client.post(reverse('bike-bulk'), data={'title': 'x'}, format='json')
+        self.assertEqual(HTTPStatus.BAD_REQUEST, response.status_code)
+
+    def test_relations(self):
+        """Тест лайков и оценок списка постов: счетчики и ошибки отдельных элементов"""
+
+        b_2 = Bike.published.create(title='post2', content='cont2', cat_id=self.c_1.id)
+        UserPostRelation.objects.set_relation(self.user.pk, b_2.pk, like=True, rate=2)
+        items = [{'bike': self.b_1.id, 'like': True, 'rate': 5}, {'bike': b_2.id, 'like': False},
+                 {'bike': 0, 'like': True}, {'bike': b_2.id, 'rate': 6}]
+        response = self.client.post(reverse('userpostrelation-bulk'), data=items, format='json')
+        self.assertEqual(HTTPStatus.OK, response.status_code)
+        self.assertEqual(['ok', 'ok', 'error', 'error'], [result['status'] for result in response.data['results']])
+
+        self.b_1.refresh_from_db()
+        b_2.refresh_from_db()
+        self.assertEqual((1, 5, 1), (self.b_1.like_count, self.b_1.rating_sum, self.b_1.rating_count))
+        self.assertEqual((0, 2, 1), (b_2.like_count, b_2.rating_sum, b_2.rating_count))
+        self.assertEqual(2, UserPostRelation.objects.filter(auth_user=self.user).count())
+
+    def test_relations_concurrent_insert(self):
+        """Тест счетчиков, когда параллельный запрос создал строку оценки после проверки пакета"""
+
+        bulk_create = UserPostRelation.objects.bulk_create
+
+        def concurrent_bulk_create(objs, **kwargs):
+            UserPostRelation.objects.set_relation(self.user.pk, self.b_1.pk, like=True, rate=3)
+            return bulk_create(objs, **kwargs)
+
+        items = [{'bike': self.b_1.id, 'like': True, 'rate': 5}]
+        with mock.patch.object(UserPostRelation.objects, 'bulk_create', concurrent_bulk_create):
+            response = self.client.post(reverse('userpostrelation-bulk'), data=items, format='json')
+        self.assertEqual(['ok'], [result['status'] for result in response.data['results']])
+        self.b_1.refresh_from_db()
+        self.assertEqual((1, 5, 1), (self.b_1.like_count, self.b_1.rating_sum, self.b_1.rating_count))
+        self.assertEqual([], list(Bike.objects.with_drifted_counters()))
+
+
 class SerializerTestCase(TestCase):
     """Тестирование сериализатора"""
 
@@ -216,6 +434,7 @@ class SerializerTestCase(TestCase):
                                          auth_user=self.user1)
         self.b_2 = Bike.published.create(title='post_2', content='post_2_content', cat_id=self.c_1.id)
         self.b_2.tags.add(tag1, tag2)
+        self.b_2.refresh_from_db()
 
         UserPostRelation.objects.create(auth_user=self.user1, bike=self.b_1, like=True,
                                         rate=3)
@@ -224,9 +443,9 @@ class SerializerTestCase(TestCase):
         UserPostRelation.objects.create(auth_user=self.user3, bike=self.b_1, like=True,
                                         rate=5)
 
-        UserPostRelation.objects.create(auth_user=self.user3, bike=self.b_2, like=True,
+        UserPostRelation.objects.create(auth_user=self.user1, bike=self.b_2, like=True,
                                         rate=1)
-        UserPostRelation.objects.create(auth_user=self.user3, bike=self.b_2, like=True,
+        UserPostRelation.objects.create(auth_user=self.user2, bike=self.b_2, like=True,
                                         rate=2)
         UserPostRelation.objects.create(auth_user=self.user3, bike=self.b_2, like=False)
 
@@ -249,7 +468,9 @@ class SerializerTestCase(TestCase):
                 'tags': [1, 2],
                 'is_published': 1,
                 'count_likes': 2,
-                'rating': '1.50'
+                'rating': '1.50',
+                'photo': None,
+                'images': {},
 
             },
             {
@@ -262,7 +483,106 @@ class SerializerTestCase(TestCase):
                 'tags': [],
                 'is_published': 1,
                 'count_likes': 3,
-                'rating': '4.00'
+                'rating': '4.00',
+                'photo': None,
+                'images': {},
             },
         ]
         self.assertEqual(expected_data, data)
+
+
+class ConditionalGetApiTestCase(APITestCase):
+    """Тест условных GET списка и объекта через API"""
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        cache.clear()
+        self.user = get_user_model().objects.create(username='test_username')
+        self.c_1 = Category.objects.create(name='cat1')
+        self.b_1 = Bike.published.create(title='post1', content='cont1', cat_id=self.c_1.id)
+
+    def test_list_not_modified(self):
+        """Тест ответа 304 для списка и нового ETag после добавления поста"""
+
+        path = reverse('bike-list')
+        etag = self.client.get(path)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(HTTPStatus.NOT_MODIFIED, response.status_code)
+
+        Bike.published.create(title='post2', content='cont2', cat_id=self.c_1.id)
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(HTTPStatus.OK, response.status_code)
+        self.assertEqual(2, len(response.data['results']))
+
+    def test_retrieve_not_modified(self):
+        """Тест ответа 304 для объекта одним запросом и нового ETag после изменения счетчиков"""
+
+        path = reverse('bike-detail', args=(self.b_1.id,))
+        etag = self.client.get(path)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(HTTPStatus.NOT_MODIFIED, response.status_code)
+
+        UserPostRelation.objects.toggle_like(self.user.pk, self.b_1.pk)
+        self.assertEqual(HTTPStatus.OK, self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code)
+        self.assertEqual(HTTPStatus.NOT_FOUND, self.client.get(reverse('bike-detail', args=(0,))).status_code)
+
+
+class AsyncUrls:
+    """Адреса сайта с асинхронными представлениями API, как при ASYNC_VIEWS под ASGI"""
+
+    urlpatterns = [path('api/', include(async_urlpatterns))] + site_urls.urlpatterns
+
+
+class AsyncReadTestCase(APITestCase):
+    """Тест асинхронного чтения списка и поста API"""
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        cache.clear()
+        self.c_1 = Category.objects.create(name='cat1')
+        self.posts = [Bike.published.create(title=f'post{i}', content='cont', cat=self.c_1) for i in range(3)]
+        self.posts[0].tags.add(Tags.objects.create(tag='tag1'))
+        self.factory = AsyncRequestFactory()
+
+    async def test_same_as_viewset(self):
+        """Тест совпадения ответа и ETag с BikesViewSet и ответа 304"""
+
+        for view, path, params, kwargs in (
+                (bike_list, reverse('bike-list'), {'page_size': 2, 'fields': 'title,tags,rating'}, {}),
+                (bike_detail, reverse('bike-detail', args=(self.posts[0].pk,)), {}, {'pk': str(self.posts[0].pk)})):
+            response = await view(self.factory.get(path, params), **kwargs)
+            expected = await sync_to_async(self.client.get)(path, params)
+            self.assertEqual(expected.json(), orjson.loads(response.content))
+            self.assertEqual(expected['ETag'], response['ETag'])
+
+            response = await view(self.factory.get(path, params, headers={'If-None-Match': response['ETag']}), **kwargs)
+            self.assertEqual(HTTPStatus.NOT_MODIFIED, response.status_code)
+
+    async def test_delegates_to_viewset(self):
+        """Тест обработки фильтров, ошибок и записи синхронным BikesViewSet"""
+
+        response = await bike_list(self.factory.get(reverse('bike-list'), {'title': 'post1'}))
+        self.assertEqual(['post1'], [post['title'] for post in response.data['results']])
+        response = await bike_list(self.factory.get(reverse('bike-list'), {'fields': 'password'}))
+        self.assertEqual(HTTPStatus.BAD_REQUEST, response.status_code)
+        response = await bike_detail(self.factory.get('/api/v1/bikes/0/'), pk='0')
+        self.assertEqual(HTTPStatus.NOT_FOUND, response.status_code)
+
+    @override_settings(ROOT_URLCONF=AsyncUrls)
+    def test_token_write(self):
+        """Тест записи с токеном через асинхронные адреса: CsrfViewMiddleware не проверяет запросы API"""
+
+        user = get_user_model().objects.create(username='test_username')
+        client = Client(enforce_csrf_checks=True, headers={'Authorization': f'Token {Token.objects.create(user=user)}'})
+        data = {'title': 'post3', 'content': 'cont3', 'cat': self.c_1.pk}
+        response = client.post(reverse('bike-list'), data, content_type='application/json')
+        self.assertEqual(HTTPStatus.CREATED, response.status_code)
+
+        path = reverse('bike-detail', args=(Bike.objects.get(title='post3').pk,))
+        response = client.patch(path, {'content': 'cont4'}, content_type='application/json')
+        self.assertEqual(HTTPStatus.OK, response.status_code)
+        self.assertEqual(HTTPStatus.NO_CONTENT, client.delete(path).status_code)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import include, path, re_path
 from drf_spectacular.views import (SpectacularAPIView, SpectacularRedocView,
                                    SpectacularSwaggerView)
@@ -5,6 +6,7 @@ from rest_framework import routers
 from rest_framework_simplejwt.views import (TokenObtainPairView,
                                             TokenRefreshView, TokenVerifyView)
 
+from . import async_views
 from .views import *
 
 router = routers.SimpleRouter()
@@ -14,6 +16,7 @@ router.register(r'bikes', BikesViewSet)
 urlpatterns = [
     path('v1/', include(router.urls)),
 
+    path('v1/export/<str:kind>/', ExportView.as_view(), name='export'),
     path('v1/drf-auth/', include('rest_framework.urls')),
     path('v1/auth/', include('djoser.urls')),
     re_path(r'^auth/', include('djoser.urls.authtoken')),
@@ -25,3 +28,12 @@ urlpatterns = [
     path("v1/schema/swagger-ui/", SpectacularSwaggerView.as_view(url_name="schema"), name="swagger-ui"),
 
 ]
+
+# под ASGI чтение списка и поста без фильтров обслуживают асинхронные представления, остальное - BikesViewSet
+async_urlpatterns = [
+    path('v1/bikes/', async_views.bike_list, name='bike-list'),
+    re_path(r'^v1/bikes/(?P<pk>\d+)/$', async_views.bike_detail, name='bike-detail'),
+]
+
+if settings.ASYNC_VIEWS:
+    urlpatterns = async_urlpatterns + urlpatterns
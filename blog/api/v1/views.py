@@ -1,30 +1,107 @@
-from django.db.models import Avg, Count, Q
+from http import HTTPStatus
+
+from django.conf import settings
+from django.http import Http404, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets
 from rest_framework.decorators import action
-from rest_framework.filters import OrderingFilter, SearchFilter
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
 from rest_framework.mixins import UpdateModelMixin
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet
 
+from bike_app.bulk import save_posts, save_relations
+from bike_app.conditional import ConditionalGetMixin
+from bike_app.export import (FORMATS, POST_COLUMNS, RELATION_COLUMNS,
+                             export_posts, export_relations, parse_since, render_export)
 from bike_app.models import *
+from bike_app.search import search_posts
+from bike_blog.query_budget import query_budget
 
+from .filters import FullTextSearchFilter
+from .pagination import KeysetPagination
 from .permissions import IsOwnerOrAdminOrReadOnly
-from .serializers import BikesSerializer, UserPostRelationSerializer
+from .serializers import (BikeBulkItemSerializer, BikeRowSerializer, BikesSerializer,
+                          RelationBulkItemSerializer, UserPostRelationSerializer)
+
+
+class RowReadMixin:
+    """Чтение списка и объекта из строк values() через BikeRowSerializer вместо экземпляров модели"""
+
+    row_serializer_class = BikeRowSerializer
+    fields_query_param = 'fields'
+
+    def get_row_serializer(self) -> BikeRowSerializer:
+        return self.row_serializer_class(self.request, self.request.query_params.get(self.fields_query_param))
+
+    def list(self, request, *args, **kwargs) -> Response:
+        serializer = self.get_row_serializer()
+        queryset = serializer.select(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.serialize(page))
+        return Response(serializer.serialize(queryset))
+
+    def retrieve(self, request, *args, **kwargs) -> Response:
+        serializer = self.get_row_serializer()
+        queryset = serializer.select(self.filter_queryset(self.get_queryset()))
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            row = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]}).first()
+        except (TypeError, ValueError):
+            raise Http404
+        if row is None:
+            raise Http404
+        self.check_object_permissions(request, row)
+        return Response(serializer.serialize([row])[0])
+
+
+class BulkMixin:
+    """Пакетная запись: проверка каждого элемента списка и ответ с результатом по каждому элементу"""
+
+    def validate_items(self, serializer_class, limit: int) -> tuple:
+        """Проверенные элементы (None для ошибочных) и ошибки проверки по индексам"""
+
+        data = self.request.data
+        if not isinstance(data, list):
+            raise ValidationError('Ожидается список объектов')
+        if not 0 < len(data) <= limit:
+            raise ValidationError(f'В пакете должно быть от 1 до {limit} объектов')
+        items, errors = [], {}
+        for index, item in enumerate(data):
+            serializer = serializer_class(data=item)
+            if serializer.is_valid():
+                items.append(serializer.validated_data)
+            else:
+                items.append(None)
+                errors[index] = serializer.errors
+        return items, errors
+
+    def bulk_response(self, results: list, errors: dict) -> Response:
+        """200, если записан хотя бы один элемент, иначе 400"""
+
+        results = [{'status': 'error', 'errors': errors[index]} if index in errors else result
+                   for index, result in enumerate(results)]
+        written = any(result['status'] != 'error' for result in results)
+        return Response({'results': results}, status=HTTPStatus.OK if written else HTTPStatus.BAD_REQUEST)
 
 
-class BikesViewSet(viewsets.ModelViewSet):
+@query_budget('bike-list', 4)
+@query_budget('bike-detail', 5)
+@query_budget('bike-search', 6)
+@query_budget('bike-tags', 3)
+class BikesViewSet(ConditionalGetMixin, RowReadMixin, BulkMixin, viewsets.ModelViewSet):
     """Представление для работы с объектами Bike"""
 
-    queryset = Bike.objects.all().annotate(
-        count_likes=Count('userpostrelation', filter=Q(userpostrelation__like=True)),
-        rating=Avg('userpostrelation__rate')).select_related('cat').order_by('-created')
+    queryset = Bike.objects.all().with_counters().select_related('cat').prefetch_related('tags').order_by('-created')
     serializer_class = BikesSerializer
     permission_classes = (IsOwnerOrAdminOrReadOnly,)
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    pagination_class = KeysetPagination
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, OrderingFilter]
     filterset_fields = ['title']
-    search_fields = ['$title', '$content', '$cat__name']
     ordering_fields = ['created', 'modified']
 
     @action(methods=['get'], detail=True)
@@ -34,8 +111,26 @@ class BikesViewSet(viewsets.ModelViewSet):
         tag = Tags.objects.get(pk=pk)
         return Response({'tag': tag.tag})
 
+    @action(methods=['get'], detail=False)
+    def search(self, request) -> Response:
+        """Полнотекстовый поиск по постам с сортировкой по релевантности, строки - как в list()"""
 
-class UserPostRelationView(UpdateModelMixin, GenericViewSet):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response([])
+        serializer = self.get_row_serializer()
+        rows = serializer.select(search_posts(self.get_queryset(), query))[:settings.SEARCH_RESULTS_LIMIT]
+        return Response(serializer.serialize(rows))
+
+    @action(methods=['post'], detail=False)
+    def bulk(self, request) -> Response:
+        """Создание (элементы без id) и изменение (с id) списка постов одной транзакцией"""
+
+        items, errors = self.validate_items(BikeBulkItemSerializer, settings.BULK_MAX_POSTS)
+        return self.bulk_response(save_posts(items, request.user), errors)
+
+
+class UserPostRelationView(BulkMixin, UpdateModelMixin, GenericViewSet):
     """Представление для работы с отношениями пользователя к постам"""
 
     queryset = UserPostRelation.objects.all()
@@ -44,8 +139,50 @@ class UserPostRelationView(UpdateModelMixin, GenericViewSet):
     lookup_field = 'bike_id'
 
     def get_object(self) -> UserPostRelation:
-        """Получает или создает объект UserPostRelation для текущего пользователя и указанного поста"""
+        """Объект UserPostRelation текущего пользователя для указанного поста, несохраненный, если оценки еще нет"""
+
+        obj = UserPostRelation.objects.filter(auth_user=self.request.user, bike_id=self.kwargs['bike_id']).first()
+        return obj or UserPostRelation(auth_user=self.request.user, bike_id=self.kwargs['bike_id'])
+
+    def perform_update(self, serializer) -> None:
+        """Запись лайка и оценки одной атомарной командой вместо чтения и сохранения объекта"""
+
+        data = serializer.validated_data
+        values = {name: data[name] for name in ('like', 'rate') if name in data}
+        relation = serializer.instance
+        relation.like, relation.rate = UserPostRelation.objects.set_relation(
+            self.request.user.pk, self.kwargs['bike_id'], **values)
+
+    @action(methods=['post'], detail=False)
+    def bulk(self, request) -> Response:
+        """Лайки и оценки текущего пользователя для списка постов одной транзакцией"""
+
+        items, errors = self.validate_items(RelationBulkItemSerializer, settings.BULK_MAX_RELATIONS)
+        return self.bulk_response(save_relations(request.user.pk, items), errors)
+
+
+class ExportView(APIView):
+    """
+    Потоковая выгрузка постов или оценок для хранилища аналитики: ?output=ndjson|csv,
+    для постов ?since=<changed> - только измененные (вместе со счетчиками) с этого момента включительно.
+    """
+
+    permission_classes = (IsAdminUser,)
 
-        obj, _ = UserPostRelation.objects.get_or_create(auth_user=self.request.user,
-                                                        bike_id=self.kwargs['bike_id'])
-        return obj
+    def get(self, request, kind: str) -> StreamingHttpResponse:
+        output = request.query_params.get('output', 'ndjson')
+        if output not in FORMATS:
+            raise ValidationError({'output': f"Доступные форматы: {', '.join(FORMATS)}"})
+        since = request.query_params.get('since')
+        if kind == 'posts':
+            try:
+                rows, columns = export_posts(parse_since(since) if since else None), POST_COLUMNS
+            except ValueError:
+                raise ValidationError({'since': 'Ожидается дата и время в формате ISO 8601'})
+        elif kind == 'relations':
+            rows, columns = export_relations(), RELATION_COLUMNS
+        else:
+            raise Http404
+        response = StreamingHttpResponse(render_export(rows, columns, output), content_type=FORMATS[output])
+        response['Content-Disposition'] = f'attachment; filename="{kind}.{output}"'
+        return response
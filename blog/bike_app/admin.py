@@ -3,6 +3,9 @@ from django.contrib.auth.admin import UserAdmin
 from django.db.models.functions import Length
 from django.utils.safestring import mark_safe
 
+from bike_blog.images import variant_urls
+
+from .caching import bump_list_generation, invalidate_sidebar_counts
 from .models import *
 
 
@@ -23,7 +26,8 @@ class BikeAdmin(admin.ModelAdmin):
     @admin.display(description='Изображение', ordering='')
     def post_photo(self, bike: Bike):
         if bike.photo:
-            return mark_safe(f"<img src='{bike.photo.url}' width=50>")
+            card = variant_urls(bike.photo, bike.photo_variants).get('card')
+            return mark_safe(f"<img src='{card[0]['jpeg'] if card else bike.photo.url}' width=50>")
         return 'Нет фото'
 
     def get_queryset(self, request):
@@ -37,11 +41,15 @@ class BikeAdmin(admin.ModelAdmin):
     @admin.action(description="Опубликовать")
     def set_published(self, request, queryset):
         count = queryset.update(is_published=Bike.Status.PUBLISHED)
+        invalidate_sidebar_counts()
+        bump_list_generation()
         self.message_user(request, f"Изменено {count} записи(ей).")
 
     @admin.action(description="Снять с публикации")
     def set_unpublished(self, request, queryset):
         count = queryset.update(is_published=Bike.Status.DRAFT)
+        invalidate_sidebar_counts()
+        bump_list_generation()
         self.message_user(request, f"{count} записи(ей) сняты с публикации!", messages.WARNING)
 
 
@@ -56,6 +64,13 @@ class TagsAdmin(admin.ModelAdmin):
     prepopulated_fields = {"slug": ("tag",)}
 
 
+class SlugRedirectAdmin(admin.ModelAdmin):
+    list_display = ('old_slug', 'bike', 'created')
+    search_fields = ('old_slug', 'bike__title')
+    raw_id_fields = ('bike',)
+
+
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(Tags, TagsAdmin)
 admin.site.register(UserPostRelation)
+admin.site.register(SlugRedirect, SlugRedirectAdmin)
@@ -1,7 +1,16 @@
 from django.apps import AppConfig
+from django.db.models.signals import m2m_changed, post_migrate
 
 
 class Bike_AppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "bike_app"
     verbose_name = 'Веломир'
+
+    def ready(self):
+        from bike_app.models import Bike
+        from bike_app.search import create_postgres_index
+        from bike_app.signals import post_tags_changed
+
+        post_migrate.connect(create_postgres_index, sender=self)
+        m2m_changed.connect(post_tags_changed, sender=Bike.tags.through)
@@ -0,0 +1,140 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404, HttpResponseRedirect
+from django.shortcuts import redirect, render
+from django.utils.cache import get_conditional_response
+
+from .caching import aget_list_page
+from .conditional import list_etag, post_etag
+from .likes import is_buffered, toggle_like_buffered
+from .models import Bike, Category, Tags, UserPostRelation
+from .pagination import InvalidCursor, KeysetPaginator, decode_cursor
+from .slugs import resolve_slug
+from .utils import DataMixin, mark_liked
+from .views import BikeCategory, BikeTags, Home, ShowPost
+
+
+async def aget_user(request):
+    """request.user под ASGI: сессия и пользователь загружаются в потоке, дальше объект уже в памяти"""
+
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+async def aconditional(request, etag_func, view, **kwargs):
+    """condition(etag_func=...) для корутин: 304 при совпадении If-None-Match, иначе ответ view с ETag"""
+
+    etag = await sync_to_async(etag_func)(request, **kwargs)
+    if etag is not None:
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            return response
+    response = await view(request, **kwargs)
+    if etag is not None and request.method in ('GET', 'HEAD'):
+        response.headers.setdefault('ETag', etag)
+    return response
+
+
+async def _resolve(kind: str, slug: str):
+    match = await sync_to_async(resolve_slug)(kind, slug)
+    if match.pk is None:
+        raise Http404('Страница не найдена')
+    return match
+
+
+async def _post_list(request, list_name: str, queryset, slug: str = '', allow_empty: bool = True, **context):
+    """Страница списка постов, как в DataMixin: общий кэш страниц, лайки пользователя поверх"""
+
+    cursor = request.GET.get(DataMixin.cursor_kwarg) or ''
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except InvalidCursor:
+            raise Http404('Неверный курсор страницы')
+    paginator = KeysetPaginator(queryset, DataMixin.paginate_by, with_total=True)
+    page = await aget_list_page(list_name, slug, cursor, lambda: paginator.apage(cursor))
+    if not page.object_list and not allow_empty:
+        raise Http404('Страница не найдена')
+
+    user = await aget_user(request)
+    if user.is_authenticated:
+        await sync_to_async(mark_liked)(user, page.object_list)
+    context.update(DataMixin.extra_context, posts=page.object_list, object_list=page.object_list, page_obj=page,
+                   paginator=paginator, is_paginated=page.has_other_pages())
+    return await sync_to_async(render)(request, Home.template_name, context)
+
+
+async def home(request):
+    """Асинхронная главная страница"""
+
+    async def view(request):
+        return await _post_list(request, 'home', Home().get_queryset(), title='Главная страница', cat_selected=0)
+
+    return await aconditional(request, list_etag('home'), view)
+
+
+async def category(request, cat_slug: str):
+    """Асинхронная страница постов категории"""
+
+    match = await _resolve('category', cat_slug)
+
+    async def view(request, cat_slug):
+        cat = await Category.objects.aget(pk=match.pk)
+        return await _post_list(request, 'category', BikeCategory(slug_pk=match.pk).get_queryset(), cat_slug,
+                                allow_empty=BikeCategory.allow_empty, title='Категория - ' + cat.name,
+                                cat_selected=cat.id)
+
+    return await aconditional(request, list_etag('category', 'category', 'cat_slug'), view, cat_slug=cat_slug)
+
+
+async def tag(request, tag_slug: str):
+    """Асинхронная страница постов тега"""
+
+    match = await _resolve('tag', tag_slug)
+
+    async def view(request, tag_slug):
+        t_obj = await Tags.objects.aget(pk=match.pk)
+        return await _post_list(request, 'tag', BikeTags(slug_pk=match.pk).get_queryset(), tag_slug,
+                                title='Тег: ' + t_obj.tag, cat_selected=None)
+
+    return await aconditional(request, list_etag('tag', 'tag', 'tag_slug'), view, tag_slug=tag_slug)
+
+
+async def show_post(request, slug: str):
+    """Асинхронная страница поста. Оценка поста (POST) обрабатывается синхронным ShowPost"""
+
+    if request.method not in ('GET', 'HEAD'):
+        return await sync_to_async(ShowPost.as_view())(request, slug=slug)
+    match = await _resolve('post', slug)
+    if match.redirect_to is not None:
+        return redirect('post', permanent=True, slug=match.redirect_to)
+
+    async def view(request, slug):
+        try:
+            post = await Bike.published.select_related('cat').aget(pk=match.pk)
+        except Bike.DoesNotExist:
+            raise Http404('Страница не найдена')
+        user = await aget_user(request)
+        rate = None
+        if user.is_authenticated:
+            rate = await UserPostRelation.objects.filter(
+                auth_user=user, bike=post).values_list('rate', flat=True).afirst()
+        context = {'post': post, 'object': post, 'title': post, 'default_img': settings.DEFAULT_POST_IMAGE,
+                   'rate_form': ShowPost.form_class(initial={'rate': rate})}
+        return await sync_to_async(render)(request, ShowPost.template_name, context)
+
+    return await aconditional(request, post_etag, view, slug=slug)
+
+
+async def reader_like(request, pk: int) -> HttpResponseRedirect:
+    """Асинхронный лайк: запрос ждет базу или Redis, не занимая поток воркера"""
+
+    user = await aget_user(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    if is_buffered():
+        await sync_to_async(toggle_like_buffered)(user, pk)
+    else:
+        await sync_to_async(UserPostRelation.objects.toggle_like)(user.pk, pk)
+    return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
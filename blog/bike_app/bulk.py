@@ -0,0 +1,287 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.template.defaultfilters import slugify
+from django.utils import timezone
+from unidecode import unidecode
+
+from bike_app.caching import bump_list_generation, change_liked_set, invalidate_sidebar_counts
+from bike_app.search import index_posts
+from bike_app.slugs import bump_slug_generation
+from bike_blog.metrics import observe_relation_write
+
+POST_FIELDS = ('title', 'content', 'cat', 'is_published')
+
+
+def post_slug(title: str) -> str:
+    """slug поста по заголовку, как в Bike.save, не длиннее поля (транслитерация кириллицы удлиняет заголовок)"""
+
+    return slugify(unidecode(title))[:255].rstrip('-')
+
+
+def _error(**errors) -> dict:
+    return {'status': 'error', 'errors': errors}
+
+
+def save_posts(items: list, user) -> list:
+    """
+    Создание и изменение постов пачкой в одной транзакции: bulk_create/bulk_update, теги одной вставкой,
+    поисковый индекс одним запросом и одна инвалидация кэшей на пачку.
+    items - проверенные словари полей (None - элемент, не прошедший проверку), элемент с id изменяет пост.
+    Возвращает результат по каждому элементу: {'status': 'created'/'updated', 'id', 'slug'} или ошибки.
+    """
+
+    from bike_app.models import Bike, Category, SlugRedirect, Tags
+
+    results = [None] * len(items)
+    with transaction.atomic():
+        existing = Bike.objects.select_for_update().in_bulk([item['id'] for item in items if item and 'id' in item])
+        cat_ids = set(Category.objects.filter(
+            pk__in={item['cat'] for item in items if item and 'cat' in item}).values_list('pk', flat=True))
+        tag_ids = set(Tags.objects.filter(
+            pk__in={tag for item in items if item for tag in item.get('tags', ())}).values_list('pk', flat=True))
+
+        slugs = {}
+        for index, item in enumerate(items):
+            if item is None:
+                continue
+            post = existing.get(item['id']) if 'id' in item else None
+            if 'id' in item and post is None:
+                results[index] = _error(id='Пост не найден')
+            elif post is not None and post.auth_user_id != user.pk and not user.is_staff:
+                results[index] = _error(id='Изменять пост может только автор или администратор')
+            elif 'cat' in item and item['cat'] not in cat_ids:
+                results[index] = _error(cat='Категория не найдена')
+            elif set(item.get('tags', ())) - tag_ids:
+                results[index] = _error(tags=f"Теги не найдены: {sorted(set(item['tags']) - tag_ids)}")
+            elif 'title' in item:
+                slug = post_slug(item['title'])
+                if not slug or slug in slugs:
+                    results[index] = _error(title='Заголовок пуст или повторяется в пакете')
+                else:
+                    slugs[slug] = index
+
+        # заголовки, занятые постами вне пакета
+        for pk, slug in Bike.objects.filter(slug__in=slugs).values_list('pk', 'slug'):
+            index = slugs[slug]
+            if items[index].get('id') != pk:
+                results[index] = _error(title='Пост с таким заголовком уже существует')
+                del slugs[slug]
+
+        now = timezone.now()
+        created, updated, written, retagged, redirects = [], [], {}, [], {}
+        for index, item in enumerate(items):
+            if item is None or results[index] is not None:
+                continue
+            values = {('cat_id' if name == 'cat' else name): item[name] for name in POST_FIELDS if name in item}
+            if 'id' in item:
+                post = existing[item['id']]
+                for name, value in values.items():
+                    setattr(post, name, value)
+                post.modified = now
+                updated.append(post)
+                written[index] = ('updated', post)
+            else:
+                post = Bike(auth_user=user, **values)
+                created.append(post)
+                written[index] = ('created', post)
+            old_slug = post.slug
+            post.slug = post_slug(post.title)
+            if old_slug and old_slug != post.slug:
+                redirects[old_slug] = post
+            if 'tags' in item:
+                retagged.append((post, item['tags']))
+
+        Bike.objects.bulk_create(created, batch_size=500)
+        Bike.objects.bulk_update(updated, ['title', 'slug', 'content', 'cat', 'is_published', 'modified'],
+                                 batch_size=500)
+
+        through = Bike.tags.through
+        through.objects.filter(bike_id__in=[post.pk for post, _ in retagged]).delete()
+        through.objects.bulk_create([through(bike_id=post.pk, tags_id=tag_id)
+                                     for post, tags in retagged for tag_id in set(tags)], batch_size=1000)
+
+        # как в Bike.save: старый адрес ведет на новый, новый slug не может быть чужим редиректом
+        SlugRedirect.objects.filter(old_slug__in=[post.slug for post in created + updated]).delete()
+        SlugRedirect.objects.bulk_create([SlugRedirect(old_slug=slug, bike=post) for slug, post in redirects.items()],
+                                         update_conflicts=True, unique_fields=['old_slug'], update_fields=['bike'])
+        index_posts(created + updated)
+
+    if created or updated:
+        invalidate_sidebar_counts()
+        bump_list_generation()
+        bump_slug_generation('post')
+    for index, (status, post) in written.items():
+        results[index] = {'status': status, 'id': post.pk, 'slug': post.slug}
+    return results
+
+
+def save_relations(user_id: int, items: list) -> list:
+    """
+    Лайки и оценки пользователя для списка постов в одной транзакции: недостающие отношения вставляются пустыми
+    (INSERT ... ON CONFLICT DO NOTHING), затем все изменяются под блокировкой строк - bulk_update,
+    счетчики постов - одним UPDATE на каждое различающееся изменение.
+    items - проверенные словари {'bike', 'like'?, 'rate'?} (None - элемент, не прошедший проверку).
+    Возвращает результат по каждому элементу: {'status': 'ok', 'bike', 'like', 'rate'} или ошибки.
+    """
+
+    from bike_app.models import Bike, UserPostRelation
+
+    results = [None] * len(items)
+    requested = [item['bike'] for item in items if item]
+    with transaction.atomic():
+        bike_ids = set(Bike.objects.filter(pk__in=requested).values_list('pk', flat=True))
+        # пустая строка не входит в счетчики; разница считается от заблокированной строки, даже если
+        # параллельный запрос вставил ее после нашего чтения
+        UserPostRelation.objects.bulk_create([UserPostRelation(auth_user_id=user_id, bike_id=bike_id)
+                                              for bike_id in bike_ids], batch_size=500, ignore_conflicts=True)
+        existing = {relation.bike_id: relation for relation in UserPostRelation.objects.select_for_update().filter(
+            auth_user_id=user_id, bike_id__in=bike_ids)}
+
+        seen, to_update = set(), []
+        deltas, likes = defaultdict(list), defaultdict(list)
+        for index, item in enumerate(items):
+            if item is None:
+                continue
+            bike_id = item['bike']
+            if bike_id not in bike_ids:
+                results[index] = _error(bike='Пост не найден')
+                continue
+            if bike_id in seen:
+                results[index] = _error(bike='Пост повторяется в пакете')
+                continue
+            seen.add(bike_id)
+
+            relation = existing[bike_id]
+            to_update.append(relation)
+            old = UserPostRelation._counter_values(relation.like, relation.rate)
+            relation.like = item.get('like', relation.like)
+            relation.rate = item.get('rate', relation.rate)
+            new = UserPostRelation._counter_values(relation.like, relation.rate)
+            delta = tuple((name, new[name] - old[name]) for name in new)
+            if any(value for _, value in delta):
+                deltas[delta].append(bike_id)
+            if old['like_count'] != new['like_count']:
+                likes['liked' if relation.like else 'unliked'].append(bike_id)
+            results[index] = {'status': 'ok', 'bike': bike_id, 'like': relation.like, 'rate': relation.rate}
+
+        UserPostRelation.objects.bulk_update(to_update, ['like', 'rate'], batch_size=500)
+        for delta, bikes in deltas.items():
+            Bike.objects.filter(pk__in=bikes).add_to_counters(**dict(delta))
+
+    if seen:
+        change_liked_set(user_id, **likes)
+        bump_list_generation()
+        written = [item for item, result in zip(items, results) if item and result['status'] == 'ok']
+        for kind in ('like', 'rate'):
+            observe_relation_write(kind, 'bulk', sum(kind in item for item in written))
+    return results
+
+
+class PostImporter:
+    """
+    Импорт постов из внешнего архива пачками: slug и заголовки без обращений к базе по занятым множествам,
+    категории и теги - по словарям slug -> id с созданием недостающих одной вставкой, посты и связи с тегами -
+    bulk_create. Кэши сбрасываются один раз в finish().
+    """
+
+    def __init__(self, user=None, on_conflict: str = 'rename'):
+        from bike_app.models import Bike, Category, SlugRedirect, Tags
+
+        self.user = user
+        self.on_conflict = on_conflict
+        self.taken_slugs = set(Bike.objects.order_by().values_list('slug', flat=True)) \
+            | set(SlugRedirect.objects.values_list('old_slug', flat=True))
+        self.taken_titles = set(Bike.objects.order_by().values_list('title', flat=True))
+        self.categories = dict(Category.objects.order_by().values_list('slug', 'pk'))
+        self.tags = dict(Tags.objects.values_list('slug', 'pk'))
+        self.created = self.skipped = 0
+        self.errors = []
+
+    def unique_title(self, title: str):
+        """Свободные заголовок и slug: при совпадении - с номером ('Пост (2)', post-2) или None для пропуска"""
+
+        title = title.strip()[:255]
+        slug = post_slug(title) or 'post'
+        if slug not in self.taken_slugs and title not in self.taken_titles:
+            return title, slug
+        if self.on_conflict == 'skip':
+            return None
+
+        def numbered(number: int) -> tuple:
+            # номер не должен выходить за длину полей: обрезается основа, а не суффикс
+            suffix = f' ({number})'
+            return (f'{title[:255 - len(suffix)].rstrip()}{suffix}',
+                    f"{slug[:254 - len(str(number))].rstrip('-')}-{number}")
+
+        number = 2
+        while numbered(number)[0] in self.taken_titles or numbered(number)[1] in self.taken_slugs:
+            number += 1
+        return numbered(number)
+
+    def resolve(self, model, known: dict, name_field: str, names) -> dict:
+        """id по slug названий, недостающие объекты создаются одной вставкой"""
+
+        missing = {}
+        for name in names:
+            slug = post_slug(name)
+            if slug and slug not in known:
+                missing.setdefault(slug, name)
+        if missing:
+            model.objects.bulk_create([model(slug=slug, **{name_field: name[:100]}) for slug, name in missing.items()],
+                                      ignore_conflicts=True)
+            known.update(model.objects.filter(slug__in=missing).values_list('slug', 'pk'))
+        return known
+
+    def import_batch(self, rows: list) -> int:
+        """
+        Запись пачки строк {'title', 'cat', 'content'?, 'tags'?, 'is_published'?, 'created'?, 'photo'?}
+        одной транзакцией. Возвращает количество созданных постов.
+        """
+
+        from bike_app.models import Bike, Category, Tags
+
+        posts, tags, created = [], [], []
+        with transaction.atomic():
+            self.resolve(Category, self.categories, 'name', (row['cat'] for row in rows if row.get('cat')))
+            self.resolve(Tags, self.tags, 'tag', (tag for row in rows for tag in row.get('tags') or ()))
+            for row in rows:
+                if not row.get('title') or not row.get('cat'):
+                    self.errors.append(f"{row.get('title') or '<без заголовка>'}: нужны title и cat")
+                    continue
+                unique = self.unique_title(row['title'])
+                if unique is None:
+                    self.skipped += 1
+                    continue
+                title, slug = unique
+                self.taken_slugs.add(slug)
+                self.taken_titles.add(title)
+                post = Bike(title=title, slug=slug, content=row.get('content') or '', auth_user=self.user,
+                            cat_id=self.categories[post_slug(row['cat'])], photo=row.get('photo') or '',
+                            is_published=row.get('is_published', Bike.Status.PUBLISHED))
+                posts.append(post)
+                tags.append({self.tags[post_slug(tag)] for tag in row.get('tags') or () if post_slug(tag)})
+                created.append(row.get('created'))
+
+            Bike.objects.bulk_create(posts, batch_size=1000)
+            through = Bike.tags.through
+            through.objects.bulk_create([through(bike_id=post.pk, tags_id=tag_id)
+                                         for post, tag_ids in zip(posts, tags) for tag_id in tag_ids], batch_size=1000)
+            # created заполняется при вставке текущим временем, даты из архива записываются отдельно
+            dated = []
+            for post, value in zip(posts, created):
+                if value:
+                    post.created = value
+                    dated.append(post)
+            Bike.objects.bulk_update(dated, ['created'], batch_size=1000)
+            index_posts(posts)
+        self.created += len(posts)
+        return len(posts)
+
+    def finish(self) -> None:
+        """Один сброс кэшей списков, боковой панели и реестров slug после импорта"""
+
+        invalidate_sidebar_counts()
+        bump_list_generation()
+        for kind in ('post', 'category', 'tag'):
+            bump_slug_generation(kind)
@@ -0,0 +1,234 @@
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+from django.db import transaction
+from django.db.models import Count, Q
+from redis.exceptions import WatchError
+
+from bike_blog.db_router import primary_reads
+from bike_blog.metrics import observe_list_cache
+
+LIST_GENERATION_KEY = 'bike_list_generation'
+SIDEBAR_COUNTS_KEY = 'sidebar_counts'
+SIDEBAR_VERSION_KEY = 'sidebar_version'
+# служебный элемент множества лайков в Redis: полнота множества; без него множество считается отсутствующим
+LIKED_SET_COMPLETE, LIKED_SET_PARTIAL = b'complete', b'partial'
+
+
+def redis_client():
+    """Клиент Redis кэша по умолчанию или None для остальных бэкендов"""
+
+    backend = caches['default']
+    if isinstance(backend, RedisCache):
+        return backend._cache.get_client(write=True)
+    return None
+
+
+def get_list_generation() -> int:
+    """Текущее поколение кэша списков постов"""
+
+    generation = cache.get(LIST_GENERATION_KEY)
+    if generation is None:
+        # начинаем с метки времени, чтобы после вытеснения ключа не попасть на старые записи
+        cache.add(LIST_GENERATION_KEY, int(time.time() * 1000), timeout=None)
+        generation = cache.get(LIST_GENERATION_KEY)
+    return generation
+
+
+def bump_list_generation() -> None:
+    """Инвалидация всех закэшированных страниц списков сменой поколения"""
+
+    try:
+        cache.incr(LIST_GENERATION_KEY)
+    except ValueError:
+        get_list_generation()
+
+
+def list_page_key(list_name: str, slug: str, page, generation: int = None) -> str:
+    return f'bike_list:{generation or get_list_generation()}:{list_name}:{slug}:{page}'
+
+
+def get_list_page(list_name: str, slug: str, page, build):
+    """
+    Возвращает материализованную страницу списка из кэша.
+    build() вызывается при промахе и должен вернуть сериализуемые данные страницы без привязки к пользователю.
+    """
+
+    key = list_page_key(list_name, slug, page)
+    data = cache.get(key)
+    observe_list_cache(list_name, data is not None)
+    if data is None:
+        with primary_reads():
+            data = build()
+        cache.set(key, data, timeout=settings.BIKE_LIST_CACHE_TIMEOUT)
+    return data
+
+
+async def aget_list_generation() -> int:
+    generation = await cache.aget(LIST_GENERATION_KEY)
+    if generation is None:
+        await cache.aadd(LIST_GENERATION_KEY, int(time.time() * 1000), timeout=None)
+        generation = await cache.aget(LIST_GENERATION_KEY)
+    return generation
+
+
+async def aget_list_page(list_name: str, slug: str, page, build):
+    """get_list_page для асинхронных представлений: build - корутина, строящая страницу при промахе"""
+
+    key = list_page_key(list_name, slug, page, generation=await aget_list_generation())
+    data = await cache.aget(key)
+    observe_list_cache(list_name, data is not None)
+    if data is None:
+        with primary_reads():
+            data = await build()
+        await cache.aset(key, data, timeout=settings.BIKE_LIST_CACHE_TIMEOUT)
+    return data
+
+
+def get_sidebar_counts() -> dict:
+    """
+    Категории и теги с количеством опубликованных постов для боковой панели.
+    Пересчитываются только после инвалидации при изменении постов, категорий или тегов.
+    """
+
+    from bike_app.models import Bike, Category, Tags
+
+    counts = cache.get(SIDEBAR_COUNTS_KEY)
+    if counts is None:
+        published = Q(posts__is_published=Bike.Status.PUBLISHED)
+        with primary_reads():
+            counts = {
+                'categories': list(Category.objects.annotate(amount=Count('posts', filter=published))
+                                   .filter(amount__gt=0)),
+                'tags': list(Tags.objects.annotate(amount=Count('posts', filter=published)).filter(amount__gt=0)),
+            }
+        cache.set(SIDEBAR_COUNTS_KEY, counts, timeout=settings.SIDEBAR_CACHE_TIMEOUT)
+    return counts
+
+
+def get_sidebar_version() -> int:
+    """Версия боковой панели для ETag страниц, меняется при каждой инвалидации счетчиков"""
+
+    version = cache.get(SIDEBAR_VERSION_KEY)
+    if version is None:
+        cache.add(SIDEBAR_VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(SIDEBAR_VERSION_KEY)
+    return version
+
+
+def invalidate_sidebar_counts() -> None:
+    cache.delete(SIDEBAR_COUNTS_KEY)
+    try:
+        cache.incr(SIDEBAR_VERSION_KEY)
+    except ValueError:
+        get_sidebar_version()
+
+
+def liked_set_key(user_id: int) -> str:
+    return f'liked_posts:{user_id}'
+
+
+def _load_liked_set(user_id: int) -> tuple:
+    from bike_app.models import UserPostRelation
+
+    limit = settings.LIKED_SET_MAX_SIZE
+    post_ids = list(UserPostRelation.objects.filter(
+        auth_user_id=user_id, like=True
+    ).order_by('-pk').values_list('bike_id', flat=True)[:limit + 1])
+    return frozenset(post_ids[:limit]), len(post_ids) <= limit
+
+
+def get_liked_set(user_id: int) -> tuple:
+    """
+    Множество лайкнутых пользователем постов и признак его полноты.
+    При отсутствии в кэше восстанавливается по UserPostRelation, хранится не больше LIKED_SET_MAX_SIZE последних лайков.
+    В Redis - нативное множество, которое лайки меняют на месте (change_liked_set).
+    """
+
+    client = redis_client()
+    if client is not None:
+        return _get_native_liked_set(client, user_id)
+    data = cache.get(liked_set_key(user_id))
+    if data is None:
+        data = _load_liked_set(user_id)
+        cache.set(liked_set_key(user_id), data, timeout=settings.LIKED_SET_TIMEOUT)
+    return data
+
+
+def _get_native_liked_set(client, user_id: int) -> tuple:
+    key = cache.make_key(liked_set_key(user_id))
+    members = client.smembers(key)
+    if LIKED_SET_COMPLETE in members or LIKED_SET_PARTIAL in members:
+        complete = LIKED_SET_COMPLETE in members
+        return frozenset(int(member) for member in members - {LIKED_SET_COMPLETE, LIKED_SET_PARTIAL}), complete
+
+    with client.pipeline() as pipe:
+        try:
+            # SADD/SREM параллельного лайка между чтением базы и записью отменит запись: данные могли устареть
+            pipe.watch(key)
+            post_ids, complete = data = _load_liked_set(user_id)
+            pipe.multi()
+            pipe.delete(key)
+            pipe.sadd(key, LIKED_SET_COMPLETE if complete else LIKED_SET_PARTIAL, *post_ids)
+            pipe.expire(key, settings.LIKED_SET_TIMEOUT)
+            pipe.execute()
+        except WatchError:
+            pass
+    return data
+
+
+def _update_native_liked_set(client, user_id: int, liked, unliked) -> None:
+    key = cache.make_key(liked_set_key(user_id))
+    pipe = client.pipeline()
+    if liked:
+        pipe.sadd(key, *liked)
+    if unliked:
+        pipe.srem(key, *unliked)
+    # SADD в отсутствующий ключ создает множество без служебного элемента: чтение его пересоберет
+    pipe.expire(key, settings.LIKED_SET_TIMEOUT)
+    pipe.execute()
+
+
+def change_liked_set(user_id: int, liked=(), unliked=(), using: str = None) -> None:
+    """
+    Изменение множества лайкнутых постов после лайков и снятия лайков. В Redis - SADD/SREM после коммита, без
+    пересборки множества. В остальных кэшах множество сбрасывается сразу и еще раз после коммита: правка на месте
+    (get, изменение, set) теряла бы одно из параллельных изменений на LIKED_SET_TIMEOUT.
+    """
+
+    if not liked and not unliked:
+        return
+    client = redis_client()
+    if client is None:
+        invalidate_liked_set(user_id)
+        transaction.on_commit(partial(invalidate_liked_set, user_id), using=using)
+    else:
+        transaction.on_commit(partial(_update_native_liked_set, client, user_id, list(liked), list(unliked)),
+                              using=using)
+
+
+def invalidate_liked_set(user_id: int) -> None:
+    """Сброс множества лайкнутых постов, оно пересобирается при следующем чтении"""
+
+    cache.delete(liked_set_key(user_id))
+
+
+def liked_post_ids(user, post_ids) -> set:
+    """Идентификаторы постов из post_ids, которые лайкнул пользователь"""
+
+    from bike_app.models import UserPostRelation
+
+    if not post_ids:
+        return set()
+    liked, complete = get_liked_set(user.pk)
+    found = {post_id for post_id in post_ids if post_id in liked}
+    if not complete:
+        # для неполного множества отсутствие поста ничего не значит, уточняем по базе
+        unknown = [post_id for post_id in post_ids if post_id not in found]
+        found |= set(UserPostRelation.objects.filter(
+            auth_user=user, like=True, bike_id__in=unknown
+        ).values_list('bike_id', flat=True))
+    return found
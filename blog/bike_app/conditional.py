@@ -0,0 +1,114 @@
+import hashlib
+
+from django.contrib.messages import get_messages
+from django.db.models import OuterRef, Subquery
+from django.utils.cache import get_conditional_response
+
+from bike_app.caching import get_list_generation, get_sidebar_version
+from bike_app.likes import pending_likes
+from bike_app.slugs import resolve_slug
+
+# поля, по которым видно изменение поста: правки, счетчики, название категории и готовность вариантов фото
+POST_VERSION_FIELDS = ('modified', 'like_count', 'rating_sum', 'rating_count', 'cat__name', 'photo_variants')
+
+
+def make_etag(*parts) -> str:
+    """Слабый ETag: страницы содержат CSRF-токен, поэтому побайтно ответы не совпадают"""
+
+    return 'W/"%s"' % hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest()
+
+
+def page_state(request):
+    """
+    Часть ETag HTML-страницы, зависящая от пользователя: кто вошел и его еще не записанные лайки.
+    None - страницу нельзя отдавать из кэша клиента (есть непоказанные сообщения).
+    """
+
+    if len(get_messages(request)):
+        return None
+    pending = sorted(pending_likes(request.user).items())
+    return request.user.pk, pending
+
+
+def post_etag(request, slug: str, **kwargs):
+    """
+    ETag страницы поста по modified, счетчикам, оценке пользователя и версии боковой панели (категории и теги
+    с числом постов меняются при изменении других постов) - один запрос по первичному ключу
+    """
+
+    from bike_app.models import Bike, UserPostRelation
+
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    match = resolve_slug('post', slug)
+    if match.pk is None or match.redirect_to is not None:
+        return None
+    state = page_state(request)
+    if state is None:
+        return None
+    queryset = Bike.published.filter(pk=match.pk)
+    fields = list(POST_VERSION_FIELDS)
+    if request.user.is_authenticated:
+        queryset = queryset.annotate(user_rate=Subquery(UserPostRelation.objects.filter(
+            bike=OuterRef('pk'), auth_user=request.user).values('rate')[:1]))
+        fields.append('user_rate')
+    row = queryset.values_list(*fields).first()
+    if row is None:
+        return None
+    return make_etag('post', match.pk, *row, get_sidebar_version(), *state)
+
+
+def list_etag(list_name: str, slug_kind: str = None, slug_kwarg: str = None):
+    """ETag страницы списка по поколению кэша списков: без запросов к базе"""
+
+    def etag(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        if slug_kind is not None and resolve_slug(slug_kind, kwargs[slug_kwarg]).pk is None:
+            return None
+        state = page_state(request)
+        if state is None:
+            return None
+        return make_etag(list_name, get_list_generation(), request.get_full_path(), *state)
+
+    return etag
+
+
+class ConditionalGetMixin:
+    """
+    Условные GET для чтения через API: ETag списка - по поколению кэша списков, объекта - по POST_VERSION_FIELDS.
+    При совпадении If-None-Match отдается 304 без выборки и сериализации.
+    """
+
+    def list_etag(self, request) -> str:
+        return make_etag('api-list', get_list_generation(), request.build_absolute_uri(),
+                         request.accepted_renderer.format)
+
+    def object_etag(self, request, pk) -> str:
+        try:
+            queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+            row = queryset.filter(pk=pk).values_list(*POST_VERSION_FIELDS).first()
+        except (TypeError, ValueError):
+            return None
+        if row is None:
+            return None
+        return make_etag('api-object', pk, *row, request.build_absolute_uri(), request.accepted_renderer.format)
+
+    def conditional(self, request, etag, view, *args, **kwargs):
+        """Ответ 304, если у клиента актуальная версия, иначе результат view с заголовком ETag"""
+
+        if etag is not None:
+            response = get_conditional_response(request, etag=etag)
+            if response is not None:
+                return response
+        response = view(request, *args, **kwargs)
+        if etag is not None and response.status_code == 200:
+            response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(request, self.list_etag(request), super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        etag = self.object_etag(request, self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        return self.conditional(request, etag, super().retrieve, *args, **kwargs)
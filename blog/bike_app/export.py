@@ -0,0 +1,112 @@
+import csv
+import re
+from datetime import datetime
+from datetime import timezone as dt_timezone
+from itertools import islice
+
+import orjson
+from django.conf import settings
+from django.db.models import DateTimeField, Q
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+POST_COLUMNS = ('id', 'title', 'slug', 'created', 'modified', 'changed', 'is_published', 'auth_user_id', 'cat', 'tags',
+                'like_count', 'rating_sum', 'rating_count', 'rating')
+RELATION_COLUMNS = ('id', 'auth_user_id', 'bike_id', 'like', 'rate')
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv; charset=utf-8'}
+
+
+def parse_since(value: str) -> datetime:
+    """Момент начала инкрементальной выгрузки из ISO 8601, без часового пояса - в UTC"""
+
+    # '+' смещения часового пояса в неэкранированном параметре URL превращается в пробел
+    since = parse_datetime(re.sub(r'(T[\d:.]+) (\d\d:?\d\d)$', r'\1+\2', value.strip()))
+    if since is None:
+        raise ValueError(value)
+    return since if timezone.is_aware(since) else timezone.make_aware(since, dt_timezone.utc)
+
+
+def _chunks(iterable, size: int):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def export_posts(since=None, chunk_size: int = None):
+    """
+    Посты с категорией, тегами и счетчиками в порядке (changed, id) для выгрузки в хранилище аналитики.
+    Строки читаются курсором на сервере порциями по chunk_size, теги - одним запросом на порцию,
+    поэтому память не зависит от размера таблицы. changed - последнее изменение поста или его счетчиков
+    (лайки и оценки не меняют modified), since - выгрузка постов, измененных с этого момента включительно.
+    Переименование категории не меняет changed ее постов.
+    """
+
+    from bike_app.models import Bike
+
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    changed = Greatest('modified', Coalesce('counters_modified', 'modified'), output_field=DateTimeField())
+    queryset = Bike.objects.annotate(changed=changed)
+    if since is not None:
+        queryset = queryset.filter(Q(modified__gte=since) | Q(counters_modified__gte=since))
+    rows = queryset.order_by('changed', 'id').values(
+        'id', 'title', 'slug', 'created', 'modified', 'changed', 'is_published', 'auth_user_id', 'cat__name',
+        'like_count', 'rating_sum', 'rating_count').iterator(chunk_size=chunk_size)
+
+    through = Bike.tags.through
+    for chunk in _chunks(rows, chunk_size):
+        tags = {row['id']: [] for row in chunk}
+        links = through.objects.filter(bike_id__in=tags).order_by('pk').values_list('bike_id', 'tags__slug')
+        for bike_id, tag in links:
+            tags[bike_id].append(tag)
+        for row in chunk:
+            row['cat'] = row.pop('cat__name')
+            row['tags'] = tags[row['id']]
+            row['rating'] = round(row['rating_sum'] / row['rating_count'], 2) if row['rating_count'] else None
+            yield row
+
+
+def export_relations(chunk_size: int = None):
+    """Все лайки и оценки в порядке id курсором на сервере. Времени изменения у оценок нет, выгрузка всегда полная"""
+
+    from bike_app.models import UserPostRelation
+
+    return UserPostRelation.objects.order_by('id').values(*RELATION_COLUMNS).iterator(
+        chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE)
+
+
+class _Echo:
+    """Файлоподобный объект для csv.writer, возвращающий записанную строку"""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE)
+
+
+def _csv_value(value):
+    if isinstance(value, list):
+        return '|'.join(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def csv_lines(rows, columns: tuple):
+    """CSV с заголовком, списки (теги) - через '|', даты - в ISO 8601, как в ndjson"""
+
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([_csv_value(row[name]) for name in columns])
+
+
+def render_export(rows, columns: tuple, output: str):
+    """Поток байтов выгрузки в формате ndjson или csv"""
+
+    if output == 'csv':
+        return (line.encode() for line in csv_lines(rows, columns))
+    return ndjson_lines(rows)
@@ -0,0 +1,264 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from bike_app.caching import bump_list_generation, change_liked_set, liked_post_ids, redis_client
+from bike_blog.metrics import observe_relation_write
+
+
+def is_buffered() -> bool:
+    """Лайки пишутся через буфер (write-behind), а не сразу в базу"""
+
+    return settings.LIKES_WRITE_MODE == 'buffered'
+
+
+class RedisLikeBuffer:
+    """
+    Буфер лайков в Redis: хэш bike_id -> состояние на каждого пользователя и множество пользователей.
+    Сброс переименовывает хэши пользователей в ключи захвата и удаляет их только после коммита (ack),
+    при ошибке или падении воркера изменения возвращаются в буфер (requeue, recover). Захваты пользователя
+    перечислены в его множестве, чтение до ack видит и их.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.users_key = cache.make_key('likes:pending:users')
+        self.claims_key = cache.make_key('likes:claims')
+
+    def user_key(self, user_id: int) -> str:
+        return cache.make_key(f'likes:pending:{user_id}')
+
+    def claim_key(self, claim: str) -> str:
+        return cache.make_key(f'likes:claimed:{claim}')
+
+    def user_claims_key(self, user_id: int) -> str:
+        return cache.make_key(f'likes:claims:{user_id}')
+
+    @staticmethod
+    def _decode(values: dict) -> dict:
+        return {int(bike_id): value == b'1' for bike_id, value in values.items()}
+
+    def set(self, user_id: int, bike_id: int, liked: bool) -> None:
+        pipe = self.client.pipeline()
+        pipe.hset(self.user_key(user_id), bike_id, int(liked))
+        pipe.sadd(self.users_key, user_id)
+        pipe.execute()
+
+    def get_user(self, user_id: int) -> dict:
+        """Изменения пользователя: захваченные еще не записанным сбросом (от ранних к поздним) и новые поверх них"""
+
+        claims = [claim.decode() for claim in self.client.smembers(self.user_claims_key(user_id))]
+        pipe = self.client.pipeline()
+        for claim in claims:
+            pipe.zscore(self.claims_key, claim)
+            pipe.hgetall(self.claim_key(claim))
+        pipe.hgetall(self.user_key(user_id))
+        *claimed, current = pipe.execute()
+        values = {}
+        for _, claim_values in sorted(zip(claimed[::2], claimed[1::2]), key=lambda item: item[0] or 0):
+            values.update(self._decode(claim_values))
+        values.update(self._decode(current))
+        return values
+
+    def pop(self, count: int) -> tuple:
+        """Захват изменений не более чем count пользователей: (захваты для ack/requeue, user_id -> изменения)"""
+
+        claims, pending = [], {}
+        for user_id in self.client.srandmember(self.users_key, count) or []:
+            user_id = int(user_id)
+            claim = f'{uuid.uuid4().hex}:{user_id}'
+            # атомарно: пользователь уходит из множества, а его хэш - в ключ захвата; новые клики пишутся в новый хэш
+            pipe = self.client.pipeline(transaction=True)
+            pipe.srem(self.users_key, user_id)
+            pipe.rename(self.user_key(user_id), self.claim_key(claim))
+            pipe.zadd(self.claims_key, {claim: time.time()})
+            pipe.sadd(self.user_claims_key(user_id), claim)
+            removed, renamed, _, _ = pipe.execute(raise_on_error=False)
+            if not removed or isinstance(renamed, Exception):
+                # пользователя забрал параллельный сброс или его хэш пуст
+                self._forget([claim])
+                continue
+            claims.append(claim)
+            values = self.client.hgetall(self.claim_key(claim))
+            if values:
+                pending[user_id] = self._decode(values)
+        return claims, pending
+
+    def has_pending(self) -> bool:
+        return bool(self.client.scard(self.users_key))
+
+    def _forget(self, claims: list, pipe=None) -> None:
+        """Удаление захватов вместе с их записями в индексах"""
+
+        execute = pipe is None
+        pipe = pipe or self.client.pipeline()
+        for claim in claims:
+            pipe.delete(self.claim_key(claim))
+            pipe.srem(self.user_claims_key(int(claim.rsplit(':', 1)[1])), claim)
+        pipe.zrem(self.claims_key, *claims)
+        if execute:
+            pipe.execute()
+
+    def ack(self, claims: list) -> None:
+        if claims:
+            self._forget(claims)
+
+    def requeue(self, claims: list) -> None:
+        """Возврат захваченных изменений в буфер; более новые клики тех же пользователей не перезаписываются"""
+
+        for claim in claims:
+            user_id = int(claim.rsplit(':', 1)[1])
+            values = self.client.hgetall(self.claim_key(claim))
+            pipe = self.client.pipeline()
+            for bike_id, value in values.items():
+                pipe.hsetnx(self.user_key(user_id), bike_id, value)
+            if values:
+                pipe.sadd(self.users_key, user_id)
+            self._forget([claim], pipe)
+            pipe.execute()
+
+    def recover(self, timeout: float) -> None:
+        """Возврат захватов старше timeout секунд: сброс, захвативший их, упал до ack"""
+
+        stale = self.client.zrangebyscore(self.claims_key, '-inf', time.time() - timeout)
+        self.requeue([claim.decode() for claim in stale])
+
+
+class CacheLikeBuffer:
+    """Буфер лайков поверх кэша Django для окружений без Redis (разработка, тесты)"""
+
+    users_key = 'likes:pending:users'
+
+    def user_key(self, user_id: int) -> str:
+        return f'likes:pending:{user_id}'
+
+    def claimed_key(self, user_id: int) -> str:
+        return f'likes:claimed:{user_id}'
+
+    def set(self, user_id: int, bike_id: int, liked: bool) -> None:
+        pending = cache.get(self.user_key(user_id), {})
+        pending[bike_id] = liked
+        cache.set(self.user_key(user_id), pending, timeout=None)
+        cache.set(self.users_key, cache.get(self.users_key, set()) | {user_id}, timeout=None)
+
+    def get_user(self, user_id: int) -> dict:
+        return {**cache.get(self.claimed_key(user_id), {}), **cache.get(self.user_key(user_id), {})}
+
+    def pop(self, count: int) -> tuple:
+        users = list(cache.get(self.users_key, set()))
+        taken, rest = users[:count], users[count:]
+        cache.set(self.users_key, set(rest), timeout=None)
+        pending = {user_id: cache.get(self.user_key(user_id), {}) for user_id in taken}
+        cache.delete_many([self.user_key(user_id) for user_id in taken])
+        pending = {user_id: values for user_id, values in pending.items() if values}
+        for user_id, values in pending.items():
+            cache.set(self.claimed_key(user_id), {**cache.get(self.claimed_key(user_id), {}), **values}, timeout=None)
+        # захват - сами изменения: процесс разработки не переживает падение, восстанавливать нечего
+        return pending, pending
+
+    def has_pending(self) -> bool:
+        return bool(cache.get(self.users_key))
+
+    def ack(self, claims: dict) -> None:
+        cache.delete_many([self.claimed_key(user_id) for user_id in claims])
+
+    def requeue(self, claims: dict) -> None:
+        for user_id, values in claims.items():
+            cache.set(self.user_key(user_id), {**values, **cache.get(self.user_key(user_id), {})}, timeout=None)
+        if claims:
+            cache.set(self.users_key, cache.get(self.users_key, set()) | set(claims), timeout=None)
+        self.ack(claims)
+
+    def recover(self, timeout: float) -> None:
+        pass
+
+
+def get_like_buffer():
+    client = redis_client()
+    if client is not None:
+        return RedisLikeBuffer(client)
+    return CacheLikeBuffer()
+
+
+def toggle_like_buffered(user, bike_id: int) -> bool:
+    """Переключение лайка через буфер: последнее состояние перекрывает предыдущие"""
+
+    buffer = get_like_buffer()
+    pending = buffer.get_user(user.pk)
+    liked = pending[bike_id] if bike_id in pending else bike_id in liked_post_ids(user, [bike_id])
+    buffer.set(user.pk, bike_id, not liked)
+    observe_relation_write('like', 'buffered')
+    return not liked
+
+
+def pending_likes(user) -> dict:
+    """Еще не записанные в базу лайки пользователя, bike_id -> состояние"""
+
+    if not is_buffered() or not user.is_authenticated:
+        return {}
+    return get_like_buffer().get_user(user.pk)
+
+
+def flush_like_buffer(batch_size: int = None) -> int:
+    """
+    Запись накопленных лайков пачкой: bulk_update/bulk_create отношений и изменение счетчиков постов на разницу.
+    Возвращает количество записанных изменений.
+    """
+
+    batch_size = batch_size or settings.LIKES_FLUSH_BATCH_SIZE
+    buffer = get_like_buffer()
+    buffer.recover(settings.LIKES_CLAIM_TIMEOUT)
+    claims, pending = buffer.pop(batch_size)
+    if not pending:
+        buffer.ack(claims)
+        return 0
+    try:
+        changes, written = _write_likes(pending)
+    except BaseException:
+        # изменения возвращаются в буфер и будут записаны следующим сбросом
+        buffer.requeue(claims)
+        raise
+    # сначала кэши, затем ack: пока захват виден чтению, множество лайков может быть старым
+    for user_id, values in pending.items():
+        change_liked_set(user_id, liked=[bike_id for bike_id, liked in values.items() if liked],
+                         unliked=[bike_id for bike_id, liked in values.items() if not liked])
+    bump_list_generation()
+    buffer.ack(claims)
+    observe_relation_write('like', 'flush', written)
+    return changes
+
+
+def _write_likes(pending: dict) -> int:
+    """Запись изменений одной транзакцией, возвращает (число изменений постов, которые есть, число записанных строк)"""
+
+    from bike_app.models import Bike, UserPostRelation
+
+    changes = {(user_id, bike_id): liked for user_id, values in pending.items() for bike_id, liked in values.items()}
+    bike_ids = set(Bike.objects.filter(pk__in={bike_id for _, bike_id in changes}).values_list('pk', flat=True))
+    changes = {key: liked for key, liked in changes.items() if key[1] in bike_ids}
+
+    with transaction.atomic():
+        # как в save_relations: пустые строки вставляются заранее, разница считается от заблокированных строк
+        UserPostRelation.objects.bulk_create([UserPostRelation(auth_user_id=user_id, bike_id=bike_id)
+                                              for user_id, bike_id in changes], batch_size=500, ignore_conflicts=True)
+        existing = {}
+        relations = UserPostRelation.objects.select_for_update().filter(auth_user_id__in=pending, bike_id__in=bike_ids)
+        for relation in relations:
+            existing[relation.auth_user_id, relation.bike_id] = relation
+
+        to_update, deltas = [], {}
+        for (user_id, bike_id), liked in changes.items():
+            relation = existing[user_id, bike_id]
+            if relation.like == liked:
+                continue
+            relation.like = liked
+            to_update.append(relation)
+            deltas[bike_id] = deltas.get(bike_id, 0) + (1 if liked else -1)
+
+        UserPostRelation.objects.bulk_update(to_update, ['like'], batch_size=500)
+        for bike_id, delta in deltas.items():
+            Bike.objects.filter(pk=bike_id).add_to_counters(like_count=delta)
+    return len(changes), len(to_update)
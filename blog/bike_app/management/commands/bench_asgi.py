@@ -0,0 +1,68 @@
+import http.client
+import itertools
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """Сравнение синхронного (gunicorn) и асинхронного (uvicorn) запуска приложения под параллельной нагрузкой"""
+
+    help = 'Отправляет одинаковые запросы запущенным серверам и выводит p50/p99 задержки и запросов в секунду'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sync-url', default='http://127.0.0.1:8000', help='Адрес синхронного сервера (WSGI)')
+        parser.add_argument('--async-url', default='http://127.0.0.1:8001', help='Адрес асинхронного сервера (ASGI)')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Путь для нагрузки, можно указать несколько раз (по умолчанию / и /api/v1/bikes/)')
+        parser.add_argument('--requests', type=int, default=1000, help='Запросов на каждый путь')
+        parser.add_argument('--concurrency', type=int, default=50, help='Одновременных соединений')
+
+    def load(self, url: str, requests: int, concurrency: int) -> dict:
+        """Задержки всех запросов к url из concurrency потоков с keep-alive соединениями"""
+
+        parts = urlsplit(url)
+        target = parts.path + (f'?{parts.query}' if parts.query else '')
+        counter = itertools.count()
+
+        def worker() -> tuple:
+            connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+            latencies, errors = [], 0
+            while next(counter) < requests:
+                started = time.perf_counter()
+                try:
+                    connection.request('GET', target)
+                    response = connection.getresponse()
+                    response.read()
+                    errors += response.status >= 400
+                except (OSError, http.client.HTTPException):
+                    errors += 1
+                    connection.close()
+                latencies.append(time.perf_counter() - started)
+            connection.close()
+            return latencies, errors
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(lambda _: worker(), range(concurrency)))
+        elapsed = time.perf_counter() - started
+        latencies = sorted(latency for worker_latencies, _ in results for latency in worker_latencies)
+        if len(latencies) < 2:
+            raise CommandError('Нужно не меньше двух запросов')
+        percentiles = statistics.quantiles(latencies, n=100)
+        return {'p50': percentiles[49] * 1000, 'p99': percentiles[98] * 1000, 'rps': len(latencies) / elapsed,
+                'errors': sum(errors for _, errors in results)}
+
+    def handle(self, *args, **options):
+        for path in options['paths'] or ['/', '/api/v1/bikes/']:
+            self.stdout.write(path)
+            for name in ('sync', 'async'):
+                base = options[f'{name}_url'].rstrip('/')
+                result = self.load(base + path, options['requests'], options['concurrency'])
+                if result['errors'] == options['requests']:
+                    raise CommandError(f'Сервер {base} не отвечает')
+                self.stdout.write(f'  {name:5} p50 {result["p50"]:7.1f} мс  p99 {result["p99"]:7.1f} мс  '
+                                  f'{result["rps"]:8.1f} запр/с  ошибок: {result["errors"]}')
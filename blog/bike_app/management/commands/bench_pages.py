@@ -0,0 +1,153 @@
+import json
+import platform
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Q
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from bike_app.caching import bump_list_generation
+from bike_app.models import Bike, Category, Tags
+from bike_blog.query_budget import count_queries
+
+
+class Command(BaseCommand):
+    """Замер горячих страниц и методов API внутри процесса для анонима и вошедшего пользователя"""
+
+    help = ('Выполняет запросы к главной, категории, тегу, посту, поиску и API через тестовый клиент и выводит '
+            'p50/p95/p99 задержки, запросы к базе и размер ответа. Результаты пишутся в JSON для сравнения прогонов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Замеряемых запросов на каждый адрес')
+        parser.add_argument('--warmup', type=int, default=5, help='Запросов для прогрева кэшей перед замером')
+        parser.add_argument('--user', default='bench_0', help='Пользователь для замеров с входом')
+        parser.add_argument('--cold', action='store_true',
+                            help='Сбрасывать поколение кэша списков перед каждым запросом')
+        parser.add_argument('--output', help='Файл для результатов в JSON')
+        parser.add_argument('--baseline', help='JSON прошлого прогона: сравнить и завершиться с ошибкой при регрессии')
+        parser.add_argument('--threshold', type=float, default=20,
+                            help='Допустимый рост p50 относительно --baseline, в процентах')
+
+    def targets(self) -> dict:
+        """Адреса замера: самая населенная категория и тег, последний пост и поиск по слову из него"""
+
+        post = Bike.published.order_by('-created', '-id').only('pk', 'slug', 'title').first()
+        published = Count('posts', filter=Q(posts__is_published=Bike.Status.PUBLISHED))
+        cat = Category.objects.annotate(published=published).filter(published__gt=0).order_by('-published').first()
+        tag = Tags.objects.annotate(published=published).filter(published__gt=0).order_by('-published').first()
+        if post is None or cat is None or tag is None:
+            raise CommandError('Нет опубликованных постов с категорией и тегом: заполните базу командой seed_bench')
+        return {
+            'home': reverse('home'),
+            'category': reverse('category', kwargs={'cat_slug': cat.slug}),
+            'tag': reverse('tag', kwargs={'tag_slug': tag.slug}),
+            'post': reverse('post', kwargs={'slug': post.slug}),
+            'search': f"{reverse('search')}?q={post.title.split()[0]}",
+            'bike-list': reverse('bike-list'),
+            'bike-list-fields': f"{reverse('bike-list')}?fields=title,slug,created,cat,count_likes,rating",
+            'bike-detail': reverse('bike-detail', kwargs={'pk': post.pk}),
+        }
+
+    def clients(self, username: str) -> dict:
+        """Клиенты с заголовком Host из ALLOWED_HOSTS: запросы проходят весь стек middleware"""
+
+        host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+        user = get_user_model().objects.filter(username=username).first()
+        if user is None:
+            raise CommandError(f'Пользователь {username} не найден')
+        anonymous, logged_in = Client(HTTP_HOST=host), Client(HTTP_HOST=host)
+        logged_in.force_login(user)
+        return {'anonymous': anonymous, 'user': logged_in}
+
+    def measure(self, client: Client, url: str, requests: int, warmup: int, cold: bool) -> dict:
+        latencies, queries, sizes, statuses = [], [], [], set()
+        for number in range(warmup + requests):
+            if cold:
+                bump_list_generation()
+            with count_queries() as counter:
+                started = time.perf_counter()
+                response = client.get(url)
+                body = b''.join(response.streaming_content) if response.streaming else response.content
+                elapsed = time.perf_counter() - started
+            if number < warmup:
+                continue
+            latencies.append(elapsed * 1000)
+            queries.append(counter.count)
+            sizes.append(len(body))
+            statuses.add(response.status_code)
+        percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+        return {
+            'url': url,
+            'status': sorted(statuses),
+            'p50_ms': round(percentiles[49], 3),
+            'p95_ms': round(percentiles[94], 3),
+            'p99_ms': round(percentiles[98], 3),
+            'mean_ms': round(statistics.fmean(latencies), 3),
+            'queries': max(queries),
+            'bytes': max(sizes),
+        }
+
+    def compare(self, results: dict, baseline: dict, threshold: float) -> list:
+        """Регрессии относительно прошлого прогона: рост p50 больше порога или больше запросов к базе"""
+
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            change = (result['p50_ms'] - before['p50_ms']) / max(before['p50_ms'], 1e-9) * 100
+            self.stdout.write(f'  {name:28} p50 {before["p50_ms"]:8.2f} -> {result["p50_ms"]:8.2f} мс '
+                              f'({change:+.0f}%)  запросов {before["queries"]} -> {result["queries"]}')
+            if change > threshold:
+                regressions.append(f'{name}: p50 вырос на {change:.0f}%')
+            if result['queries'] > before['queries']:
+                regressions.append(f'{name}: запросов к базе {before["queries"]} -> {result["queries"]}')
+        return regressions
+
+    def handle(self, *args, **options):
+        if options['requests'] < 2:
+            raise CommandError('Нужно не меньше двух запросов на адрес')
+        if settings.DEBUG:
+            self.stderr.write('DEBUG включен: панель отладки и журнал SQL искажают результаты')
+
+        targets = self.targets()
+        results = {}
+        for client_name, client in self.clients(options['user']).items():
+            for name, url in targets.items():
+                result = self.measure(client, url, options['requests'], max(options['warmup'], 0), options['cold'])
+                label = f'{name}:{client_name}'
+                results[label] = result
+                self.stdout.write(f'{label:28} p50 {result["p50_ms"]:8.2f}  p95 {result["p95_ms"]:8.2f}  '
+                                  f'p99 {result["p99_ms"]:8.2f} мс  запросов {result["queries"]:3}  '
+                                  f'{result["bytes"]:8,} байт  {result["status"]}')
+
+        report = {
+            'meta': {
+                'created': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'posts': Bike.objects.count(),
+                'requests': options['requests'],
+                'warmup': options['warmup'],
+                'cold': options['cold'],
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)['results']
+            self.stdout.write(f'Сравнение с {options["baseline"]}:')
+            regressions = self.compare(results, baseline, options['threshold'])
+            if regressions:
+                raise CommandError('Регрессии:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Регрессий нет'))
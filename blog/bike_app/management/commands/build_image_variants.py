@@ -0,0 +1,53 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from bike_app.caching import bump_list_generation
+from bike_app.models import Bike
+from bike_blog.images import render_job, save_variants, setup_worker, variants_are_current
+
+
+class Command(BaseCommand):
+    """Создание уменьшенных копий для уже загруженных фото постов и пользователей"""
+
+    help = 'Создает WebP/JPEG варианты изображений, у которых их еще нет, в пуле процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Количество процессов')
+        parser.add_argument('--force', action='store_true', help='Пересоздать и уже существующие варианты')
+        parser.add_argument('--only', choices=['post', 'avatar'], help='Обработать только посты или пользователей')
+
+    def jobs(self, model, spec_name: str, force: bool):
+        spec = settings.IMAGE_VARIANTS[spec_name]
+        for instance in model._default_manager.exclude(photo='').exclude(photo=None).only('pk', 'photo',
+                                                                                          'photo_variants'):
+            if force or not variants_are_current(instance.photo, instance.photo_variants):
+                yield model._meta.label, instance.pk, 'photo', instance.photo.name, spec
+
+    def handle(self, *args, **options):
+        targets = {'post': Bike, 'avatar': get_user_model()}
+        if options['only']:
+            targets = {options['only']: targets[options['only']]}
+
+        # соединения с базой не должны наследоваться дочерними процессами
+        for connection in connections.all():
+            if not connection.in_atomic_block:
+                connection.close()
+        with ProcessPoolExecutor(max_workers=max(options['workers'], 1), initializer=setup_worker) as pool:
+            for spec_name, model in targets.items():
+                built = failed = 0
+                for pk, variants, error in pool.map(render_job, self.jobs(model, spec_name, options['force']),
+                                                    chunksize=8):
+                    if error is not None:
+                        failed += 1
+                        self.stderr.write(f'{model._meta.label} {pk}: {error}')
+                    elif save_variants(model, pk, 'photo', variants):
+                        built += 1
+                if model is Bike and built:
+                    bump_list_generation()
+                self.stdout.write(self.style.SUCCESS(
+                    f'{model._meta.verbose_name_plural}: создано вариантов для {built}, ошибок {failed}'))
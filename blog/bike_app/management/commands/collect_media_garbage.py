@@ -0,0 +1,86 @@
+import os
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now
+
+from bike_app.models import Bike
+from bike_blog.images import variant_files
+from bike_blog.storage import TEMP_PREFIX
+
+
+class Command(BaseCommand):
+    """Удаление файлов хранилища по хэшу, на которые не ссылается ни один объект"""
+
+    help = 'Подсчитывает ссылки на медиафайлы из постов и пользователей и удаляет файлы без ссылок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help='Не трогать файлы моложе N часов: загрузка могла еще не сохраниться в базе')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет удалено')
+
+    def references(self) -> Counter:
+        """Количество ссылок на каждый файл: фото и их варианты"""
+
+        counts = Counter()
+        for model in (Bike, get_user_model()):
+            for name, variants in model._default_manager.exclude(photo='').exclude(photo=None) \
+                    .values_list('photo', 'photo_variants').iterator():
+                counts[name] += 1
+                counts.update(variant_files(variants))
+        return counts
+
+    def handle(self, *args, **options):
+        storage = default_storage
+        if not getattr(storage, 'deduplicates', False):
+            raise CommandError('Хранилище по умолчанию не использует имена по хэшу содержимого')
+
+        references = self.references()
+        threshold = now() - timedelta(hours=options['grace_hours'])
+        orphans = [name for name in storage.walk() if name not in references
+                   and storage.get_modified_time(name) < threshold]
+        # временные файлы прерванных загрузок
+        if storage.exists(''):
+            orphans += [name for name in storage.listdir('')[1]
+                        if name.startswith(TEMP_PREFIX) and storage.get_modified_time(name) < threshold]
+
+        if options['dry_run']:
+            freed = sum(storage.size(name) for name in orphans)
+        else:
+            # пока шел обход, новая загрузка могла сослаться на файл: ссылки проверяются еще раз
+            references = self.references()
+            deleted, freed = [], 0
+            for name in orphans:
+                # время изменения - непосредственно перед удалением: повторная загрузка того же файла его обновляет
+                if name in references or not self.is_stale(storage, name, threshold):
+                    continue
+                freed += storage.size(name)
+                storage.delete(name)
+                self.remove_empty_parents(storage, name)
+                deleted.append(name)
+            orphans = deleted
+
+        shared = sum(1 for amount in references.values() if amount > 1)
+        action = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'Файлов со ссылками: {len(references)}, из них общих: {shared}. '
+            f'{action} файлов без ссылок: {len(orphans)} ({freed} байт)'))
+
+    def is_stale(self, storage, name: str, threshold) -> bool:
+        try:
+            return storage.get_modified_time(name) < threshold
+        except FileNotFoundError:
+            return False
+
+    def remove_empty_parents(self, storage, name: str) -> None:
+        """Удаление опустевших каталогов ab/cd после удаления файла"""
+
+        directory = os.path.dirname(name)
+        for _ in range(2):
+            if not directory or any(storage.listdir(directory)):
+                return
+            os.rmdir(storage.path(directory))
+            directory = os.path.dirname(directory)
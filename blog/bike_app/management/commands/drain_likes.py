@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from bike_app.likes import flush_like_buffer, get_like_buffer
+
+
+class Command(BaseCommand):
+    """Запись всех накопленных в буфере лайков, например перед остановкой"""
+
+    help = 'Полностью опустошает буфер лайков, записывая изменения в базу'
+
+    def handle(self, *args, **options):
+        buffer, total = get_like_buffer(), 0
+        # пачка только из лайков удаленных постов ничего не записывает, поэтому условие - пустой буфер
+        while True:
+            total += flush_like_buffer()
+            if not buffer.has_pending():
+                break
+        self.stdout.write(self.style.SUCCESS(f'Записано изменений лайков: {total}'))
@@ -0,0 +1,52 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bike_app.export import (FORMATS, POST_COLUMNS, RELATION_COLUMNS, export_posts, export_relations, parse_since,
+                             render_export)
+
+
+class Command(BaseCommand):
+    """Потоковая выгрузка постов или оценок в NDJSON/CSV для хранилища аналитики"""
+
+    help = 'Выгружает посты (с категорией, тегами и счетчиками) или оценки в файл или stdout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=['posts', 'relations'])
+        parser.add_argument('--output', choices=list(FORMATS), default='ndjson', help='Формат выгрузки')
+        parser.add_argument('--since', help='Только посты, измененные с этого момента (ISO 8601) включительно')
+        parser.add_argument('--file', help='Файл выгрузки, по умолчанию stdout')
+        parser.add_argument('--chunk-size', type=int, help='Строк в одной порции курсора')
+
+    def handle(self, *args, **options):
+        stats = {'count': 0, 'last_changed': None}
+
+        def tracked(rows):
+            for row in rows:
+                stats['count'] += 1
+                stats['last_changed'] = row.get('changed', stats['last_changed'])
+                yield row
+
+        if options['kind'] == 'posts':
+            try:
+                since = parse_since(options['since']) if options['since'] else None
+            except ValueError:
+                raise CommandError('--since: ожидается дата и время в формате ISO 8601')
+            rows, columns = export_posts(since, options['chunk_size']), POST_COLUMNS
+        else:
+            rows, columns = export_relations(options['chunk_size']), RELATION_COLUMNS
+
+        file = open(options['file'], 'wb') if options['file'] else sys.stdout.buffer
+        try:
+            for chunk in render_export(tracked(rows), columns, options['output']):
+                file.write(chunk)
+        finally:
+            if options['file']:
+                file.close()
+            else:
+                file.flush()
+
+        message = f'Выгружено строк: {stats["count"]}'
+        if stats['last_changed'] is not None:
+            message += f', следующая выгрузка: --since {stats["last_changed"].isoformat()}'
+        self.stderr.write(message)
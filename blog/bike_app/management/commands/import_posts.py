@@ -0,0 +1,107 @@
+import csv
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import orjson
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from bike_app.bulk import PostImporter
+from bike_app.export import parse_since
+from bike_app.models import Bike
+
+
+class Command(BaseCommand):
+    """Быстрый импорт постов из NDJSON/CSV архива пачками через bulk_create"""
+
+    help = ('Импортирует посты из NDJSON или CSV (title, cat, content, tags, is_published, created, photo). '
+            'Категории и теги создаются при необходимости, фото копируются из локального каталога пулом потоков')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл архива, - для stdin')
+        parser.add_argument('--format', choices=['ndjson', 'csv'], help='Формат, по умолчанию - по расширению файла')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Постов в одной транзакции')
+        parser.add_argument('--photo-root', help='Каталог, относительно которого заданы пути фото в архиве')
+        parser.add_argument('--workers', type=int, default=8, help='Потоков для копирования фото')
+        parser.add_argument('--author', help='Имя пользователя - автора импортированных постов')
+        parser.add_argument('--on-conflict', choices=['rename', 'skip'], default='rename',
+                            help='Совпадение заголовка с существующим: добавить номер или пропустить пост')
+
+    def read_rows(self, file, file_format: str):
+        """Строки архива по одной, списки тегов в CSV - через '|'"""
+
+        if file_format == 'csv':
+            for row in csv.DictReader(io.TextIOWrapper(file, encoding='utf-8')):
+                row['tags'] = [tag for tag in (row.get('tags') or '').split('|') if tag]
+                yield row
+            return
+        for line in file:
+            if line.strip():
+                yield orjson.loads(line)
+
+    def normalize(self, row: dict) -> dict:
+        if isinstance(row.get('tags'), str):
+            row['tags'] = [tag for tag in row['tags'].split('|') if tag]
+        if row.get('is_published') not in (None, ''):
+            row['is_published'] = int(row['is_published'])
+        else:
+            row.pop('is_published', None)
+        row['created'] = parse_since(row['created']) if row.get('created') else None
+        return row
+
+    def store_photo(self, path: str):
+        """Копирование фото в хранилище медиафайлов, возвращает имя файла или None, если файла нет"""
+
+        full_path = os.path.join(self.photo_root, path)
+        if not os.path.isfile(full_path):
+            return None
+        field = Bike._meta.get_field('photo')
+        with open(full_path, 'rb') as file:
+            return field.storage.save(field.generate_filename(None, os.path.basename(path)), File(file))
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or ('csv' if options['path'].endswith('.csv') else 'ndjson')
+        author = None
+        if options['author']:
+            author = get_user_model().objects.filter(username=options['author']).first()
+            if author is None:
+                raise CommandError(f'Пользователь {options["author"]} не найден')
+        self.photo_root = options['photo_root'] or os.getcwd()
+
+        importer = PostImporter(author, options['on_conflict'])
+        file = sys.stdin.buffer if options['path'] == '-' else open(options['path'], 'rb')
+        started = time.perf_counter()
+        stored_photos = missing_photos = 0
+        try:
+            rows = (self.normalize(row) for row in self.read_rows(file, file_format))
+            with ThreadPoolExecutor(max_workers=max(options['workers'], 1)) as pool:
+                while batch := list(islice(rows, options['batch_size'])):
+                    photos = [row.get('photo') for row in batch]
+                    stored = pool.map(lambda path: self.store_photo(path) if path else None, photos)
+                    for row, path, name in zip(batch, photos, stored):
+                        row['photo'] = name
+                        stored_photos += name is not None
+                        missing_photos += bool(path) and name is None
+                    importer.import_batch(batch)
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f'Импортировано {importer.created} постов')
+        except (ValueError, KeyError, OSError) as error:
+            raise CommandError(f'Ошибка в архиве: {error}')
+        finally:
+            if file is not sys.stdin.buffer:
+                file.close()
+            importer.finish()
+
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        for error in importer.errors[:20]:
+            self.stderr.write(error)
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано {importer.created} постов за {elapsed:.1f} с ({importer.created / elapsed:,.0f} постов/с), '
+            f'пропущено: {importer.skipped}, ошибок: {len(importer.errors)}, фото не найдено: {missing_photos}'))
+        if stored_photos:
+            self.stdout.write('Уменьшенные копии фото создаются командой build_image_variants')
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Min
+
+from bike_app.caching import bump_list_generation
+from bike_app.models import Bike, UserPostRelation
+
+
+class Command(BaseCommand):
+    """Слияние повторных оценок одного пользователя одному посту перед добавлением уникального ограничения"""
+
+    help = 'Объединяет дубли UserPostRelation (auth_user, bike) и пересчитывает счетчики затронутых постов'
+
+    def handle(self, *args, **options):
+        duplicates = UserPostRelation.objects.values('auth_user', 'bike').annotate(
+            amount=Count('pk'), first_id=Min('pk')).filter(amount__gt=1).order_by()
+
+        merged, bike_ids = 0, set()
+        with transaction.atomic():
+            for group in duplicates:
+                relations = UserPostRelation.objects.filter(auth_user=group['auth_user'], bike=group['bike'])
+                # лайк сохраняется, если он был хотя бы в одной строке, оценка - последняя поставленная
+                like = relations.filter(like=True).exists()
+                rate = relations.exclude(rate=None).order_by('-pk').values_list('rate', flat=True).first()
+                relations.filter(pk=group['first_id']).update(like=like, rate=rate)
+                merged += relations.exclude(pk=group['first_id']).delete()[0]
+                bike_ids.add(group['bike'])
+            Bike.objects.filter(pk__in=bike_ids).recount_counters()
+
+        if merged:
+            bump_list_generation()
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено дублей оценок: {merged}, пересчитаны счетчики {len(bike_ids)} постов'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bike_app.models import Bike
+
+
+class Command(BaseCommand):
+    """Пересчет и проверка денормализованных счетчиков лайков и рейтинга постов"""
+
+    help = 'Пересчитывает like_count, rating_sum и rating_count постов по таблице оценок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только проверить счетчики, завершиться с ошибкой при расхождении')
+        parser.add_argument('--ids', nargs='+', type=int, help='Пересчитать только указанные посты')
+
+    def handle(self, *args, **options):
+        queryset = Bike.objects.all()
+        if options['ids']:
+            queryset = queryset.filter(pk__in=options['ids'])
+
+        drifted = list(queryset.with_drifted_counters().values_list('pk', flat=True))
+        if options['check']:
+            if drifted:
+                raise CommandError(f'Счетчики расходятся у {len(drifted)} постов: {drifted[:20]}')
+            self.stdout.write(self.style.SUCCESS('Счетчики в порядке'))
+            return
+
+        updated = queryset.recount_counters()
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано {updated} постов, исправлено расхождений: {len(drifted)}'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from bike_app.models import Bike
+from bike_app.search import index_posts
+
+
+class Command(BaseCommand):
+    """Перестроение поискового индекса постов"""
+
+    help = 'Заполняет поисковый индекс для всех постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Размер порции постов')
+
+    def handle(self, *args, **options):
+        # порции по id, каждая индексируется одним index_posts: число запросов не зависит от числа постов в порции
+        posts = Bike.objects.only('pk', 'title', 'content', 'cat_id').order_by('pk')
+        count = last_pk = 0
+        while chunk := list(posts.filter(pk__gt=last_pk)[:options['chunk_size']]):
+            index_posts(chunk)
+            count += len(chunk)
+            last_pk = chunk[-1].pk
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано {count} постов'))
@@ -0,0 +1,178 @@
+import random
+import time
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from itertools import accumulate, islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from bike_app.bulk import PostImporter, post_slug
+from bike_app.caching import bump_list_generation, invalidate_sidebar_counts, liked_set_key
+from bike_app.models import Bike, Category, Tags, UserPostRelation
+from bike_app.slugs import bump_slug_generation
+
+# пароль всех пользователей набора, под ним входит bench_pages
+BENCH_PASSWORD = 'bench-password'
+# даты постов отсчитываются от фиксированного момента, чтобы набор не зависел от дня запуска
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+SYLLABLES = ('ве', 'ло', 'сип', 'ед', 'гор', 'ный', 'шос', 'се', 'ра', 'ма', 'ко', 'ле', 'со', 'цеп', 'тор',
+             'моз', 'руль', 'спи', 'цы', 'об', 'од', 'пе', 'даль', 'кас', 'сет', 'та', 'вил', 'ка', 'аморт', 'ти')
+
+
+def name_prefix(prefix: str, kind: str) -> str:
+    """Начало slug объектов набора: 'bench-post-', 'bench-kategoriia-', 'bench-teg-'"""
+
+    return post_slug(f'{prefix} {kind}') + '-'
+
+
+class Command(BaseCommand):
+    """Детерминированный набор данных большого объема для нагрузочных замеров страниц и API"""
+
+    help = ('Создает пользователей, категории, теги, посты и оценки пачками через bulk_create. '
+            'Одинаковые параметры и --seed дают одинаковые данные, повторный запуск дописывает недостающее')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Количество пользователей')
+        parser.add_argument('--categories', type=int, default=20, help='Количество категорий')
+        parser.add_argument('--tags', type=int, default=200, help='Количество тегов')
+        parser.add_argument('--posts', type=int, default=100000, help='Количество постов')
+        parser.add_argument('--relations', type=int, default=1000000,
+                            help='Количество оценок (пар пользователь - пост), не больше users * posts')
+        parser.add_argument('--tags-per-post', type=int, default=4, help='Наибольшее число тегов у поста')
+        parser.add_argument('--like-rate', type=float, default=0.3, help='Доля оценок с лайком')
+        parser.add_argument('--rate-rate', type=float, default=0.2, help='Доля оценок с рейтингом')
+        parser.add_argument('--seed', type=int, default=1, help='Начальное значение генератора')
+        parser.add_argument('--prefix', default='bench', help='Префикс имен пользователей, категорий, тегов и постов')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Строк в одной вставке')
+        parser.add_argument('--clear', action='store_true', help='Удалить ранее созданный набор с этим префиксом')
+
+    def rng(self, stage: str) -> random.Random:
+        """Отдельный генератор на каждый этап: число постов не меняет оценки и наоборот"""
+
+        return random.Random(f'{self.seed}:{stage}')
+
+    def progress(self, message: str, started: float, rows: int) -> None:
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        self.stdout.write(f'{message}: {rows:,} за {elapsed:.1f} с ({rows / elapsed:,.0f} строк/с)')
+
+    def clear(self, prefix: str) -> None:
+        users = get_user_model().objects.filter(username__startswith=f'{prefix}_')
+        posts = Bike.objects.filter(slug__startswith=name_prefix(prefix, 'пост'))
+        with transaction.atomic():
+            deleted = UserPostRelation.objects.filter(auth_user__in=users).delete()[0]
+            deleted += posts.delete()[0]
+            deleted += Category.objects.filter(slug__startswith=name_prefix(prefix, 'категория')).delete()[0]
+            deleted += Tags.objects.filter(slug__startswith=name_prefix(prefix, 'тег')).delete()[0]
+            deleted += users.delete()[0]
+        invalidate_sidebar_counts()
+        bump_list_generation()
+        for kind in ('post', 'category', 'tag'):
+            bump_slug_generation(kind)
+        self.stdout.write(f'Удалено объектов: {deleted:,}')
+
+    def create_users(self, prefix: str, count: int) -> list:
+        """id пользователей набора в порядке номеров"""
+
+        User = get_user_model()
+        started = time.perf_counter()
+        password = make_password(BENCH_PASSWORD)
+        names = [f'{prefix}_{i}' for i in range(count)]
+        for start in range(0, count, self.batch_size):
+            User.objects.bulk_create([User(username=name, email=f'{name}@example.com', password=password,
+                                           is_verified_email=True)
+                                      for name in names[start:start + self.batch_size]], ignore_conflicts=True)
+        ids = dict(User.objects.filter(username__startswith=f'{prefix}_').values_list('username', 'pk'))
+        self.progress('Пользователи', started, count)
+        return [ids[name] for name in names]
+
+    def post_rows(self, prefix: str, options: dict):
+        """Строки постов для PostImporter: категории распределены неравномерно, как на живом сайте"""
+
+        rng = self.rng('posts')
+        words = sorted({''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) for _ in range(3000)})
+        rng.shuffle(words)
+        # частоты слов по закону Ципфа: частые слова повторяются, как в живом тексте
+        word_weights = list(accumulate(1 / (rank + 1) for rank in range(len(words))))
+        categories = [f'{prefix} категория {i}' for i in range(options['categories'])]
+        weights = [1 / (i + 1) for i in range(len(categories))]
+        tags = [f'{prefix} тег {i}' for i in range(options['tags'])]
+        for i in range(options['posts']):
+            paragraphs = (' '.join(rng.choices(words, cum_weights=word_weights, k=rng.randint(20, 80))).capitalize()
+                          + '.' for _ in range(rng.randint(1, 5)))
+            yield {
+                'title': f'{prefix} пост {i}',
+                'cat': rng.choices(categories, weights)[0],
+                'content': '\n\n'.join(paragraphs),
+                'tags': rng.sample(tags, min(rng.randint(0, options['tags_per_post']), len(tags))),
+                'created': EPOCH + timedelta(seconds=i * 600 + rng.randrange(600)),
+            }
+
+    def create_posts(self, prefix: str, author_id: int, options: dict) -> list:
+        """id постов набора в порядке номеров; существующие посты пропускаются"""
+
+        started = time.perf_counter()
+        importer = PostImporter(get_user_model()(pk=author_id), on_conflict='skip')
+        rows = self.post_rows(prefix, options)
+        while batch := list(islice(rows, self.batch_size)):
+            importer.import_batch(batch)
+            if self.verbosity > 1:
+                self.stdout.write(f'Постов: {importer.created + importer.skipped:,}')
+        importer.finish()
+        self.progress('Посты', started, importer.created)
+
+        ids = dict(Bike.objects.filter(slug__startswith=name_prefix(prefix, 'пост')).values_list('slug', 'pk'))
+        return [ids[post_slug(f'{prefix} пост {i}')] for i in range(options['posts'])]
+
+    def relation_rows(self, user_ids: list, post_ids: list, options: dict):
+        """Оценки поровну на пользователя, посты каждого пользователя без повторов"""
+
+        rng = self.rng('relations')
+        per_user, extra = divmod(options['relations'], len(user_ids))
+        for number, user_id in enumerate(user_ids):
+            for index in rng.sample(range(len(post_ids)), per_user + (number < extra)):
+                like = rng.random() < options['like_rate']
+                rate = rng.randint(1, 5) if rng.random() < options['rate_rate'] else None
+                yield UserPostRelation(auth_user_id=user_id, bike_id=post_ids[index], like=like, rate=rate)
+
+    def create_relations(self, user_ids: list, post_ids: list, options: dict) -> None:
+        started = time.perf_counter()
+        rows = self.relation_rows(user_ids, post_ids, options)
+        written = 0
+        while batch := list(islice(rows, self.batch_size)):
+            UserPostRelation.objects.bulk_create(batch, ignore_conflicts=True)
+            written += len(batch)
+            if self.verbosity > 1:
+                self.stdout.write(f'Оценок: {written:,}')
+        self.progress('Оценки', started, written)
+
+        started = time.perf_counter()
+        updated = Bike.objects.filter(slug__startswith=name_prefix(self.prefix, 'пост')).recount_counters()
+        cache.delete_many([liked_set_key(user_id) for user_id in user_ids])
+        bump_list_generation()
+        self.progress('Счетчики', started, updated)
+
+    def handle(self, *args, **options):
+        self.seed, self.prefix = options['seed'], options['prefix']
+        self.batch_size = max(options['batch_size'], 1)
+        self.verbosity = options['verbosity']
+        if options['clear']:
+            self.clear(self.prefix)
+            return
+        if options['users'] < 1 or options['categories'] < 1 or options['posts'] < 1:
+            raise CommandError('Нужны хотя бы один пользователь, одна категория и один пост')
+        if options['relations'] > options['users'] * options['posts']:
+            raise CommandError('Оценок не может быть больше, чем пар пользователь - пост')
+
+        started = time.perf_counter()
+        user_ids = self.create_users(self.prefix, options['users'])
+        post_ids = self.create_posts(self.prefix, user_ids[0], options)
+        if options['relations']:
+            self.create_relations(user_ids, post_ids, options)
+        self.stdout.write(self.style.SUCCESS(
+            f'Набор "{self.prefix}" (seed {self.seed}) готов за {time.perf_counter() - started:.1f} с: '
+            f'{len(user_ids):,} пользователей, {len(post_ids):,} постов, {options["relations"]:,} оценок. '
+            f'Пароль пользователей: {BENCH_PASSWORD}'))
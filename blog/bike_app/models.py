@@ -1,13 +1,75 @@
 from django.contrib.auth import get_user_model
-from django.core.cache import cache
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import connections, models, router, transaction
+from django.db.models import (Case, Count, F, FloatField, OuterRef, Q,
+                              Subquery, Sum, When)
+from django.db.models.functions import Cast, Coalesce
 from django.template.defaultfilters import slugify
 from django.urls import reverse
+from django.utils import timezone
 from django_extensions.db.models import TimeStampedModel
 from unidecode import unidecode
 
+from bike_app.caching import (bump_list_generation, change_liked_set,
+                              invalidate_liked_set, invalidate_sidebar_counts)
+from bike_app.search import index_post, index_posts
+from bike_app.slugs import bump_slug_generation
+from bike_blog.images import schedule_image_variants
+from bike_blog.metrics import observe_relation_write
 
-class PublishedManager(models.Manager):
+
+class BikeQuerySet(models.QuerySet):
+    """QuerySet постов с поддержкой денормализованных счетчиков лайков и рейтинга"""
+
+    def with_counters(self) -> 'BikeQuerySet':
+        """Аннотация count_likes и rating из хранимых счетчиков без обращения к таблице оценок"""
+
+        return self.annotate(
+            count_likes=F('like_count'),
+            rating=Case(
+                When(rating_count=0, then=None),
+                default=Cast('rating_sum', FloatField()) / F('rating_count'),
+                output_field=FloatField(),
+            ),
+        )
+
+    def add_to_counters(self, like_count: int = 0, rating_sum: int = 0, rating_count: int = 0) -> int:
+        """Атомарное изменение счетчиков через F-выражения с отметкой counters_modified для инкрементальной выгрузки"""
+
+        deltas = {'like_count': like_count, 'rating_sum': rating_sum, 'rating_count': rating_count}
+        values = {name: F(name) + delta for name, delta in deltas.items() if delta}
+        if not values:
+            return 0
+        return self.update(counters_modified=timezone.now(), **values)
+
+    def _actual_counters(self) -> dict:
+        """Подзапросы, вычисляющие счетчики по таблице UserPostRelation"""
+
+        relations = UserPostRelation.objects.filter(bike=OuterRef('pk')).order_by().values('bike')
+        return {
+            'like_count': Coalesce(Subquery(
+                relations.annotate(amount=Count('pk', filter=Q(like=True))).values('amount')), 0),
+            'rating_sum': Coalesce(Subquery(relations.annotate(amount=Sum('rate')).values('amount')), 0),
+            'rating_count': Coalesce(Subquery(relations.annotate(amount=Count('rate')).values('amount')), 0),
+        }
+
+    def with_drifted_counters(self) -> 'BikeQuerySet':
+        """Посты, у которых хранимые счетчики расходятся с таблицей оценок"""
+
+        actual = {f'actual_{name}': expression for name, expression in self._actual_counters().items()}
+        return self.annotate(**actual).filter(
+            ~Q(like_count=F('actual_like_count'))
+            | ~Q(rating_sum=F('actual_rating_sum'))
+            | ~Q(rating_count=F('actual_rating_count'))
+        )
+
+    def recount_counters(self) -> int:
+        """Пересчет счетчиков одним UPDATE по таблице оценок"""
+
+        return self.update(counters_modified=timezone.now(), **self._actual_counters())
+
+
+class PublishedManager(models.Manager.from_queryset(BikeQuerySet)):
     """Менеджер для получения только опубликованных постов"""
 
     def get_queryset(self):
@@ -26,16 +88,27 @@ class Bike(TimeStampedModel, models.Model):
     slug = models.SlugField(max_length=255, unique=True, db_index=True, blank=True, verbose_name="URL")
     content = models.TextField(blank=True, verbose_name="Текст статьи")
     photo = models.ImageField(upload_to="pictures/%Y/%m/%d/", blank=True, verbose_name="Фото")
+    photo_variants = models.JSONField(default=dict, blank=True, editable=False, verbose_name="Варианты фото")
     is_published = models.IntegerField(choices=Status.choices, default=Status.PUBLISHED, verbose_name="Статус")
     cat = models.ForeignKey('Category', on_delete=models.PROTECT, related_name='posts', verbose_name="Категории")
     tags = models.ManyToManyField("Tags", blank=True, related_name='posts', verbose_name="Теги")
     auth_user = models.ForeignKey(get_user_model(), on_delete=models.SET_NULL, related_name='posts', null=True,
                                   default=None, verbose_name="Автор")
     readers = models.ManyToManyField(get_user_model(), related_name='readers', through='UserPostRelation')
-
-    objects = models.Manager()
+    like_count = models.IntegerField(default=0, editable=False, verbose_name="Количество лайков")
+    rating_sum = models.IntegerField(default=0, editable=False, verbose_name="Сумма оценок")
+    rating_count = models.IntegerField(default=0, editable=False, verbose_name="Количество оценок")
+    # счетчики меняются без modified (это дата поста на страницах), для инкрементальной выгрузки - своя отметка
+    counters_modified = models.DateTimeField(null=True, blank=True, editable=False, db_index=True,
+                                             verbose_name="Изменение счетчиков")
+    search_vector = SearchVectorField(null=True, editable=False)  # заполняется только в PostgreSQL
+
+    objects = BikeQuerySet.as_manager()
     published = PublishedManager()
 
+    COUNTER_FIELDS = ('like_count', 'rating_sum', 'rating_count')
+    DERIVED_FIELDS = COUNTER_FIELDS + ('counters_modified', 'search_vector', 'photo_variants')
+
     def __str__(self):
         return self.title
 
@@ -45,22 +118,72 @@ class Bike(TimeStampedModel, models.Model):
     class Meta:
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
-        ordering = ['-created']
+        ordering = ['-created', '-id']
         indexes = [
-            models.Index(fields=['-created'])
+            # ключи пагинации по курсору: (created, id) для всех постов, опубликованных и по категории
+            models.Index(fields=['-created', '-id']),
+            models.Index(fields=['is_published', '-created', '-id']),
+            models.Index(fields=['cat', 'is_published', '-created', '-id']),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Запоминаем категорию и статус, чтобы пересчитывать счетчики боковой панели только при их изменении"""
+
+        instance = super().from_db(db, field_names, values)
+        instance._stored_listing = (instance.__dict__.get('cat_id'), instance.__dict__.get('is_published'))
+        instance._stored_photo = instance.__dict__.get('photo')
+        instance._stored_slug = instance.__dict__.get('slug')
+        return instance
+
     def save(self, *args, **kwargs):
         """Переопределенный метод сохранения объекта с добавленем значения в поле slug"""
 
         transliterated_title = unidecode(self.title)
         self.slug = slugify(transliterated_title)
+        old_slug = getattr(self, '_stored_slug', None)
+        listing_changed = getattr(self, '_stored_listing', None) != (self.cat_id, self.is_published)
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            # счетчики и поисковый вектор обновляются отдельно, устаревшие значения экземпляра не перезаписываем
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.DERIVED_FIELDS]
         super().save(*args, **kwargs)
-        cache.delete('home_cache')
+        index_post(self)
+        if old_slug != self.slug:
+            # старый адрес продолжает работать через редирект, новый slug не может быть чужим редиректом
+            SlugRedirect.objects.filter(old_slug=self.slug).delete()
+            if old_slug:
+                SlugRedirect.objects.update_or_create(old_slug=old_slug, defaults={'bike': self})
+            self._stored_slug = self.slug
+            bump_slug_generation('post')
+        if listing_changed:
+            invalidate_sidebar_counts()
+            self._stored_listing = (self.cat_id, self.is_published)
+        if self.photo and self.photo.name != getattr(self, '_stored_photo', None):
+            schedule_image_variants('bike_app.tasks.build_post_image_variants', self.pk, self.photo.name)
+            self._stored_photo = self.photo.name
+        bump_list_generation()
 
     def delete(self, *args, **kwargs):
         super().delete(*args, **kwargs)
-        cache.delete('home_cache')
+        invalidate_sidebar_counts()
+        bump_list_generation()
+        bump_slug_generation('post')
+
+
+class SlugRedirect(models.Model):
+    """Прежние slug постов, сменившиеся после изменения заголовка"""
+
+    old_slug = models.SlugField(max_length=255, unique=True, verbose_name="Прежний URL")
+    bike = models.ForeignKey(Bike, on_delete=models.CASCADE, related_name='slug_redirects', verbose_name='Пост')
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.old_slug} -> {self.bike.slug}'
+
+    class Meta:
+        verbose_name = 'Редирект'
+        verbose_name_plural = 'Редиректы'
 
 
 class Category(models.Model):
@@ -85,8 +208,23 @@ class Category(models.Model):
 
         transliterated_name = unidecode(self.name)
         self.slug = slugify(transliterated_name)
+        renamed = self.pk is not None and Category.objects.filter(pk=self.pk).exclude(name=self.name).exists()
         super().save(*args, **kwargs)
+        if renamed:
+            # название категории входит в поисковый индекс постов: пачками по несколько запросов, а не по посту
+            posts = self.posts.only('pk', 'title', 'content', 'cat_id').order_by('pk')
+            for start in range(0, posts.count(), 500):
+                index_posts(posts[start:start + 500])
+        invalidate_sidebar_counts()
+        bump_list_generation()
+        bump_slug_generation('category')
 
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        invalidate_sidebar_counts()
+        bump_list_generation()
+        bump_slug_generation('category')
+        return result
 
 
 class Tags(models.Model):
@@ -111,8 +249,160 @@ class Tags(models.Model):
         transliterated_tag = unidecode(self.tag)
         self.slug = slugify(transliterated_tag)
         super().save(*args, **kwargs)
+        invalidate_sidebar_counts()
+        bump_list_generation()
+        bump_slug_generation('tag')
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        invalidate_sidebar_counts()
+        bump_list_generation()
+        bump_slug_generation('tag')
+        return result
+
+
+class SearchTerm(models.Model):
+    """Инвертированный индекс основ слов постов для СУБД без встроенного полнотекстового поиска"""
+
+    term = models.CharField(max_length=64, verbose_name="Основа слова")
+    bike = models.ForeignKey(Bike, on_delete=models.CASCADE, related_name='search_terms', verbose_name='Пост')
+    weight = models.FloatField(verbose_name="Вес")
+
+    def __str__(self):
+        return self.term
+
+    class Meta:
+        verbose_name = 'Поисковый термин'
+        verbose_name_plural = 'Поисковые термины'
+        indexes = [
+            models.Index(fields=['term', 'bike']),
+        ]
 
 
+class UserPostRelationQuerySet(models.QuerySet):
+    """
+    Атомарные операции над оценками пользователя: проверка существования строки и запись
+    выполняются одним запросом, поэтому параллельные клики не создают дублей и не теряют изменений.
+    """
+
+    @property
+    def write_db(self) -> str:
+        """База для записи: self.db у запроса без select_for_update - база для чтения, а это может быть реплика"""
+
+        return self._db or router.db_for_write(self.model, **self._hints)
+
+    def _quote(self, name: str) -> str:
+        return connections[self.write_db].ops.quote_name(name)
+
+    def _execute(self, sql: str, params: list) -> tuple:
+        with connections[self.write_db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchone()
+
+    def _supports_upsert(self) -> bool:
+        """INSERT ... ON CONFLICT DO UPDATE ... RETURNING (PostgreSQL, SQLite 3.35+)"""
+
+        features = connections[self.write_db].features
+        return features.supports_update_conflicts_with_target and features.can_return_columns_from_insert
+
+    def _locked_update(self, user_id: int, bike_id: int, get_values) -> tuple:
+        """
+        Запасной путь для СУБД без upsert: строка создается без конфликта, блокируется и изменяется.
+        get_values получает заблокированную оценку и возвращает новые значения полей.
+        """
+
+        self.bulk_create([self.model(auth_user_id=user_id, bike_id=bike_id)], ignore_conflicts=True)
+        relation = self.select_for_update().get(auth_user_id=user_id, bike_id=bike_id)
+        values = get_values(relation)
+        self.filter(pk=relation.pk).update(**values)
+        return (relation.like, relation.rate), (values.get('like', relation.like), values.get('rate', relation.rate))
+
+    def _upsert_returning_old(self, user_id: int, bike_id: int, values: dict):
+        """
+        PostgreSQL: одна команда, которая блокирует существующую строку и меняет ее, либо вставляет новую.
+        Возвращает прежние (like, rate), (False, None) для вставленной строки или None, если строку
+        параллельно вставил другой запрос.
+        """
+
+        table, like, rate = self._quote(self.model._meta.db_table), self._quote('like'), self._quote('rate')
+        row = {'like': False, 'rate': None, **values}
+        assignments = ', '.join(f'{self._quote(name)} = %s' for name in values)
+        sql = (
+            f'WITH old AS (SELECT id, {like}, {rate} FROM {table} '
+            f'WHERE auth_user_id = %s AND bike_id = %s FOR UPDATE), '
+            f'changed AS (UPDATE {table} SET {assignments} FROM old WHERE {table}.id = old.id '
+            f'RETURNING old.{like}, old.{rate}), '
+            f'inserted AS (INSERT INTO {table} (auth_user_id, bike_id, {like}, {rate}) '
+            f'SELECT %s, %s, %s, %s::smallint WHERE NOT EXISTS (SELECT 1 FROM old) '
+            f'ON CONFLICT (auth_user_id, bike_id) DO NOTHING RETURNING FALSE, NULL::smallint) '
+            f'SELECT * FROM changed UNION ALL SELECT * FROM inserted'
+        )
+        return self._execute(sql, [user_id, bike_id, *values.values(),
+                                   user_id, bike_id, row['like'], row['rate']])
+
+    def _apply_change(self, user_id: int, bike_id: int, old: tuple, new: tuple) -> None:
+        """Изменение счетчиков поста на разницу между прежним и новым состоянием оценки"""
+
+        old_values, new_values = self.model._counter_values(*old), self.model._counter_values(*new)
+        Bike.objects.using(self.write_db).filter(pk=bike_id).add_to_counters(
+            **{name: new_values[name] - old_values[name] for name in new_values})
+
+    def _invalidate_caches(self, user_id: int, bike_id: int, old: tuple, new: tuple) -> None:
+        """
+        Изменение множества лайков пользователя (change_liked_set) и сброс кэша списков после записи оценки,
+        как в bump_slug_generation: сразу и, внутри внешней транзакции, еще раз после ее коммита - кэш,
+        собранный параллельно по данным до коммита, не переживет его.
+        """
+
+        if bool(old[0]) != bool(new[0]):
+            change_liked_set(user_id, **{'liked' if new[0] else 'unliked': [bike_id]}, using=self.write_db)
+        if old != new:
+            bump_list_generation()
+            if connections[self.write_db].in_atomic_block:
+                transaction.on_commit(bump_list_generation, using=self.write_db)
+
+    def toggle_like(self, user_id: int, bike_id: int) -> bool:
+        """Переключение лайка одним INSERT ... ON CONFLICT DO UPDATE ... RETURNING, возвращает новое состояние"""
+
+        with transaction.atomic(using=self.write_db):
+            if self._supports_upsert():
+                table, like = self._quote(self.model._meta.db_table), self._quote('like')
+                liked, = self._execute(
+                    f'INSERT INTO {table} (auth_user_id, bike_id, {like}, rate) VALUES (%s, %s, %s, NULL) '
+                    f'ON CONFLICT (auth_user_id, bike_id) DO UPDATE SET {like} = NOT {table}.{like} '
+                    f'RETURNING {table}.{like}',
+                    [user_id, bike_id, True],
+                )
+                liked = bool(liked)
+                old, new = (not liked, None), (liked, None)
+            else:
+                old, new = self._locked_update(user_id, bike_id, lambda relation: {'like': not relation.like})
+            self._apply_change(user_id, bike_id, old, new)
+        self._invalidate_caches(user_id, bike_id, old, new)
+        observe_relation_write('like', 'sync')
+        return new[0]
+
+    def set_relation(self, user_id: int, bike_id: int, **values) -> tuple:
+        """
+        Установка лайка и/или оценки с созданием строки при необходимости, возвращает новые (like, rate).
+        В PostgreSQL - одной командой, в остальных СУБД - под блокировкой строки.
+        """
+
+        with transaction.atomic(using=self.write_db):
+            old = None
+            if values and connections[self.write_db].vendor == 'postgresql':
+                old = self._upsert_returning_old(user_id, bike_id, values)
+            if old is None:
+                old, new = self._locked_update(user_id, bike_id, lambda relation: values)
+            else:
+                new = (values.get('like', old[0]), values.get('rate', old[1]))
+            self._apply_change(user_id, bike_id, old, new)
+        self._invalidate_caches(user_id, bike_id, old, new)
+        for kind in ('like', 'rate'):
+            if kind in values:
+                observe_relation_write(kind, 'sync')
+        return new
+
 
 class UserPostRelation(models.Model):
     """Модель для хранения отношений пользователей и постов"""
@@ -129,17 +419,65 @@ class UserPostRelation(models.Model):
     like = models.BooleanField(default=False, verbose_name='Like')
     rate = models.PositiveSmallIntegerField(choices=RATE_CHOICES, blank=True, null=True, verbose_name='Рэйтинг')
 
+    objects = UserPostRelationQuerySet.as_manager()
+
     def __str__(self):
         return f' {self.auth_user.username}: {self.bike.title}, rate {self.rate}'
 
     class Meta:
         verbose_name = 'Оценки'
         verbose_name_plural = 'Оценки'
+        constraints = [
+            models.UniqueConstraint(fields=['auth_user', 'bike'], name='unique_user_post_relation'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Запоминаем сохраненное состояние, чтобы при записи изменять счетчики поста на разницу"""
+
+        instance = super().from_db(db, field_names, values)
+        instance._stored_state = instance._counter_state()
+        return instance
+
+    def _counter_state(self) -> tuple:
+        return self.bike_id, self.like, self.rate
+
+    @staticmethod
+    def _counter_values(like: bool, rate) -> dict:
+        return {'like_count': int(bool(like)), 'rating_sum': rate or 0, 'rating_count': int(rate is not None)}
+
+    def _shift_counters(self, state: tuple, sign: int) -> None:
+        """Прибавляет (sign=1) или вычитает (sign=-1) вклад оценки в счетчики поста"""
+
+        bike_id, like, rate = state
+        values = self._counter_values(like, rate)
+        Bike.objects.filter(pk=bike_id).add_to_counters(**{name: sign * value for name, value in values.items()})
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        cache.delete('home_cache')
+        stored = getattr(self, '_stored_state', None)
+        current = self._counter_state()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if stored is not None and stored[0] == current[0]:
+                old, new = self._counter_values(*stored[1:]), self._counter_values(*current[1:])
+                Bike.objects.filter(pk=self.bike_id).add_to_counters(
+                    **{name: new[name] - old[name] for name in new})
+            else:
+                if stored is not None:
+                    self._shift_counters(stored, -1)
+                self._shift_counters(current, 1)
+        self._stored_state = current
+        if stored is None or stored[:2] != current[:2]:
+            invalidate_liked_set(self.auth_user_id)
+        bump_list_generation()
 
     def delete(self, *args, **kwargs):
-        super().delete(*args, **kwargs)
-        cache.delete('home_cache')
+        state = getattr(self, '_stored_state', None) or self._counter_state()
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            self._shift_counters(state, -1)
+        self._stored_state = None
+        if state[1]:
+            invalidate_liked_set(self.auth_user_id)
+        bump_list_generation()
+        return result
@@ -0,0 +1,161 @@
+import base64
+import hashlib
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    """Курсор поврежден или не относится к текущему порядку сортировки"""
+
+
+def encode_cursor(value, pk: int, direction: str) -> str:
+    """Непрозрачный токен позиции (значение ключа сортировки - дата или число, id, направление)"""
+
+    raw = json.dumps([value.isoformat() if hasattr(value, 'isoformat') else value, pk, direction],
+                     separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        value, pk, direction = json.loads(raw)
+        if isinstance(value, str):
+            value = parse_datetime(value)
+        elif not isinstance(value, (int, float)) or isinstance(value, bool):
+            value = None
+    except (ValueError, TypeError):
+        raise InvalidCursor(token)
+    if value is None or not isinstance(pk, int) or direction not in ('next', 'prev'):
+        raise InvalidCursor(token)
+    return value, pk, direction
+
+
+def approximate_count(queryset: QuerySet) -> int:
+    """
+    Приблизительное количество объектов без COUNT(*) на каждый запрос:
+    для нефильтрованной таблицы в PostgreSQL - статистика планировщика, иначе точный COUNT с кэшированием.
+    """
+
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] >= 0:
+            return row[0]
+
+    key = 'approximate_count:' + hashlib.md5(str(queryset.order_by().query).encode()).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.order_by().count()
+        cache.set(key, count, timeout=settings.APPROXIMATE_COUNT_TIMEOUT)
+    return count
+
+
+class KeysetPage:
+    """Страница, полученная по курсору"""
+
+    def __init__(self, object_list: list, next_cursor: str = None, previous_cursor: str = None,
+                 approximate_total: int = None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.approximate_total = approximate_total
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+    def has_other_pages(self) -> bool:
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Пагинация по ключу (field, id) вместо OFFSET: каждая страница - это WHERE по индексу и LIMIT,
+    поэтому глубокие страницы стоят столько же, сколько первая.
+    """
+
+    def __init__(self, queryset: QuerySet, per_page: int, field: str = 'created', descending: bool = True,
+                 with_total: bool = False):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.field = field
+        self.descending = descending
+        self.with_total = with_total
+
+    def _ordered(self, forward: bool) -> QuerySet:
+        descending = self.descending == forward
+        prefix = '-' if descending else ''
+        return self.queryset.order_by(f'{prefix}{self.field}', f'{prefix}id')
+
+    def _after(self, value, pk: int, forward: bool) -> Q:
+        lookup = 'lt' if self.descending == forward else 'gt'
+        return Q(**{f'{self.field}__{lookup}': value}) | Q(**{self.field: value, f'id__{lookup}': pk})
+
+    def _key(self, row) -> tuple:
+        """Значение ключа и id строки: объекта модели или словаря из values()"""
+
+        if isinstance(row, dict):
+            return row[self.field], row['id']
+        return getattr(row, self.field), row.pk
+
+    def _query(self, cursor: str = None) -> tuple:
+        forward = True
+        queryset = self._ordered(forward)
+        if cursor:
+            value, pk, direction = decode_cursor(cursor)
+            forward = direction == 'next'
+            queryset = self._ordered(forward).filter(self._after(value, pk, forward))
+        return queryset[:self.per_page + 1], forward
+
+    def _build(self, rows: list, cursor: str, forward: bool, total: int = None) -> KeysetPage:
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if forward:
+            has_next, has_previous = has_more, bool(cursor)
+        else:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = encode_cursor(*self._key(rows[-1]), 'next')
+        if rows and has_previous:
+            previous_cursor = encode_cursor(*self._key(rows[0]), 'prev')
+        return KeysetPage(rows, next_cursor, previous_cursor, total)
+
+    def page(self, cursor: str = None) -> KeysetPage:
+        """Страница после (или перед) позицией курсора, без курсора - первая страница"""
+
+        queryset, forward = self._query(cursor)
+        rows = list(queryset)
+        total = approximate_count(self.queryset) if self.with_total else None
+        return self._build(rows, cursor, forward, total)
+
+    async def apage(self, cursor: str = None) -> KeysetPage:
+        """page() для асинхронных представлений: строки читаются асинхронным ORM"""
+
+        queryset, forward = self._query(cursor)
+        rows = [row async for row in queryset]
+        total = await sync_to_async(approximate_count)(self.queryset) if self.with_total else None
+        return self._build(rows, cursor, forward, total)
@@ -0,0 +1,230 @@
+import math
+import re
+from collections import Counter
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Case, Count, F, FloatField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from bike_app.pagination import approximate_count
+
+VOWELS = 'аеиоуыэюя'
+
+PERFECTIVE_GERUND = (('в', 'вши', 'вшись'), ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'))
+ADJECTIVE = ((), ('ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом', 'его',
+                  'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею'))
+PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+REFLEXIVE = ((), ('ся', 'сь'))
+VERB = (('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'ешь', 'нно'),
+        ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ило',
+         'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'))
+NOUN = ((), ('а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой', 'ий',
+             'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю',
+             'ия', 'ья', 'я'))
+SUPERLATIVE = ((), ('ейш', 'ейше'))
+DERIVATIONAL = ((), ('ост', 'ость'))
+
+WORD_RE = re.compile(r'\w+')
+
+
+def _endings(groups: tuple) -> list:
+    """Окончания группы от длинных к коротким, первая подгруппа требует перед собой 'а' или 'я'"""
+
+    preceded, plain = groups
+    endings = [(ending, True) for ending in preceded] + [(ending, False) for ending in plain]
+    return sorted(endings, key=lambda item: len(item[0]), reverse=True)
+
+
+_ENDINGS = {name: _endings(groups) for name, groups in {
+    'gerund': PERFECTIVE_GERUND, 'adjective': ADJECTIVE, 'participle': PARTICIPLE, 'reflexive': REFLEXIVE,
+    'verb': VERB, 'noun': NOUN, 'superlative': SUPERLATIVE, 'derivational': DERIVATIONAL,
+}.items()}
+
+
+def _regions(word: str) -> tuple:
+    """Начала областей RV, R1 и R2 алгоритма Snowball"""
+
+    rv = r1 = r2 = len(word)
+    for i, char in enumerate(word):
+        if char in VOWELS:
+            rv = i + 1
+            break
+    for i in range(1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            r1 = i + 1
+            break
+    for i in range(r1 + 1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            r2 = i + 1
+            break
+    return rv, r1, r2
+
+
+def _strip(word: str, start: int, group: str):
+    """Отрезает самое длинное окончание группы внутри области, None - если окончание не найдено"""
+
+    for ending, preceded in _ENDINGS[group]:
+        stem_length = len(word) - len(ending)
+        if word.endswith(ending) and stem_length >= start:
+            if preceded and not (stem_length - 1 >= start and word[stem_length - 1] in 'ая'):
+                return None
+            return word[:stem_length]
+    return None
+
+
+@lru_cache(maxsize=100000)
+def stem(word: str) -> str:
+    """Стемминг русского слова по алгоритму Snowball, слова на других языках возвращаются без изменений.
+    Словарь текстов ограничен, поэтому основы запоминаются: индексация пачки постов не стеммит слово повторно
+    """
+
+    word = word.lower().replace('ё', 'е')
+    rv, r1, r2 = _regions(word)
+    if rv >= len(word):
+        return word
+
+    stripped = _strip(word, rv, 'gerund')
+    if stripped is None:
+        word = _strip(word, rv, 'reflexive') or word
+        for group in ('adjective', 'verb', 'noun'):
+            stripped = _strip(word, rv, group)
+            if stripped is not None:
+                if group == 'adjective':
+                    stripped = _strip(stripped, rv, 'participle') or stripped
+                word = stripped
+                break
+    else:
+        word = stripped
+
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+    word = _strip(word, r2, 'derivational') or word
+
+    if word.endswith('нн') and len(word) - 2 >= rv:
+        return word[:-1]
+    stripped = _strip(word, rv, 'superlative')
+    if stripped is not None:
+        return stripped[:-1] if stripped.endswith('нн') else stripped
+    if word.endswith('ь') and len(word) - 1 >= rv:
+        return word[:-1]
+    return word
+
+
+def tokenize(text: str) -> list:
+    """Основы слов текста в порядке следования"""
+
+    return [stem(word)[:64] for word in WORD_RE.findall(text.lower())]
+
+
+def uses_postgres() -> bool:
+    return connection.vendor == 'postgresql'
+
+
+def index_post(bike) -> None:
+    """Обновление поискового индекса поста: tsvector в PostgreSQL, инвертированный индекс в остальных СУБД"""
+
+    from bike_app.models import Bike, SearchTerm
+
+    category = bike.cat.name if bike.cat_id else ''
+    if uses_postgres():
+        from django.contrib.postgres.search import SearchVector
+
+        config = settings.SEARCH_CONFIG
+        Bike.objects.filter(pk=bike.pk).update(search_vector=(
+            SearchVector(Value(bike.title), weight='A', config=config)
+            + SearchVector(Value(bike.content), weight='B', config=config)
+            + SearchVector(Value(category), weight='C', config=config)
+        ))
+        return
+
+    with transaction.atomic():
+        SearchTerm.objects.filter(bike_id=bike.pk).delete()
+        SearchTerm.objects.bulk_create(
+            SearchTerm(bike_id=bike.pk, term=term, weight=weight)
+            for term, weight in _term_weights(bike.title, bike.content, category).items()
+        )
+
+
+def _term_weights(title: str, content: str, category: str) -> Counter:
+    weights = Counter()
+    for text, weight in ((title, 1.0), (content, 0.4), (category, 0.2)):
+        for term in tokenize(text):
+            weights[term] += weight
+    return weights
+
+
+def index_posts(bikes) -> None:
+    """Обновление поискового индекса пачки постов: один UPDATE в PostgreSQL, один DELETE и INSERT в остальных СУБД"""
+
+    from bike_app.models import Bike, Category, SearchTerm
+
+    bikes = list(bikes)
+    if not bikes:
+        return
+    if uses_postgres():
+        from django.contrib.postgres.search import SearchVector
+
+        config = settings.SEARCH_CONFIG
+        category = Coalesce(Subquery(Category.objects.filter(pk=OuterRef('cat_id')).values('name')[:1]), Value(''))
+        Bike.objects.filter(pk__in=[bike.pk for bike in bikes]).update(search_vector=(
+            SearchVector('title', weight='A', config=config)
+            + SearchVector('content', weight='B', config=config)
+            + SearchVector(category, weight='C', config=config)
+        ))
+        return
+
+    names = dict(Category.objects.filter(pk__in={bike.cat_id for bike in bikes}).values_list('pk', 'name'))
+    with transaction.atomic():
+        SearchTerm.objects.filter(bike_id__in=[bike.pk for bike in bikes]).delete()
+        SearchTerm.objects.bulk_create((
+            SearchTerm(bike_id=bike.pk, term=term, weight=weight)
+            for bike in bikes
+            for term, weight in _term_weights(bike.title, bike.content, names.get(bike.cat_id, '')).items()
+        ), batch_size=1000)
+
+
+def search_posts(queryset, query: str):
+    """Посты, содержащие все слова запроса, с аннотацией search_rank и сортировкой по релевантности"""
+
+    if uses_postgres():
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        search_query = SearchQuery(query, config=settings.SEARCH_CONFIG, search_type='websearch')
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-search_rank', '-created', '-id')
+
+    from bike_app.models import SearchTerm
+
+    terms = set(tokenize(query))
+    if not terms:
+        return queryset.none()
+    # idf по инвертированному индексу: редкие слова весят больше
+    total = max(approximate_count(queryset.model.objects.all()), 1)
+    frequencies = dict(SearchTerm.objects.filter(term__in=terms).values_list('term').annotate(amount=Count('pk')))
+    if len(frequencies) < len(terms):
+        return queryset.none()
+    rank = Sum(Case(
+        *[When(search_terms__term=term, then=F('search_terms__weight') * math.log(1 + total / amount))
+          for term, amount in frequencies.items()],
+        output_field=FloatField(),
+    ))
+    return queryset.filter(search_terms__term__in=terms).annotate(
+        search_rank=rank, matched_terms=Count('search_terms__term', distinct=True)
+    ).filter(matched_terms=len(terms)).order_by('-search_rank', '-created', '-id')
+
+
+def create_postgres_index(using: str = 'default', **kwargs) -> None:
+    """GIN-индекс по search_vector создается только в PostgreSQL, поэтому не описан в Meta.indexes"""
+
+    from bike_app.models import Bike
+
+    db = connections[using]
+    if db.vendor != 'postgresql':
+        return
+    table = db.ops.quote_name(Bike._meta.db_table)
+    with db.cursor() as cursor:
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS bike_app_bike_search_vector_gin ON {table} '
+                       f'USING gin (search_vector)')
@@ -0,0 +1,25 @@
+from django.utils import timezone
+
+from bike_app.caching import bump_list_generation, invalidate_sidebar_counts
+
+
+def post_tags_changed(sender, instance, action: str, reverse: bool = False, pk_set=None, **kwargs) -> None:
+    """
+    Смена тегов поста меняет счетчики тегов в боковой панели и списки постов по тегам.
+    У затронутых постов обновляется modified, от которого зависит ETag страницы поста.
+    """
+
+    from bike_app.models import Bike
+
+    if not reverse:
+        post_ids = {instance.pk}
+    elif action == 'pre_clear':
+        # после очистки связи тега с постами уже не найти
+        post_ids = set(instance.posts.values_list('pk', flat=True))
+    else:
+        post_ids = pk_set or set()
+    if action in ('post_add', 'post_remove', 'post_clear') or (reverse and action == 'pre_clear'):
+        Bike.objects.filter(pk__in=post_ids).update(modified=timezone.now())
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_sidebar_counts()
+        bump_list_generation()
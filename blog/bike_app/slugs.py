@@ -0,0 +1,151 @@
+import hashlib
+import math
+import time
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from bike_blog.db_router import primary_reads
+
+KINDS = ('post', 'category', 'tag')
+
+
+class BloomFilter:
+    """Компактное множество с ложноположительными, но без ложноотрицательных ответов"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, value: str) -> None:
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class SlugMatch(NamedTuple):
+    """Результат поиска slug: pk объекта и актуальный slug, если адрес устарел"""
+
+    pk: Optional[int] = None
+    redirect_to: Optional[str] = None
+
+
+class _LocalRegistry:
+    """Состояние реестра в процессе, действительное для одного поколения"""
+
+    def __init__(self, generation=None):
+        self.generation = generation
+        self.bloom = None
+        self.matches = {}
+
+
+_local = {kind: _LocalRegistry() for kind in KINDS}
+
+
+def _generation_key(kind: str) -> str:
+    return f'slugs:{kind}:generation'
+
+
+def get_slug_generation(kind: str) -> int:
+    generation = cache.get(_generation_key(kind))
+    if generation is None:
+        cache.add(_generation_key(kind), int(time.time() * 1000), timeout=None)
+        generation = cache.get(_generation_key(kind))
+    return generation
+
+
+def bump_slug_generation(kind: str) -> None:
+    """
+    Сброс реестра вида при изменении slug. Поколение меняется сразу и еще раз после коммита:
+    фильтр, построенный параллельно по данным до коммита, останется в старом поколении.
+    """
+
+    def bump():
+        try:
+            cache.incr(_generation_key(kind))
+        except ValueError:
+            get_slug_generation(kind)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def _known_slugs(kind: str) -> list:
+    """Все slug вида, включая старые адреса постов"""
+
+    from bike_app.models import Bike, Category, SlugRedirect, Tags
+
+    if kind == 'post':
+        return list(Bike.objects.values_list('slug', flat=True)) \
+            + list(SlugRedirect.objects.values_list('old_slug', flat=True))
+    model = Category if kind == 'category' else Tags
+    return list(model.objects.values_list('slug', flat=True))
+
+
+def _find(kind: str, slug: str) -> SlugMatch:
+    from bike_app.models import Bike, Category, SlugRedirect, Tags
+
+    model = {'post': Bike, 'category': Category, 'tag': Tags}[kind]
+    pk = model.objects.filter(slug=slug).values_list('pk', flat=True).first()
+    if pk is not None:
+        return SlugMatch(pk)
+    if kind == 'post':
+        moved = SlugRedirect.objects.filter(old_slug=slug).values_list('bike_id', 'bike__slug').first()
+        if moved is not None:
+            return SlugMatch(*moved)
+    return SlugMatch()
+
+
+def _get_bloom(kind: str, generation: int) -> BloomFilter:
+    key = f'slugs:{kind}:{generation}:bloom'
+    bloom = cache.get(key)
+    if bloom is None:
+        with primary_reads():
+            slugs = _known_slugs(kind)
+        bloom = BloomFilter(len(slugs) * 2 + 1000, settings.SLUG_BLOOM_ERROR_RATE)
+        for slug in slugs:
+            bloom.add(slug)
+        cache.set(key, bloom, timeout=settings.SLUG_REGISTRY_TIMEOUT)
+    return bloom
+
+
+def resolve_slug(kind: str, slug: str) -> SlugMatch:
+    """
+    Поиск объекта по slug: словарь в процессе, затем фильтр Блума (несуществующий slug - без запроса к базе),
+    затем общий кэш и только потом база.
+    """
+
+    generation = get_slug_generation(kind)
+    local = _local[kind]
+    if local.generation != generation:
+        local = _local[kind] = _LocalRegistry(generation)
+    if slug in local.matches:
+        return local.matches[slug]
+
+    if local.bloom is None:
+        local.bloom = _get_bloom(kind, generation)
+    if slug not in local.bloom:
+        return SlugMatch()
+
+    key = f'slugs:{kind}:{generation}:{hashlib.md5(slug.encode()).hexdigest()}'
+    match = cache.get(key)
+    if match is None:
+        with primary_reads():
+            match = _find(kind, slug)
+        cache.set(key, tuple(match), timeout=settings.SLUG_REGISTRY_TIMEOUT)
+    match = SlugMatch(*match)
+    if len(local.matches) >= settings.SLUG_REGISTRY_LOCAL_SIZE:
+        local.matches.clear()
+    local.matches[slug] = match
+    return match
@@ -0,0 +1,21 @@
+from celery import shared_task
+from django.conf import settings
+
+from bike_app.caching import bump_list_generation
+from bike_app.likes import flush_like_buffer
+from bike_app.models import Bike
+from bike_blog.images import build_variants
+
+
+@shared_task
+def flush_likes() -> int:
+    """Периодическая запись накопленных в буфере лайков в базу"""
+    return flush_like_buffer()
+
+
+@shared_task
+def build_post_image_variants(post_id: int, name: str) -> None:
+    """Создает уменьшенные копии загруженного фото поста для карточек и страницы поста"""
+
+    if build_variants(Bike, post_id, 'photo', name, settings.IMAGE_VARIANTS['post']):
+        bump_list_generation()
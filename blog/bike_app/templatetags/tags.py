@@ -1,16 +1,39 @@
 from django import template
-from django.db.models import Count
+from django.utils.html import format_html
 
-from bike_app.models import *
+from bike_app.caching import get_sidebar_counts
+from bike_blog.images import MIME_TYPES, srcset, variant_urls
 
 register = template.Library()
 
 
 @register.inclusion_tag('bike_app/list_categories.html')
 def show_categories(cat_selected=0):
-    return {'cats': Category.objects.annotate(amount=Count("posts")).filter(amount__gt=0), 'cat_selected': cat_selected}
+    return {'cats': get_sidebar_counts()['categories'], 'cat_selected': cat_selected}
 
 
 @register.inclusion_tag('bike_app/list_tags.html')
 def show_tags():
-    return {"tags": Tags.objects.annotate(amount=Count("posts")).filter(amount__gt=0)}
+    return {"tags": get_sidebar_counts()['tags']}
+
+
+@register.simple_tag
+def picture(instance, variant: str, sizes: str = '100vw', css_class: str = '', alt: str = '', width=None,
+            field: str = 'photo'):
+    """
+    <picture> с WebP и JPEG вариантами изображения и srcset по ширинам.
+    Пока варианты не созданы, выводится исходное изображение шириной width.
+    """
+
+    field_file = getattr(instance, field)
+    entries = variant_urls(field_file, getattr(instance, f'{field}_variants', None)).get(variant)
+    if not entries:
+        return format_html('<img src="{}"{} class="{}" alt="{}" loading="lazy">', field_file.url,
+                           format_html(' width="{}"', width) if width else '', css_class, alt)
+    fallback = entries[0]
+    return format_html(
+        '<picture><source type="{}" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" class="{}" alt="{}" loading="lazy"></picture>',
+        MIME_TYPES['webp'], srcset(entries, 'webp'), sizes,
+        fallback['jpeg'], srcset(entries, 'jpeg'), sizes, fallback['width'], fallback['height'], css_class, alt,
+    )
@@ -1,8 +1,50 @@
 from http import HTTPStatus
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import Counter
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, IntegrityError, connection, connections
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils import timezone
 
+from bike_blog import db_router, urls as site_urls
+from bike_blog.profiling import call_tree, flame_boxes, get_profile
+from bike_blog.query_budget import BUDGETS, count_queries
+
+from . import likes
+from .admin import BikeAdmin
+from .caching import (get_liked_set, get_sidebar_counts, liked_post_ids,
+                      liked_set_key, list_page_key)
+from .export import export_posts
+from .likes import flush_like_buffer, pending_likes
 from .models import *
+from .search import search_posts, stem
+from .slugs import BloomFilter, resolve_slug
+from PIL import Image
+from prometheus_client import REGISTRY
+
+from .tasks import build_post_image_variants, flush_likes
+from .templatetags.tags import show_categories, show_tags
+from .urls import async_urlpatterns
+from .utils import DataMixin
 
 
 class PageTestCase(TestCase):
@@ -11,6 +53,8 @@ class PageTestCase(TestCase):
     def setUp(self):
         """Инициализация перед выполнением каждого теста"""
 
+        cache.clear()
+
     def test_homepage(self):
         """Тест главной страницы"""
 
@@ -38,14 +82,26 @@ class PageTestCase(TestCase):
         self.assertQuerysetEqual(response.context_data['posts'], b[:1])
 
     def test_paginate_mainpage(self):
-        """Тест пагинации"""
+        """Тест пагинации по курсору"""
 
         path = reverse('home')
-        page = 2
-        paginate_by = 1
-        response = self.client.get(path + f'?page={page}')
         b = Bike.published.all().select_related('cat')
-        self.assertQuerysetEqual(response.context_data['posts'], b[(page - 1) * paginate_by:page * paginate_by])
+        response = self.client.get(path)
+        next_cursor = response.context_data['page_obj'].next_cursor
+        response = self.client.get(path, {'cursor': next_cursor})
+        self.assertQuerysetEqual(response.context_data['posts'], b[1:2])
+        self.assertEqual(b.count(), response.context_data['page_obj'].approximate_total)
+
+        previous_cursor = response.context_data['page_obj'].previous_cursor
+        response = self.client.get(path, {'cursor': previous_cursor})
+        self.assertQuerysetEqual(response.context_data['posts'], b[:1])
+        self.assertFalse(response.context_data['page_obj'].has_previous())
+
+    def test_paginate_wrong_cursor(self):
+        """Тест неверного курсора"""
+
+        response = self.client.get(reverse('home'), {'cursor': 'wrong'})
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
 
     def test_content_post(self):
         """Тест содержания поста"""
@@ -57,3 +113,1283 @@ class PageTestCase(TestCase):
 
     def tearDown(self):
         "Действия после выполнения каждого теста"
+
+
+class CountersTestCase(TestCase):
+    """Тест денормализованных счетчиков лайков и рейтинга"""
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        self.user = get_user_model().objects.create(username='test_username')
+        self.user2 = get_user_model().objects.create(username='test_username2')
+        self.cat = Category.objects.create(name='cat1')
+        self.post = Bike.published.create(title='post1', content='cont1', cat=self.cat)
+
+    def test_relation_changes_counters(self):
+        """Тест изменения счетчиков при создании, изменении и удалении оценок"""
+
+        relation = UserPostRelation.objects.create(auth_user=self.user, bike=self.post, like=True, rate=4)
+        UserPostRelation.objects.create(auth_user=self.user2, bike=self.post, rate=2)
+        self.post.refresh_from_db()
+        self.assertEqual((1, 6, 2), (self.post.like_count, self.post.rating_sum, self.post.rating_count))
+
+        relation = UserPostRelation.objects.get(pk=relation.pk)
+        relation.like = False
+        relation.rate = 5
+        relation.save()
+        self.post.refresh_from_db()
+        self.assertEqual((0, 7, 2), (self.post.like_count, self.post.rating_sum, self.post.rating_count))
+
+        relation.delete()
+        self.post.refresh_from_db()
+        self.assertEqual((0, 2, 1), (self.post.like_count, self.post.rating_sum, self.post.rating_count))
+        self.assertEqual(2.0, Bike.objects.with_counters().get(pk=self.post.pk).rating)
+
+    def test_reader_like(self):
+        """Тест лайка и повторного клика через представление"""
+
+        self.client.force_login(self.user)
+        path = reverse('reader_like', args=[self.post.pk])
+        self.client.get(path, HTTP_REFERER=reverse('home'))
+        self.post.refresh_from_db()
+        self.assertEqual(1, self.post.like_count)
+
+        self.client.get(path, HTTP_REFERER=reverse('home'))
+        self.post.refresh_from_db()
+        self.assertEqual(0, self.post.like_count)
+
+    def test_post_save_keeps_counters(self):
+        """Тест сохранения поста с устаревшими значениями счетчиков"""
+
+        stale = Bike.objects.get(pk=self.post.pk)
+        UserPostRelation.objects.create(auth_user=self.user, bike=self.post, like=True)
+        stale.content = 'cont2'
+        stale.save()
+        self.post.refresh_from_db()
+        self.assertEqual(1, self.post.like_count)
+
+    def test_rebuild_counters_command(self):
+        """Тест команды пересчета счетчиков"""
+
+        UserPostRelation.objects.create(auth_user=self.user, bike=self.post, like=True, rate=3)
+        Bike.objects.filter(pk=self.post.pk).update(like_count=10, rating_sum=0, rating_count=0)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_counters', '--check', stdout=StringIO())
+
+        call_command('rebuild_counters', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual((1, 3, 1), (self.post.like_count, self.post.rating_sum, self.post.rating_count))
+        call_command('rebuild_counters', '--check', stdout=StringIO())
+
+
+class ListCacheTestCase(TestCase):
+    """Тест кэша страниц списков постов"""
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        cache.clear()
+        self.user = get_user_model().objects.create(username='test_username')
+        self.user2 = get_user_model().objects.create(username='test_username2')
+        self.cat = Category.objects.create(name='cat1')
+        self.post = Bike.published.create(title='post1', content='cont1', cat=self.cat)
+
+    def test_page_shared_between_users(self):
+        """Тест общей страницы списка с лайками конкретного пользователя"""
+
+        UserPostRelation.objects.create(auth_user=self.user, bike=self.post, like=True)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('home'))
+        self.assertTrue(response.context_data['posts'][0].liked_by_user)
+        self.assertEqual(1, response.context_data['posts'][0].count_likes)
+
+        self.client.force_login(self.user2)
+        response = self.client.get(reverse('home'))
+        self.assertFalse(response.context_data['posts'][0].liked_by_user)
+
+    def test_page_invalidated_on_write(self):
+        """Тест смены поколения кэша при добавлении поста"""
+
+        path = reverse('category', args=[self.cat.slug])
+        self.client.get(path)
+        key = list_page_key('category', self.cat.slug, '')
+        self.assertIsNotNone(cache.get(key))
+
+        Bike.published.create(title='post2', content='cont2', cat=self.cat)
+        self.assertNotEqual(key, list_page_key('category', self.cat.slug, ''))
+        response = self.client.get(path)
+        self.assertEqual('post2', response.context_data['posts'][0].title)
+
+    def test_liked_set_updated_on_like(self):
+        """Тест сброса и пересборки множества лайкнутых постов при лайке"""
+
+        self.client.force_login(self.user)
+        self.assertEqual((frozenset(), True), get_liked_set(self.user.pk))
+        self.client.get(reverse('reader_like', args=[self.post.pk]), HTTP_REFERER=reverse('home'))
+        # множество сбрасывается, а не правится на месте: параллельные лайки не теряются
+        self.assertIsNone(cache.get(liked_set_key(self.user.pk)))
+        self.assertEqual((frozenset({self.post.pk}), True), get_liked_set(self.user.pk))
+        with self.assertNumQueries(0):
+            self.assertEqual({self.post.pk}, liked_post_ids(self.user, [self.post.pk]))
+
+    @override_settings(LIKED_SET_MAX_SIZE=1)
+    def test_liked_set_size_limit(self):
+        """Тест ограничения размера множества лайкнутых постов"""
+
+        post2 = Bike.published.create(title='post2', content='cont2', cat=self.cat)
+        UserPostRelation.objects.create(auth_user=self.user, bike=self.post, like=True)
+        UserPostRelation.objects.create(auth_user=self.user, bike=post2, like=True)
+        liked, complete = get_liked_set(self.user.pk)
+        self.assertEqual(({post2.pk}, False), (set(liked), complete))
+        self.assertEqual({self.post.pk, post2.pk}, liked_post_ids(self.user, [self.post.pk, post2.pk]))
+
+
+class SearchTestCase(TestCase):
+    """Тест полнотекстового поиска по постам"""
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        self.cat = Category.objects.create(name='Велосипеды')
+        self.road = Bike.published.create(title='Шоссейные велосипеды', content='Быстрая езда по дорогам',
+                                          cat=self.cat)
+        self.mtb = Bike.published.create(title='Горный байк', content='Катался по горным дорогам на велосипеде',
+                                         cat=self.cat)
+
+    def test_stem(self):
+        """Тест стемминга русских слов"""
+
+        self.assertEqual(stem('велосипеды'), stem('велосипедами'))
+        self.assertEqual(stem('горный'), stem('горным'))
+        self.assertEqual('post2', stem('post2'))
+
+    def test_search_page(self):
+        """Тест страницы поиска со словоформами и ранжированием"""
+
+        response = self.client.get(reverse('search'), {'q': 'велосипед'})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual([self.road, self.mtb], list(response.context_data['posts']))
+
+        response = self.client.get(reverse('search'), {'q': 'горная дорога'})
+        self.assertEqual([self.mtb], list(response.context_data['posts']))
+
+    def test_index_updated_on_save(self):
+        """Тест обновления индекса при изменении поста"""
+
+        self.road.content = 'Тормоза и покрышки'
+        self.road.save()
+        self.assertEqual([self.mtb], list(search_posts(Bike.objects.all(), 'дороги')))
+        self.assertEqual([self.road], list(search_posts(Bike.objects.all(), 'покрышка')))
+
+    def test_rebuild_command(self):
+        """Тест перестроения индекса порциями с числом запросов, не зависящим от числа постов в порции"""
+
+        SearchTerm.objects.all().delete()
+        with CaptureQueriesContext(connection) as small:
+            call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual([self.road, self.mtb], list(search_posts(Bike.objects.all(), 'велосипед')))
+
+        for number in range(5):
+            Bike.published.create(title=f'Пост {number}', content='Текст', cat=self.cat)
+        with CaptureQueriesContext(connection) as large:
+            call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(5, len(search_posts(Bike.objects.all(), 'текст')))
+
+    def test_category_rename_reindex(self):
+        """Тест переиндексации постов категории пачкой при переименовании"""
+
+        for number in range(5):
+            Bike.published.create(title=f'Пост {number}', content='Текст', cat=self.cat)
+        with self.assertNumQueries(9):
+            self.cat.name = 'Самокаты'
+            self.cat.save()
+        self.assertEqual(7, len(search_posts(Bike.objects.all(), 'самокат')))
+        self.assertEqual([], list(search_posts(Bike.objects.all(), 'велосипеды').filter(title__startswith='Пост')))
+
+
+class SidebarTestCase(TestCase):
+    """Тест счетчиков постов по категориям и тегам в боковой панели"""
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        cache.clear()
+        self.cat = Category.objects.create(name='cat1')
+        self.cat2 = Category.objects.create(name='cat2')
+        self.tag = Tags.objects.create(tag='tag1')
+        self.post = Bike.published.create(title='post1', content='cont1', cat=self.cat)
+        self.draft = Bike.objects.create(title='post2', content='cont2', cat=self.cat2,
+                                         is_published=Bike.Status.DRAFT)
+
+    def test_counts_without_drafts(self):
+        """Тест учета только опубликованных постов и отсутствия запросов при повторном выводе"""
+
+        counts = get_sidebar_counts()
+        self.assertEqual([(self.cat, 1)], [(c, c.amount) for c in counts['categories']])
+        self.assertEqual([], counts['tags'])
+        with self.assertNumQueries(0):
+            show_categories()
+            show_tags()
+
+    def test_counts_invalidated(self):
+        """Тест пересчета при смене тегов и статуса поста"""
+
+        get_sidebar_counts()
+        self.post.tags.add(self.tag)
+        self.assertEqual([(self.tag, 1)], [(t, t.amount) for t in get_sidebar_counts()['tags']])
+
+        with mock.patch.object(BikeAdmin, 'message_user'):
+            BikeAdmin(Bike, admin.site).set_published(None, Bike.objects.filter(pk=self.draft.pk))
+        self.assertEqual([self.cat, self.cat2], get_sidebar_counts()['categories'])
+
+        self.post.is_published = Bike.Status.DRAFT
+        self.post.save()
+        self.assertEqual([self.cat2], get_sidebar_counts()['categories'])
+
+
+@override_settings(LIKES_WRITE_MODE='buffered')
+class LikeBufferTestCase(TestCase):
+    """Тест записи лайков через буфер"""
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        cache.clear()
+        self.user = get_user_model().objects.create(username='test_username')
+        self.user2 = get_user_model().objects.create(username='test_username2')
+        self.cat = Category.objects.create(name='cat1')
+        self.post = Bike.published.create(title='post1', content='cont1', cat=self.cat)
+        self.path = reverse('reader_like', args=[self.post.pk])
+
+    def test_like_buffered(self):
+        """Тест отсутствия записи в базу до сброса буфера и учета отложенного лайка на странице"""
+
+        self.client.force_login(self.user)
+        self.client.get(self.path, HTTP_REFERER=reverse('home'))
+        self.assertFalse(UserPostRelation.objects.exists())
+        self.assertEqual({self.post.pk: True}, pending_likes(self.user))
+
+        post = self.client.get(reverse('home')).context['posts'][0]
+        self.assertTrue(post.liked_by_user)
+        self.assertEqual(1, post.count_likes)
+
+    def test_flush(self):
+        """Тест записи пачки лайков: схлопывание повторных кликов и изменение счетчика на разницу"""
+
+        UserPostRelation.objects.create(auth_user=self.user2, bike=self.post, like=True)
+        for user, clicks in ((self.user, 3), (self.user2, 1)):
+            self.client.force_login(user)
+            for _ in range(clicks):
+                self.client.get(self.path, HTTP_REFERER=reverse('home'))
+
+        self.assertEqual(2, flush_like_buffer())
+        self.assertEqual(0, flush_like_buffer())
+        self.post.refresh_from_db()
+        self.assertEqual(1, self.post.like_count)
+        self.assertTrue(UserPostRelation.objects.get(auth_user=self.user).like)
+        self.assertFalse(UserPostRelation.objects.get(auth_user=self.user2).like)
+        self.assertEqual(({self.post.pk}, True), get_liked_set(self.user.pk))
+
+    def test_flush_error_requeues(self):
+        """Тест возврата лайков в буфер при ошибке записи: новый клик во время сброса не перезаписывается"""
+
+        self.client.force_login(self.user)
+        self.client.get(self.path, HTTP_REFERER=reverse('home'))
+        post2 = Bike.published.create(title='post2', content='cont2', cat=self.cat)
+
+        def fail(pending):
+            self.client.get(reverse('reader_like', args=[post2.pk]), HTTP_REFERER=reverse('home'))
+            raise DatabaseError
+
+        with mock.patch('bike_app.likes._write_likes', side_effect=fail), self.assertRaises(DatabaseError):
+            flush_like_buffer()
+        self.assertEqual({self.post.pk: True, post2.pk: True}, pending_likes(self.user))
+        self.assertEqual(2, flush_like_buffer())
+        self.assertEqual({}, pending_likes(self.user))
+
+    def test_flush_concurrent_insert(self):
+        """Тест счетчика, когда синхронный лайк создал строку во время сброса буфера"""
+
+        self.client.force_login(self.user)
+        self.client.get(self.path, HTTP_REFERER=reverse('home'))
+        bulk_create = UserPostRelation.objects.bulk_create
+
+        def concurrent_bulk_create(objs, **kwargs):
+            UserPostRelation.objects.toggle_like(self.user.pk, self.post.pk)
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(UserPostRelation.objects, 'bulk_create', concurrent_bulk_create):
+            flush_like_buffer()
+        self.post.refresh_from_db()
+        self.assertEqual(1, self.post.like_count)
+        self.assertTrue(UserPostRelation.objects.get(auth_user=self.user).like)
+
+    def test_drain_likes_command(self):
+        """Тест команды полной записи буфера"""
+
+        self.client.force_login(self.user)
+        self.client.get(self.path, HTTP_REFERER=reverse('home'))
+        out = StringIO()
+        call_command('drain_likes', stdout=out)
+        self.assertIn('1', out.getvalue())
+        self.assertEqual({}, pending_likes(self.user))
+        self.assertEqual(1, Bike.objects.get(pk=self.post.pk).like_count)
+
+    @override_settings(LIKES_FLUSH_BATCH_SIZE=1)
+    def test_drain_skips_deleted_posts(self):
+        """Тест записи всего буфера, когда первая пачка - лайки удаленного поста"""
+
+        deleted = Bike.published.create(title='post2', content='cont2', cat=self.cat)
+        for user, path in ((self.user, reverse('reader_like', args=[deleted.pk])), (self.user2, self.path)):
+            self.client.force_login(user)
+            self.client.get(path, HTTP_REFERER=reverse('home'))
+        deleted.delete()
+        call_command('drain_likes', stdout=StringIO())
+        self.assertEqual(({}, {}), (pending_likes(self.user), pending_likes(self.user2)))
+        self.assertEqual(1, Bike.objects.get(pk=self.post.pk).like_count)
+
+    def test_read_during_flush(self):
+        """Тест чтения и повторного клика, пока захваченные сбросом изменения еще не записаны"""
+
+        self.client.force_login(self.user)
+        self.client.get(self.path, HTTP_REFERER=reverse('home'))
+        write_likes = likes._write_likes
+
+        def click_during_flush(pending):
+            self.assertEqual({self.post.pk: True}, pending_likes(self.user))
+            self.client.get(self.path, HTTP_REFERER=reverse('home'))
+            self.assertEqual({self.post.pk: False}, pending_likes(self.user))
+            return write_likes(pending)
+
+        with mock.patch('bike_app.likes._write_likes', side_effect=click_during_flush):
+            flush_like_buffer()
+        self.assertEqual({self.post.pk: False}, pending_likes(self.user))
+        flush_like_buffer()
+        self.assertEqual(0, Bike.objects.get(pk=self.post.pk).like_count)
+        self.assertFalse(UserPostRelation.objects.get(auth_user=self.user).like)
+
+
+class RelationUpsertTestCase(TestCase):
+    """Тест атомарного переключения лайка и установки оценки"""
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        cache.clear()
+        self.user = get_user_model().objects.create(username='test_username')
+        self.cat = Category.objects.create(name='cat1')
+        self.post = Bike.published.create(title='post1', content='cont1', cat=self.cat)
+
+    def test_toggle_like(self):
+        """Тест создания строки первым кликом, переключения вторым и обновления счетчика и множества лайков"""
+
+        self.assertTrue(UserPostRelation.objects.toggle_like(self.user.pk, self.post.pk))
+        self.assertEqual(({self.post.pk}, True), get_liked_set(self.user.pk))
+        self.assertFalse(UserPostRelation.objects.toggle_like(self.user.pk, self.post.pk))
+        self.assertEqual((frozenset(), True), get_liked_set(self.user.pk))
+        self.assertEqual(1, UserPostRelation.objects.count())
+        self.post.refresh_from_db()
+        self.assertEqual(0, self.post.like_count)
+
+    def test_invalidate_after_outer_commit(self):
+        """Тест повторного сброса множества лайков после коммита внешней транзакции"""
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            UserPostRelation.objects.toggle_like(self.user.pk, self.post.pk)
+            # множество, собранное до коммита внешней транзакции
+            get_liked_set(self.user.pk)
+        self.assertIsNotNone(cache.get(liked_set_key(self.user.pk)))
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(cache.get(liked_set_key(self.user.pk)))
+
+    def test_set_relation(self):
+        """Тест установки оценки с пересчетом счетчиков на разницу"""
+
+        self.assertEqual((False, 3), UserPostRelation.objects.set_relation(self.user.pk, self.post.pk, rate=3))
+        self.assertEqual((True, 5), UserPostRelation.objects.set_relation(self.user.pk, self.post.pk,
+                                                                          like=True, rate=5))
+        self.post.refresh_from_db()
+        self.assertEqual((1, 5, 1), (self.post.like_count, self.post.rating_sum, self.post.rating_count))
+
+    def test_rate_view(self):
+        """Тест установки оценки на странице поста"""
+
+        self.client.force_login(self.user)
+        self.client.post(self.post.get_absolute_url(), {'rate': 4, 'post_id': self.post.pk})
+        self.client.post(self.post.get_absolute_url(), {'rate': 2, 'post_id': self.post.pk})
+        self.assertEqual(2, UserPostRelation.objects.get(auth_user=self.user, bike=self.post).rate)
+        self.post.refresh_from_db()
+        self.assertEqual((2, 1), (self.post.rating_sum, self.post.rating_count))
+
+    def test_unique_relation(self):
+        """Тест запрета повторной строки для пары пользователь - пост"""
+
+        UserPostRelation.objects.create(auth_user=self.user, bike=self.post)
+        with self.assertRaises(IntegrityError):
+            UserPostRelation.objects.create(auth_user=self.user, bike=self.post, like=True)
+
+
+class ConcurrentRelationTestCase(TransactionTestCase):
+    """Нагрузочный тест параллельных кликов из нескольких потоков"""
+
+    threads = 8
+    clicks = 5
+
+    def test_concurrent_clicks(self):
+        """Тест отсутствия дублей и потерянных изменений счетчиков"""
+
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Параллельная запись требует файловой базы SQLite или PostgreSQL')
+        user_model = get_user_model()
+        shared_user = user_model.objects.create(username='shared')
+        users = [user_model.objects.create(username=f'user{i}') for i in range(self.threads)]
+        post = Bike.published.create(title='post1', content='cont1', cat=Category.objects.create(name='cat1'))
+        barrier = threading.Barrier(self.threads)
+        errors = []
+
+        def click(user):
+            try:
+                barrier.wait()
+                for i in range(self.clicks):
+                    UserPostRelation.objects.toggle_like(shared_user.pk, post.pk)
+                    UserPostRelation.objects.set_relation(shared_user.pk, post.pk, rate=i + 1)
+                UserPostRelation.objects.toggle_like(user.pk, post.pk)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=click, args=(user,)) for user in users]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual([], errors)
+        self.assertEqual(self.threads + 1, UserPostRelation.objects.count())
+        shared = UserPostRelation.objects.get(auth_user=shared_user)
+        self.assertEqual((self.threads * self.clicks) % 2 == 1, shared.like)
+        post.refresh_from_db()
+        self.assertEqual(self.threads + shared.like, post.like_count)
+        self.assertEqual((shared.rate, 1), (post.rating_sum, post.rating_count))
+        self.assertEqual([], list(Bike.objects.with_drifted_counters()))
+
+    def test_merge_duplicates_command(self):
+        """Тест команды слияния дублей на данных без дублей"""
+
+        out = StringIO()
+        call_command('merge_duplicate_relations', stdout=out)
+        self.assertIn('Удалено дублей оценок: 0', out.getvalue())
+
+
+class ImageVariantsTestCase(TestCase):
+    """Тест создания уменьшенных копий фото постов"""
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        image = Image.new('RGB', (1000, 500), 'red')
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera'  # Make
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', exif=exif)
+        self.cat = Category.objects.create(name='cat1')
+        with mock.patch('bike_app.tasks.build_post_image_variants.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                photo = SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+                self.post = Bike.published.create(title='post1', content='cont1', cat=self.cat, photo=photo)
+        delay.assert_called_once_with(self.post.pk, self.post.photo.name)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def open_variant(self, path: str) -> Image.Image:
+        return Image.open(self.post.photo.storage.path(path))
+
+    def test_build_variants(self):
+        """Тест размеров и форматов вариантов, удаления метаданных и отсутствия увеличения"""
+
+        build_post_image_variants(self.post.pk, self.post.photo.name)
+        self.post.refresh_from_db()
+        sizes = self.post.photo_variants['sizes']
+        self.assertEqual([(320, 160), (640, 320)], [(e['width'], e['height']) for e in sizes['card']])
+        self.assertEqual([800, 1000], [entry['width'] for entry in sizes['detail']])
+        self.assertEqual('WEBP', self.open_variant(sizes['card'][0]['webp']).format)
+        jpeg = self.open_variant(sizes['card'][0]['jpeg'])
+        self.assertEqual(('JPEG', (320, 160)), (jpeg.format, jpeg.size))
+        self.assertFalse(jpeg.getexif())
+
+    def test_srcset_on_list_page(self):
+        """Тест вывода srcset на главной странице после создания вариантов"""
+
+        self.assertNotIn('srcset', self.client.get(reverse('home')).content.decode())
+        build_post_image_variants(self.post.pk, self.post.photo.name)
+        content = self.client.get(reverse('home')).content.decode()
+        self.assertIn('type="image/webp"', content)
+        self.assertRegex(content, r'[0-9a-f]{64}\.webp 320w')
+
+    def test_backfill_command(self):
+        """Тест дозаполнения вариантов командой в пуле процессов"""
+
+        out = StringIO()
+        call_command('build_image_variants', workers=1, only='post', stdout=out)
+        self.assertIn('создано вариантов для 1', out.getvalue())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.photo.name, self.post.photo_variants['source'])
+
+
+class MediaStorageTestCase(TestCase):
+    """Тест хранилища по хэшу содержимого и сборки мусора"""
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.cat = Category.objects.create(name='cat1')
+        self.user = get_user_model().objects.create(username='test_username')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def upload(self, color: str, name: str = 'photo.JPG') -> SimpleUploadedFile:
+        buffer = BytesIO()
+        Image.new('RGB', (10, 10), color).save(buffer, 'JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def test_same_content_stored_once(self):
+        """Тест одинакового имени по хэшу для одинаковых загрузок поста и пользователя"""
+
+        post = Bike.published.create(title='post1', content='cont1', cat=self.cat, photo=self.upload('red'))
+        self.user.photo = self.upload('red', 'avatar.jpg')
+        self.user.save()
+        post2 = Bike.published.create(title='post2', content='cont2', cat=self.cat, photo=self.upload('red'))
+
+        self.assertRegex(post.photo.name, r'^pictures/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertEqual(post.photo.name, post2.photo.name)
+        self.assertEqual(post.photo.name.split('/', 1)[1], self.user.photo.name.split('/', 1)[1])
+        self.assertEqual([post.photo.name], list(default_storage.walk('pictures')))
+
+    def test_collect_garbage(self):
+        """Тест удаления только файлов без ссылок"""
+
+        post = Bike.published.create(title='post1', content='cont1', cat=self.cat, photo=self.upload('red'))
+        Bike.published.create(title='post2', content='cont2', cat=self.cat, photo=self.upload('red'))
+        old_name = post.photo.name
+        post.photo = self.upload('blue')
+        post.save()
+        post2 = Bike.published.create(title='post3', content='cont3', cat=self.cat, photo=self.upload('green'))
+        orphan = post2.photo.name
+        post2.delete()
+        os.makedirs(default_storage.path('users'))
+        with open(default_storage.path('users/no_pic.png'), 'wb') as file:
+            file.write(self.upload('white').read())
+
+        out = StringIO()
+        call_command('collect_media_garbage', grace_hours=0, stdout=out)
+        self.assertIn('Удалено файлов без ссылок: 1', out.getvalue())
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertTrue(default_storage.exists(old_name))
+        self.assertTrue(default_storage.exists(post.photo.name))
+        self.assertTrue(default_storage.exists('users/no_pic.png'))
+
+    def test_reuploaded_orphan_kept(self):
+        """Тест файла-сироты, на который снова сослались: повторная загрузка и новая ссылка во время обхода"""
+
+        post = Bike.published.create(title='post1', content='cont1', cat=self.cat, photo=self.upload('red'))
+        name = post.photo.name
+        post.delete()
+        old = (timezone.now() - timedelta(days=2)).timestamp()
+        os.utime(default_storage.path(name), (old, old))
+        self.assertEqual(name, default_storage.save('pictures/photo.jpg', self.upload('red')))
+        call_command('collect_media_garbage', grace_hours=1, stdout=StringIO())
+        self.assertTrue(default_storage.exists(name))
+
+        os.utime(default_storage.path(name), (old, old))
+        with mock.patch('bike_app.management.commands.collect_media_garbage.Command.references',
+                        side_effect=[Counter(), Counter({name: 1})]):
+            call_command('collect_media_garbage', grace_hours=1, stdout=StringIO())
+        self.assertTrue(default_storage.exists(name))
+
+
+class SlugRegistryTestCase(TestCase):
+    """Тест реестра slug, фильтра Блума и редиректов со старых адресов"""
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        cache.clear()
+        self.cat = Category.objects.create(name='cat1')
+        self.post = Bike.published.create(title='post1', content='cont1', cat=self.cat)
+
+    def test_bloom_filter(self):
+        """Тест отсутствия ложноотрицательных ответов и доли ложноположительных"""
+
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add(f'post-{i}')
+        self.assertTrue(all(f'post-{i}' in bloom for i in range(1000)))
+        self.assertLess(sum(f'other-{i}' in bloom for i in range(10000)), 300)
+
+    def test_unknown_slug_without_queries(self):
+        """Тест 404 для несуществующего поста без запросов к базе"""
+
+        self.client.get(self.post.get_absolute_url())
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('post', args=['no-such-post']))
+        self.assertEqual(HTTPStatus.NOT_FOUND, response.status_code)
+        self.assertEqual((self.cat.pk, None), resolve_slug('category', self.cat.slug))
+
+    def test_redirect_after_retitle(self):
+        """Тест редиректа со старого slug и освобождения его для нового поста"""
+
+        old_url = self.post.get_absolute_url()
+        self.post.title = 'post renamed'
+        self.post.save()
+        response = self.client.get(old_url)
+        self.assertRedirects(response, reverse('post', args=['post-renamed']),
+                             status_code=HTTPStatus.MOVED_PERMANENTLY)
+
+        new_post = Bike.published.create(title='post1', content='cont2', cat=self.cat)
+        self.assertFalse(SlugRedirect.objects.exists())
+        self.assertEqual(new_post, self.client.get(old_url).context['post'])
+
+
+class ConditionalGetTestCase(TestCase):
+    """Тест условных GET страниц постов и списков по ETag"""
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        cache.clear()
+        self.user = get_user_model().objects.create(username='test_username')
+        self.cat = Category.objects.create(name='cat1')
+        self.post = Bike.published.create(title='post1', content='cont1', cat=self.cat)
+
+    def test_post_not_modified(self):
+        """Тест ответа 304 без выполнения представления и смены ETag после лайка"""
+
+        path = self.post.get_absolute_url()
+        self.client.force_login(self.user)
+        etag = self.client.get(path)['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        with mock.patch('bike_app.views.ShowPost.get_context_data') as get_context_data:
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(HTTPStatus.NOT_MODIFIED, response.status_code)
+        get_context_data.assert_not_called()
+
+        self.client.get(reverse('reader_like', args=[self.post.pk]), HTTP_REFERER=reverse('home'))
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(HTTPStatus.OK, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+
+    def test_post_etag_sidebar(self):
+        """Тест смены ETag поста при публикации другого поста: меняются счетчики боковой панели"""
+
+        path = self.post.get_absolute_url()
+        etag = self.client.get(path)['ETag']
+        self.assertEqual(HTTPStatus.NOT_MODIFIED, self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code)
+        Bike.published.create(title='post2', content='cont2', cat=Category.objects.create(name='cat2'))
+        self.assertEqual(HTTPStatus.OK, self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code)
+
+    def test_post_etag_per_user(self):
+        """Тест разных ETag страницы поста для гостя и пользователя"""
+
+        path = self.post.get_absolute_url()
+        etag = self.client.get(path)['ETag']
+        self.client.force_login(self.user)
+        self.assertEqual(HTTPStatus.OK, self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code)
+
+    def test_list_not_modified(self):
+        """Тест ответа 304 для списка без запросов к базе и смены ETag при изменении тегов поста"""
+
+        tag = Tags.objects.create(tag='tag1')
+        path = reverse('home')
+        etag = self.client.get(path)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(HTTPStatus.NOT_MODIFIED, response.status_code)
+
+        modified = self.post.modified
+        tag.posts.add(self.post)
+        self.assertEqual(HTTPStatus.OK, self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code)
+        self.post.refresh_from_db()
+        self.assertGreater(self.post.modified, modified)
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Тест бюджетов запросов: каждая страница и метод API с бюджетом открывается на наборах данных разного размера,
+    число запросов не должно превышать бюджет и расти с числом постов.
+    """
+
+    sizes = (1, 12)
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        cache.clear()
+        self.user = get_user_model().objects.create(username='test_username')
+        self.readers = [get_user_model().objects.create(username=f'reader{i}') for i in range(3)]
+        self.cat = Category.objects.create(name='cat1')
+        self.tags = [Tags.objects.create(tag='tag1'), Tags.objects.create(tag='tag2')]
+
+    def seed(self, size: int) -> None:
+        """Дополнение набора данных до size постов с тегами, лайками и оценками"""
+
+        for i in range(Bike.objects.count(), size):
+            post = Bike.published.create(title=f'велосипед {i}', content='горный велосипед', cat=self.cat,
+                                         auth_user=self.user)
+            post.tags.add(*self.tags)
+            for reader in self.readers + [self.user]:
+                UserPostRelation.objects.set_relation(reader.pk, post.pk, like=True, rate=4)
+
+    def urls(self) -> dict:
+        post = Bike.objects.order_by('pk').first()
+        return {
+            'home': reverse('home'),
+            'add_page': reverse('add_page'),
+            'update_post': reverse('update_post', args=[post.slug]),
+            'contact': reverse('contact'),
+            'post': post.get_absolute_url(),
+            'category': reverse('category', args=[self.cat.slug]),
+            'tag': reverse('tag', args=[self.tags[0].slug]),
+            'search': reverse('search') + '?q=велосипед',
+            'bike-list': reverse('bike-list') + '?page_size=100',
+            'bike-detail': reverse('bike-detail', args=[post.pk]),
+            'bike-search': reverse('bike-search') + '?q=велосипед',
+            'bike-tags': reverse('bike-tags', args=[self.tags[0].pk]),
+            'users:login': reverse('users:login'),
+            'users:register': reverse('users:register'),
+            'users:profile': reverse('users:profile'),
+        }
+
+    def measure(self) -> dict:
+        """Число запросов для каждого URL с холодным кэшем"""
+
+        counts = {}
+        for name, url in self.urls().items():
+            cache.clear()
+            with count_queries() as counter:
+                response = self.client.get(url)
+            self.assertEqual(HTTPStatus.OK, response.status_code, name)
+            counts[name] = counter.count
+        return counts
+
+    @mock.patch.object(DataMixin, 'paginate_by', 100)
+    def test_budgets(self):
+        """Тест бюджетов для всех объявленных URL"""
+
+        self.client.force_login(self.user)
+        results = {}
+        for size in self.sizes:
+            self.seed(size)
+            results[size] = self.measure()
+
+        self.assertEqual(set(BUDGETS), set(results[self.sizes[0]]), 'URL с бюджетом без проверки в тесте')
+        for name, budget in BUDGETS.items():
+            counts = [results[size][name] for size in self.sizes]
+            self.assertEqual(len(set(counts)), 1, f'{name}: число запросов растет с числом постов {counts}')
+            self.assertLessEqual(counts[0], budget, f'{name}: превышен бюджет')
+
+    @override_settings(QUERY_BUDGET_SAMPLE_RATE=1)
+    def test_middleware_logs_violation(self):
+        """Тест записи превышения бюджета в лог"""
+
+        self.seed(1)
+        with mock.patch.dict(BUDGETS, {'home': 0}), self.assertLogs('bike_blog.query_budget', 'WARNING') as logs:
+            self.client.get(reverse('home'))
+        self.assertIn('home', logs.output[0])
+
+
+class InstrumentationTestCase(TestCase):
+    """Тест метрик запроса: заголовок Server-Timing, строка в логе и медленные запросы"""
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        cache.clear()
+        self.cat = Category.objects.create(name='cat1')
+        self.post = Bike.published.create(title='post1', content='cont', cat=self.cat)
+
+    def test_server_timing_and_log(self):
+        """Тест метрик базы, кэша и шаблонов: второй запрос главной берет страницу из кэша"""
+
+        with override_settings(SERVER_TIMING=True), self.assertLogs('bike_blog.instrumentation', 'DEBUG') as logs:
+            self.client.get(reverse('home'))
+            response = self.client.get(reverse('home'))
+        timing = dict(item.strip().split(';', 1) for item in response['Server-Timing'].split(','))
+        self.assertEqual({'db', 'cache', 'tpl', 'total'}, set(timing))
+        self.assertRegex(timing['cache'], r'desc="[1-9]\d* hits')
+        self.assertTrue(logs.output[-1].startswith('DEBUG:'))
+        self.assertIn('view=home status=200', logs.output[-1])
+        self.assertRegex(logs.output[-1], r'db_count=\d+ .* template_ms=\d')
+
+        response = self.client.get(reverse('home'))
+        self.assertNotIn('Server-Timing', response)
+        self.client.force_login(get_user_model().objects.create(username='admin', is_staff=True))
+        self.assertIn('Server-Timing', self.client.get(reverse('home')))
+
+    def test_slow_request_log(self):
+        """Тест строки метрик: быстрые запросы - только DEBUG, дольше SLOW_REQUEST_THRESHOLD_MS - WARNING"""
+
+        with self.assertNoLogs('bike_blog.instrumentation', 'INFO'):
+            self.client.get(reverse('home'))
+        with override_settings(SLOW_REQUEST_THRESHOLD_MS=0), \
+                self.assertLogs('bike_blog.instrumentation', 'WARNING') as logs:
+            self.client.get(reverse('home'))
+        self.assertIn('view=home status=200', logs.output[-1])
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_SAMPLE_RATE=1)
+    def test_slow_query_origin(self):
+        """Тест записи медленного запроса с местом вызова в коде проекта"""
+
+        with self.assertLogs('bike_blog.instrumentation', 'WARNING') as logs:
+            self.client.get(self.post.get_absolute_url())
+        self.assertTrue(any('Медленный запрос' in line and 'bike_app/' in line for line in logs.output))
+
+
+class MetricsTestCase(TestCase):
+    """Тест метрик Prometheus: запросы, кэш списков, записи лайков и задачи Celery"""
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        cache.clear()
+        self.user = get_user_model().objects.create(username='test_username')
+        self.post = Bike.published.create(title='post1', content='cont', cat=Category.objects.create(name='cat1'))
+
+    def sample(self, name: str, **labels) -> float:
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_request_and_cache_metrics(self):
+        """Тест гистограммы ответов по представлению и попаданий в кэш страниц главной"""
+
+        requests = self.sample('bike_http_request_duration_seconds_count', view='home', method='GET', status='2xx')
+        hits = self.sample('bike_list_cache_requests_total', list='home', result='hit')
+        self.client.get(reverse('home'))
+        self.client.get(reverse('home'))
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(HTTPStatus.OK, response.status_code)
+        self.assertContains(response, 'bike_celery_queue_length')
+        self.assertEqual(requests + 2, self.sample('bike_http_request_duration_seconds_count',
+                                                   view='home', method='GET', status='2xx'))
+        self.assertEqual(hits + 1, self.sample('bike_list_cache_requests_total', list='home', result='hit'))
+        self.assertGreater(self.sample('bike_db_queries_total', view='home'), 0)
+        self.assertGreater(self.sample('bike_cache_seconds_total', view='home'), 0)
+
+    def test_import_without_multiproc_dir(self):
+        """Тест импорта модуля метрик без файлов, когда каталога PROMETHEUS_MULTIPROC_DIR еще нет"""
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        missing = os.path.join(directory, 'prometheus')
+        subprocess.run([sys.executable, '-c', 'import django; django.setup(); import bike_blog.metrics'],
+                       cwd=settings.BASE_DIR, env=dict(os.environ, PROMETHEUS_MULTIPROC_DIR=missing), check=True)
+        self.assertFalse(os.path.exists(missing))
+
+    def test_relation_and_task_metrics(self):
+        """Тест счетчиков записи лайков и оценок и выполнений задачи Celery"""
+
+        likes = self.sample('bike_relation_writes_total', kind='like', mode='sync')
+        rates = self.sample('bike_relation_writes_total', kind='rate', mode='sync')
+        UserPostRelation.objects.toggle_like(self.user.pk, self.post.pk)
+        UserPostRelation.objects.set_relation(self.user.pk, self.post.pk, rate=3)
+        self.assertEqual(likes + 1, self.sample('bike_relation_writes_total', kind='like', mode='sync'))
+        self.assertEqual(rates + 1, self.sample('bike_relation_writes_total', kind='rate', mode='sync'))
+
+        runs = self.sample('bike_celery_task_runs_total', task='bike_app.tasks.flush_likes', state='success')
+        flush_likes.apply()
+        self.assertEqual(runs + 1,
+                         self.sample('bike_celery_task_runs_total', task='bike_app.tasks.flush_likes', state='success'))
+        self.assertGreater(self.sample('bike_celery_task_duration_seconds_count', task='bike_app.tasks.flush_likes'), 0)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_token(self):
+        """Тест доступа к /metrics только с токеном"""
+
+        self.assertEqual(HTTPStatus.FORBIDDEN, self.client.get(reverse('metrics')).status_code)
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(HTTPStatus.OK, response.status_code)
+
+
+class ProfilingTestCase(TestCase):
+    """Тест профилирования запросов и страниц профилей в админке"""
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        cache.clear()
+        self.staff = get_user_model().objects.create(username='staff', is_staff=True, is_superuser=True)
+        self.user = get_user_model().objects.create(username='test_username')
+        Bike.published.create(title='post1', content='cont', cat=Category.objects.create(name='cat1'))
+
+    @override_settings(PROFILING_INTERVAL=0.001)
+    def test_staff_profile(self):
+        """Тест профиля по ?_profile=1 для staff: заголовок, хронология SQL и страницы админки"""
+
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('home'), {'_profile': 1})
+        self.assertEqual(HTTPStatus.OK, response.status_code)
+        profile = get_profile(response['X-Profile-Id'])
+        self.assertEqual('staff', profile['trigger'])
+        self.assertEqual('staff', profile['user'])
+        self.assertTrue(profile['queries'])
+
+        response = self.client.get(reverse('admin_profiles'))
+        self.assertContains(response, reverse('admin_profile', args=[profile['id']]))
+        response = self.client.get(reverse('admin_profile', args=[profile['id']]))
+        self.assertContains(response, 'Граф пламени')
+        response = self.client.get(reverse('admin_profile', args=[profile['id']]), {'format': 'folded'})
+        self.assertEqual('text/plain; charset=utf-8', response['Content-Type'])
+        self.assertEqual(HTTPStatus.NOT_FOUND, self.client.get(reverse('admin_profile', args=['missing'])).status_code)
+
+    def test_not_profiled(self):
+        """Тест запроса без профилирования: флаг обычного пользователя не учитывается, админка закрыта"""
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('home'), {'_profile': 1})
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(HTTPStatus.FOUND, self.client.get(reverse('admin_profiles')).status_code)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_sampled_profile(self):
+        """Тест случайной выборки запросов анонимных пользователей"""
+
+        response = self.client.get(reverse('home'))
+        self.assertEqual('sample', get_profile(response['X-Profile-Id'])['trigger'])
+
+    def test_call_tree(self):
+        """Тест дерева вызовов и прямоугольников графа пламени из стеков"""
+
+        tree = call_tree([[['a', 'b'], 3], [['a', 'c'], 1]])
+        self.assertEqual(4, tree['children']['a']['total'])
+        self.assertEqual(3, tree['children']['a']['children']['b']['self'])
+        boxes = {box['name']: box for box in flame_boxes(tree)}
+        self.assertEqual((1, 100), (boxes['a']['depth'], boxes['a']['width']))
+        self.assertEqual((0, 75), (boxes['b']['left'], boxes['b']['width']))
+        self.assertEqual(75, boxes['c']['left'])
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRouterTestCase(SimpleTestCase):
+    """Тест маршрутизации чтения в реплики и закрепления клиента за основной базой после записи"""
+
+    def setUp(self):
+        """Реплика считается доступной, пока тест не проверит обратное"""
+
+        db_router._health.clear()
+        self.router = db_router.ReplicaRouter()
+        self.factory = RequestFactory()
+        self.patcher = mock.patch('bike_blog.db_router.check_replica', return_value=True)
+        self.check_replica = self.patcher.start()
+        self.addCleanup(self.patcher.stop)
+
+    def route(self, request, write: bool = False):
+        """
+        Базы для чтения внутри запроса (после записи, если write): обычного и внутри primary_reads(),
+        и ответ ReplicaRoutingMiddleware
+        """
+
+        databases = []
+
+        def get_response(request):
+            if write:
+                self.router.db_for_write(Bike)
+            databases.append(self.router.db_for_read(Bike))
+            with db_router.primary_reads():
+                databases.append(self.router.db_for_read(Bike))
+            return HttpResponse()
+
+        response = db_router.ReplicaRoutingMiddleware(get_response)(request)
+        return databases, response
+
+    def test_read_from_replica(self):
+        """Тест чтения GET-запроса из реплики, а в primary_reads(), POST-запросах и вне HTTP-запросов - из основной"""
+
+        self.assertEqual(['replica1', 'default'], self.route(self.factory.get('/'))[0])
+        self.assertEqual(['default', 'default'], self.route(self.factory.post('/'))[0])
+        self.assertIsNone(self.router.db_for_read(Bike))
+
+    def test_read_your_writes(self):
+        """Тест чтения после записи: в том же запросе и в запросах с cookie - из основной базы"""
+
+        databases, response = self.route(self.factory.get('/'), write=True)
+        self.assertEqual('default', databases[0])
+        cookie = response.cookies[settings.REPLICA_PIN_COOKIE]
+        self.assertEqual(settings.REPLICA_PIN_SECONDS, cookie['max-age'])
+
+        request = self.factory.get('/')
+        request.COOKIES[settings.REPLICA_PIN_COOKIE] = '1'
+        databases, response = self.route(request)
+        self.assertEqual('default', databases[0])
+        self.assertNotIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+
+    @override_settings(REPLICA_HEALTH_INTERVAL=60)
+    def test_unhealthy_replica(self):
+        """Тест переключения на основную базу при недоступной реплике и проверки не чаще интервала"""
+
+        self.check_replica.return_value = False
+        self.assertEqual('default', self.route(self.factory.get('/'))[0][0])
+        self.check_replica.return_value = True
+        self.assertEqual('default', self.route(self.factory.get('/'))[0][0])
+        self.assertEqual(1, self.check_replica.call_count)
+
+    def test_missing_replica(self):
+        """Тест проверки реплики, которой нет в DATABASES"""
+
+        self.patcher.stop()
+        with self.assertLogs('bike_blog.db_router', 'WARNING'):
+            self.assertFalse(db_router.check_replica('replica1'))
+
+
+class ExportTestCase(TestCase):
+    """Тест потоковой выгрузки постов и оценок"""
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        self.user = get_user_model().objects.create(username='test_username', is_staff=True)
+        self.cat = Category.objects.create(name='cat1')
+        self.tag = Tags.objects.create(tag='tag1')
+        self.posts = [Bike.published.create(title=f'post{i}', content='cont', cat=self.cat) for i in range(5)]
+        self.posts[0].tags.add(self.tag)
+        UserPostRelation.objects.set_relation(self.user.pk, self.posts[0].pk, like=True, rate=4)
+
+    def test_command_since(self):
+        """Тест инкрементальной выгрузки в NDJSON порциями меньше числа постов"""
+
+        out, err = BytesIO(), StringIO()
+        with mock.patch('sys.stdout', mock.Mock(buffer=out)):
+            call_command('export_data', 'posts', chunk_size=2, stderr=err)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(5, len(rows))
+        first = next(row for row in rows if row['id'] == self.posts[0].pk)
+        self.assertEqual(('cat1', ['tag1'], 1, 4.0),
+                         (first['cat'], first['tags'], first['like_count'], first['rating']))
+
+        since = err.getvalue().split('--since ')[1].strip()
+        Bike.objects.filter(pk=self.posts[1].pk).update(modified=timezone.now() + timedelta(seconds=1))
+        out = BytesIO()
+        with mock.patch('sys.stdout', mock.Mock(buffer=out)):
+            call_command('export_data', 'posts', since=since, stderr=StringIO())
+        ids = [json.loads(line)['id'] for line in out.getvalue().splitlines()]
+        self.assertEqual(self.posts[1].pk, ids[-1])
+        self.assertLess(len(ids), 5)
+
+    def test_since_counters(self):
+        """Тест попадания в инкрементальную выгрузку постов, у которых изменились только счетчики"""
+
+        since = list(export_posts())[-1]['changed']
+        modified = self.posts[2].modified
+        UserPostRelation.objects.toggle_like(self.user.pk, self.posts[2].pk)
+        rows = list(export_posts(since))
+        self.assertEqual((self.posts[2].pk, 1), (rows[-1]['id'], rows[-1]['like_count']))
+        self.assertEqual(modified, rows[-1]['modified'])
+        self.assertLess(len(rows), 5)
+
+    def test_endpoint_csv(self):
+        """Тест выгрузки оценок в CSV через API только для администратора"""
+
+        path = reverse('export', args=['relations'])
+        self.assertIn(self.client.get(path).status_code, (HTTPStatus.UNAUTHORIZED, HTTPStatus.FORBIDDEN))
+        self.client.force_login(self.user)
+        response = self.client.get(path, {'output': 'csv'})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(['id,auth_user_id,bike_id,like,rate', f'{UserPostRelation.objects.get().pk},'
+                          f'{self.user.pk},{self.posts[0].pk},True,4'], lines)
+        self.assertEqual(HTTPStatus.BAD_REQUEST,
+                         self.client.get(reverse('export', args=['posts']), {'since': 'вчера'}).status_code)
+
+
+class ImportTestCase(TestCase):
+    """Тест пакетного импорта постов из архива"""
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=os.path.join(self.directory, 'media'))
+        self.settings_override.enable()
+        self.cat = Category.objects.create(name='Горные')
+        Bike.published.create(title='Архивный пост', content='cont', cat=self.cat)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory)
+
+    def write(self, name: str, content: str) -> str:
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def test_import_ndjson(self):
+        """Тест импорта с созданием категорий и тегов, переименованием совпавших заголовков, датами и фото"""
+
+        Image.new('RGB', (10, 10), 'red').save(os.path.join(self.directory, 'photo.jpg'))
+        rows = [{'title': f'Пост {i}', 'cat': 'Шоссейные' if i % 2 else 'Горные', 'content': 'обзор велосипеда',
+                 'tags': ['Карбон', 'karbon', 'Сталь'][:i % 3 + 1]} for i in range(7)]
+        rows += [{'title': 'Архивный пост', 'cat': 'gornye', 'created': '2015-05-01T10:00:00Z', 'photo': 'photo.jpg'},
+                 {'title': 'Без категории'}]
+        path = self.write('posts.ndjson', '\n'.join(json.dumps(row, ensure_ascii=False) for row in rows))
+
+        out = StringIO()
+        with self.assertNumQueries(37):
+            call_command('import_posts', path, batch_size=3, photo_root=self.directory, stdout=out, stderr=StringIO())
+        self.assertIn('Импортировано 8 постов', out.getvalue())
+
+        self.assertEqual(2, Category.objects.count())
+        self.assertEqual({'karbon', 'stal'}, set(Tags.objects.values_list('slug', flat=True)))
+        renamed = Bike.objects.get(slug='arkhivnyi-post-2')
+        self.assertEqual(('Архивный пост (2)', self.cat, 2015), (renamed.title, renamed.cat, renamed.created.year))
+        self.assertTrue(default_storage.exists(renamed.photo.name))
+        self.assertEqual(1, Bike.objects.get(title='Пост 1').tags.count())
+        self.assertEqual(7, search_posts(Bike.objects.all(), 'обзор').count())
+
+    def test_import_long_titles(self):
+        """Тест длинных кириллических заголовков: slug и заголовки с номером не длиннее полей"""
+
+        title = 'Щ' * 300
+        path = self.write('posts.ndjson', '\n'.join(json.dumps({'title': title, 'cat': 'Горные'}, ensure_ascii=False)
+                                                    for _ in range(3)))
+        call_command('import_posts', path, stdout=StringIO(), stderr=StringIO())
+        posts = Bike.objects.filter(title__startswith='Щ').order_by('pk')
+        self.assertEqual(3, posts.count())
+        self.assertEqual([title[:255], title[:251] + ' (2)', title[:251] + ' (3)'], [post.title for post in posts])
+        self.assertEqual(['shch' * 63 + 'shc', 'shch' * 63 + 's-2', 'shch' * 63 + 's-3'], [post.slug for post in posts])
+
+    def test_import_exported_csv(self):
+        """Тест импорта выгрузки export_data в CSV"""
+
+        tag = Tags.objects.create(tag='tag1')
+        Bike.objects.get().tags.add(tag)
+        path = os.path.join(self.directory, 'posts.csv')
+        call_command('export_data', 'posts', output='csv', file=path, stderr=StringIO())
+        Bike.objects.all().delete()
+
+        call_command('import_posts', path, stdout=StringIO(), stderr=StringIO())
+        post = Bike.objects.get()
+        self.assertEqual(('Архивный пост', [tag]), (post.title, list(post.tags.all())))
+
+
+class BenchCommandsTestCase(TestCase):
+    """Тест генератора набора данных seed_bench и замеров bench_pages"""
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def seed(self) -> set:
+        call_command('seed_bench', users=3, categories=2, tags=4, posts=12, relations=20, batch_size=5,
+                     stdout=StringIO())
+        return set(UserPostRelation.objects.values_list('auth_user__username', 'bike__slug', 'like', 'rate'))
+
+    def test_seed_is_deterministic(self):
+        """Тест одинакового набора после удаления и повторного запуска, счетчики сходятся с оценками"""
+
+        relations = self.seed()
+        self.assertEqual(20, len(relations))
+        self.assertEqual(12, Bike.objects.filter(slug__startswith='bench-post-').count())
+        self.assertFalse(Bike.objects.with_drifted_counters().exists())
+        self.assertEqual(relations, self.seed())
+
+        call_command('seed_bench', clear=True, stdout=StringIO())
+        self.assertFalse(Bike.objects.exists() or Category.objects.exists() or UserPostRelation.objects.exists())
+        self.assertEqual(relations, self.seed())
+
+    def test_bench_pages_report(self):
+        """Тест отчета в JSON и регрессии по числу запросов относительно прошлого прогона"""
+
+        self.seed()
+        output = os.path.join(self.directory, 'bench.json')
+        call_command('bench_pages', requests=2, warmup=1, output=output, stdout=StringIO(), stderr=StringIO())
+        with open(output, encoding='utf-8') as file:
+            report = json.load(file)
+        self.assertEqual(16, len(report['results']))
+        self.assertEqual([200], report['results']['post:user']['status'])
+        self.assertGreater(report['results']['bike-list:anonymous']['bytes'], 0)
+
+        for result in report['results'].values():
+            result['queries'] = 0
+        with open(output, 'w', encoding='utf-8') as file:
+            json.dump(report, file)
+        with self.assertRaisesMessage(CommandError, 'запросов к базе 0 ->'):
+            call_command('bench_pages', requests=2, baseline=output, threshold=1000, stdout=StringIO(),
+                         stderr=StringIO())
+
+
+class AsyncUrls:
+    """Адреса сайта с асинхронными представлениями, как при ASYNC_VIEWS под ASGI"""
+
+    urlpatterns = [path('', include(async_urlpatterns))] + site_urls.urlpatterns
+
+
+@override_settings(ROOT_URLCONF=AsyncUrls)
+class AsyncViewsTestCase(TestCase):
+    """Тест асинхронных представлений горячих путей чтения"""
+
+    def setUp(self):
+        """Данные для тестирования"""
+
+        cache.clear()
+        self.user = get_user_model().objects.create(username='test_username')
+        self.cat = Category.objects.create(name='cat1')
+        self.tag = Tags.objects.create(tag='tag1')
+        self.post = Bike.published.create(title='post1', content='cont1', cat=self.cat)
+        self.post.tags.add(self.tag)
+        self.async_client.force_login(self.user)
+        self.guest = AsyncClient()
+
+    async def test_pages_match_sync(self):
+        """Тест совпадения страниц и ETag с синхронными представлениями и ответа 304"""
+
+        for path in ('/', self.cat.get_absolute_url(), self.tag.get_absolute_url(), self.post.get_absolute_url()):
+            response = await self.guest.get(path)
+            self.assertEqual(HTTPStatus.OK, response.status_code, path)
+            self.assertContains(response, 'post1')
+            with override_settings(ROOT_URLCONF='bike_blog.urls'):
+                expected = await sync_to_async(self.client.get)(path)
+            self.assertEqual(expected['ETag'], response['ETag'], path)
+            response = await self.guest.get(path, headers={'If-None-Match': response['ETag']})
+            self.assertEqual(HTTPStatus.NOT_MODIFIED, response.status_code, path)
+
+    async def test_missing_and_moved_slug(self):
+        """Тест 404 для несуществующего slug и перенаправления со старого адреса поста"""
+
+        self.assertEqual(HTTPStatus.NOT_FOUND, (await self.guest.get('/category/missing/')).status_code)
+        self.post.title = 'post2'
+        await sync_to_async(self.post.save)()
+        response = await self.guest.get('/post/post1/')
+        self.assertRedirects(response, '/post/post2/', status_code=HTTPStatus.MOVED_PERMANENTLY,
+                             fetch_redirect_response=False)
+
+    async def test_like_and_rate(self):
+        """Тест лайка, входа для гостя и оценки поста через синхронное представление"""
+
+        response = await self.async_client.get(reverse('reader_like', args=[self.post.pk]), headers={'Referer': '/'})
+        self.assertEqual(HTTPStatus.FOUND, response.status_code)
+        self.assertEqual(1, await Bike.objects.filter(pk=self.post.pk).values_list('like_count', flat=True).aget())
+        response = await self.guest.get(reverse('reader_like', args=[self.post.pk]))
+        self.assertTrue(response.url.startswith(reverse('users:login')))
+
+        response = await self.async_client.post(self.post.get_absolute_url(), {'rate': 4})
+        self.assertEqual(HTTPStatus.OK, response.status_code)
+        relation = await UserPostRelation.objects.aget(auth_user=self.user, bike=self.post)
+        self.assertEqual((True, 4), (relation.like, relation.rate))
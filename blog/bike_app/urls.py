@@ -1,5 +1,7 @@
+from django.conf import settings
 from django.urls import path
 
+from . import async_views
 from .views import *
 
 urlpatterns = [
@@ -12,5 +14,18 @@ urlpatterns = [
     path('delete/<slug:slug>/', DeletePost.as_view(), name='delete_post'),
     path('category/<slug:cat_slug>/', BikeCategory.as_view(), name='category'),
     path('tag/<slug:tag_slug>/', BikeTags.as_view(), name='tag'),
+    path('search/', SearchPosts.as_view(), name='search'),
     path('reader_like/<int:pk>/', reader_like, name='reader_like'),
 ]
+
+# под ASGI горячие пути чтения обслуживают асинхронные представления с теми же именами
+async_urlpatterns = [
+    path('', async_views.home, name='home'),
+    path('post/<slug:slug>/', async_views.show_post, name='post'),
+    path('category/<slug:cat_slug>/', async_views.category, name='category'),
+    path('tag/<slug:tag_slug>/', async_views.tag, name='tag'),
+    path('reader_like/<int:pk>/', async_views.reader_like, name='reader_like'),
+]
+
+if settings.ASYNC_VIEWS:
+    urlpatterns = async_urlpatterns + urlpatterns
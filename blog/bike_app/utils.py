@@ -1,11 +1,81 @@
 from django.conf import settings
+from django.http import Http404
+from django.shortcuts import redirect
+
+from bike_app.caching import get_list_page, liked_post_ids
+from bike_app.likes import pending_likes
+from bike_app.pagination import InvalidCursor, KeysetPaginator, decode_cursor
+from bike_app.slugs import resolve_slug
 
 
 class DataMixin:
-    """Миксин для классов представлений, использующих встроенную пагинацию и дополнительный контекст"""
+    """Миксин для классов представлений, использующих пагинацию по курсору и дополнительный контекст"""
 
     paginate_by = 1
     extra_context = {'default_img': settings.DEFAULT_POST_IMAGE}
+    cursor_kwarg = 'cursor'
+    list_cache_name = None  # имя списка в кэше страниц
+    list_cache_slug_kwarg = None  # kwarg урла, различающий списки одного вида
+
+    def paginate_queryset(self, queryset, page_size):
+        """Страница списка берется из общего для всех пользователей кэша, лайки пользователя накладываются сверху"""
+
+        cursor = self.request.GET.get(self.cursor_kwarg) or ''
+        if cursor:
+            try:
+                decode_cursor(cursor)
+            except InvalidCursor:
+                raise Http404('Неверный курсор страницы')
+        slug = self.kwargs.get(self.list_cache_slug_kwarg, '')
+        paginator = KeysetPaginator(queryset, page_size, with_total=True)
+        page = get_list_page(self.list_cache_name, slug, cursor, lambda: paginator.page(cursor))
+
+        mark_liked(self.request.user, page.object_list)
+        return paginator, page, page.object_list, page.has_other_pages()
+
+
+class SlugRegistryMixin:
+    """
+    Миксин для представлений с slug в адресе: объект ищется через реестр slug, несуществующий адрес
+    отдает 404 без запроса к базе, старый адрес поста перенаправляет на новый.
+    """
+
+    slug_kind = 'post'
+    slug_kwarg = 'slug'
+    slug_pk = None
+
+    def dispatch(self, request, *args, **kwargs):
+        match = resolve_slug(self.slug_kind, kwargs[self.slug_kwarg])
+        if match.pk is None:
+            raise Http404('Страница не найдена')
+        if match.redirect_to is not None and request.method in ('GET', 'HEAD'):
+            return redirect(request.resolver_match.view_name, permanent=True,
+                            **{**kwargs, self.slug_kwarg: match.redirect_to})
+        self.slug_pk = match.pk
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_object(self, queryset=None):
+        if queryset is None:
+            queryset = self.get_queryset()
+        try:
+            return queryset.get(pk=self.slug_pk)
+        except queryset.model.DoesNotExist:
+            raise Http404('Страница не найдена')
+
+
+def mark_liked(user, posts: list) -> None:
+    """
+    Проставляет постам liked_by_user для авторизованного пользователя.
+    Еще не записанные из буфера лайки пользователя учитываются и в состоянии, и в счетчике.
+    """
+
+    if user.is_authenticated:
+        liked = liked_post_ids(user, [post.pk for post in posts])
+        pending = pending_likes(user)
+        for post in posts:
+            post.liked_by_user = pending.get(post.pk, post.pk in liked)
+            if post.liked_by_user != (post.pk in liked):
+                post.count_likes += 1 if post.liked_by_user else -1
 
 
 def get_initial_rate(self):
@@ -10,19 +10,29 @@ from django.http import (HttpResponse, HttpResponseNotFound,
                          HttpResponseRedirect)
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse_lazy
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.views.generic import (CreateView, DeleteView, DetailView, FormView,
                                   ListView, UpdateView)
 
+from bike_blog.query_budget import query_budget
+
+from .conditional import list_etag, post_etag
 from .forms import *
 from .models import *
-from .utils import DataMixin, get_initial_rate
+from .likes import is_buffered, toggle_like_buffered
+from .search import search_posts
+from .utils import DataMixin, SlugRegistryMixin, get_initial_rate, mark_liked
 
 
+@query_budget('home', 8)
+@method_decorator(condition(etag_func=list_etag('home')), name='dispatch')
 class Home(DataMixin, ListView):
     """Класс представления домашней страницы"""
 
     template_name = 'bike_app/index.html'
     context_object_name = 'posts'
+    list_cache_name = 'home'
 
     def get_context_data(self, *, object_list=None, **kwargs) -> dict:
         context = super().get_context_data(**kwargs)
@@ -31,42 +41,21 @@ class Home(DataMixin, ListView):
         return context
 
     def get_queryset(self) -> QuerySet:
-        queryset = cache.get('home_cache')
-        if not queryset:
-            queryset = Bike.published.all().annotate(
-                count_likes=Count('userpostrelation', filter=Q(userpostrelation__like=True)),
-                rating=Avg('userpostrelation__rate')
-            ).select_related('cat').prefetch_related('tags').order_by('-created')
-
-            if self.request.user.is_authenticated:
-                queryset = queryset.annotate(
-                    liked_by_user=Exists(
-                        UserPostRelation.objects.filter(
-                            bike=OuterRef('pk'),
-                            auth_user=self.request.user,
-                            like=True
-                        )
-                    )
-                )
-            cache.set('home_cache', queryset, timeout=15)
-        return queryset
+        return Bike.published.all().with_counters() \
+            .select_related('cat').prefetch_related('tags').order_by('-created')
 
 
 @login_required
 def reader_like(request, pk: int) -> HttpResponseRedirect:
     """Функция представления оценки(лайка) авторизованного пользователя"""
-    obj, created = UserPostRelation.objects.get_or_create(auth_user=request.user, bike_id=pk)
-    if created is False:
-        if obj.like is False:
-            obj.like = True
-        else:
-            obj.like = False
-    else:
-        obj.like = True
-    obj.save()
+    if is_buffered():
+        toggle_like_buffered(request.user, pk)
+        return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
+    UserPostRelation.objects.toggle_like(request.user.pk, pk)
     return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
 
 
+@query_budget('add_page', 6)
 class AddPost(LoginRequiredMixin, CreateView):
     """Класс представления страницы для добавления статьи авторизованным пользователем"""
 
@@ -83,7 +72,8 @@ class AddPost(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
-class UpdatePost(UserPassesTestMixin, UpdateView):
+@query_budget('update_post', 13)
+class UpdatePost(SlugRegistryMixin, UserPassesTestMixin, UpdateView):
     """Класс представления для страницы редактирования поста"""
     model = Bike
     fields = ['title', 'slug', 'content', 'photo', 'is_published', 'cat', 'tags']
@@ -99,7 +89,7 @@ class UpdatePost(UserPassesTestMixin, UpdateView):
         return obj.auth_user == self.request.user
 
 
-class DeletePost(UserPassesTestMixin, DeleteView):
+class DeletePost(SlugRegistryMixin, UserPassesTestMixin, DeleteView):
     """Класс представления для удаления поста"""
     model = Bike
     template_name = 'bike_app/deletepage.html'
@@ -115,6 +105,7 @@ class DeletePost(UserPassesTestMixin, DeleteView):
         return obj.auth_user == self.request.user
 
 
+@query_budget('contact', 5)
 class ContactFormView(SuccessMessageMixin, FormView):
     """Класс для обработки формы обратной связи"""
     form_class = ContactForm
@@ -135,7 +126,9 @@ class ContactFormView(SuccessMessageMixin, FormView):
         return super().form_valid(form)
 
 
-class ShowPost(DetailView):
+@query_budget('post', 11)
+@method_decorator(condition(etag_func=post_etag), name='dispatch')
+class ShowPost(SlugRegistryMixin, DetailView):
     """Класс представления страницы поста"""
 
     form_class = AddRateForm
@@ -150,7 +143,7 @@ class ShowPost(DetailView):
         return context
 
     def get_object(self, queryset=None) -> Bike:
-        return get_object_or_404(Bike.published, slug=self.kwargs[self.slug_url_kwarg])
+        return super().get_object(Bike.published.all())
 
     def post(self, request, *args, **kwargs) -> HttpResponse:
         """Функция для установки оценки(рейтинга) авторизованным пользователем"""
@@ -161,11 +154,7 @@ class ShowPost(DetailView):
 
         if form.is_valid():
             rate = form.cleaned_data["rate"]
-            UserPostRelation.objects.update_or_create(
-                auth_user_id=self.request.user.id,
-                bike_id=form.data["post_id"],
-                defaults={'rate': rate}
-            )
+            UserPostRelation.objects.set_relation(self.request.user.id, self.object.pk, rate=rate)
             context['rate_form'] = self.form_class(initial={'rate': rate})
             return render(request, self.template_name, context)
         else:
@@ -173,69 +162,78 @@ class ShowPost(DetailView):
             return render(request, self.template_name, context)
 
 
-class BikeCategory(DataMixin, ListView):
+@query_budget('category', 12)
+@method_decorator(condition(etag_func=list_etag('category', 'category', 'cat_slug')), name='dispatch')
+class BikeCategory(SlugRegistryMixin, DataMixin, ListView):
     """Класс представления постов отфильтровванных по категории"""
 
     template_name = 'bike_app/index.html'
     context_object_name = 'posts'
     allow_empty = False
+    list_cache_name = 'category'
+    list_cache_slug_kwarg = 'cat_slug'
+    slug_kind = 'category'
+    slug_kwarg = 'cat_slug'
 
     def get_context_data(self, *, object_list=None, **kwargs) -> dict:
         context = super().get_context_data(**kwargs)
-        cat = get_object_or_404(Category, slug=self.kwargs['cat_slug'])
+        cat = self.get_object(Category.objects.all())
         context['title'] = 'Категория - ' + cat.name
         context['cat_selected'] = cat.id
         return context
 
     def get_queryset(self) -> QuerySet:
-        queryset = Bike.published.filter(cat__slug=self.kwargs['cat_slug']).annotate(
-            count_likes=Count('userpostrelation', filter=Q(userpostrelation__like=True)),
-            rating=Avg('userpostrelation__rate')
-        ).select_related('cat').prefetch_related('tags').order_by('-created')
-
-        if self.request.user.is_authenticated:
-            queryset = queryset.annotate(
-                liked_by_user=Exists(
-                    UserPostRelation.objects.filter(
-                        bike=OuterRef('pk'),
-                        auth_user=self.request.user,
-                        like=True
-                    )
-                )
-            )
-        return queryset
-
-
-class BikeTags(DataMixin, ListView):
+        return Bike.published.filter(cat_id=self.slug_pk).with_counters() \
+            .select_related('cat').prefetch_related('tags').order_by('-created')
+
+
+@query_budget('tag', 11)
+@method_decorator(condition(etag_func=list_etag('tag', 'tag', 'tag_slug')), name='dispatch')
+class BikeTags(SlugRegistryMixin, DataMixin, ListView):
     """Класс представления постов отфильтровванных по тегу"""
 
     template_name = 'bike_app/index.html'
     context_object_name = 'posts'
+    list_cache_name = 'tag'
+    list_cache_slug_kwarg = 'tag_slug'
+    slug_kind = 'tag'
+    slug_kwarg = 'tag_slug'
 
     def get_context_data(self, *, object_list=None, **kwargs) -> dict:
         context = super().get_context_data(**kwargs)
-        t_obj = get_object_or_404(Tags, slug=self.kwargs['tag_slug'])
+        t_obj = self.get_object(Tags.objects.all())
         context['title'] = 'Тег: ' + t_obj.tag
         context['cat_selected'] = None
         return context
 
     def get_queryset(self) -> QuerySet:
-        queryset = Bike.published.filter(tags__slug=self.kwargs['tag_slug']).annotate(
-            count_likes=Count('userpostrelation', filter=Q(userpostrelation__like=True)),
-            rating=Avg('userpostrelation__rate')
-        ).select_related('cat').prefetch_related('tags').order_by('-created')
-
-        if self.request.user.is_authenticated:
-            queryset = queryset.annotate(
-                liked_by_user=Exists(
-                    UserPostRelation.objects.filter(
-                        bike=OuterRef('pk'),
-                        auth_user=self.request.user,
-                        like=True
-                    )
-                )
-            )
-        return queryset
+        return Bike.published.filter(tags__id=self.slug_pk).with_counters() \
+            .select_related('cat').prefetch_related('tags').order_by('-created')
+
+
+@query_budget('search', 9)
+class SearchPosts(ListView):
+    """Класс представления страницы полнотекстового поиска по постам"""
+
+    template_name = 'bike_app/index.html'
+    context_object_name = 'posts'
+    extra_context = {'default_img': settings.DEFAULT_POST_IMAGE}
+
+    def get_context_data(self, *, object_list=None, **kwargs) -> dict:
+        context = super().get_context_data(**kwargs)
+        context['title'] = 'Поиск: ' + self.request.GET.get('q', '')
+        context['cat_selected'] = None
+        context['search_query'] = self.request.GET.get('q', '')
+        return context
+
+    def get_queryset(self) -> list:
+        query = self.request.GET.get('q', '').strip()
+        if not query:
+            return []
+        queryset = Bike.published.all().with_counters().select_related('cat').prefetch_related('tags')
+        posts = list(search_posts(queryset, query)[:settings.SEARCH_RESULTS_LIMIT])
+        mark_liked(self.request.user, posts)
+        return posts
 
 
 def page_not_found(request, exception) -> HttpResponseNotFound:
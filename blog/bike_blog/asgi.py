@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bike_blog.settings')
+# под ASGI горячие пути чтения обслуживают асинхронные представления
+os.environ.setdefault('ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
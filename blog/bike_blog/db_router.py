@@ -0,0 +1,165 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+# методы, при которых весь запрос читает из основной базы: прочитанное может тут же записываться
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = ContextVar('routing_state', default=None)
+_primary = ContextVar('primary_reads', default=False)
+# псевдоним реплики -> (доступна ли, время проверки по time.monotonic())
+_health = {}
+
+
+class RoutingState:
+    """Маршрутизация одного HTTP-запроса: закреплен ли он за основной базой и выбранная реплика"""
+
+    def __init__(self, pinned: bool):
+        self.pinned = pinned
+        self.wrote = False
+        self.replica = None
+
+
+@contextmanager
+def primary_reads():
+    """
+    Чтение внутри блока - из основной базы. Для заполнения общих кэшей, которые живут до инвалидации:
+    данные из отстающей реплики сразу после записи остались бы в кэше и после того, как реплика догонит.
+    """
+
+    token = _primary.set(True)
+    try:
+        yield
+    finally:
+        _primary.reset(token)
+
+
+def check_replica(alias: str) -> bool:
+    """Реплика отвечает и (в PostgreSQL) отстает от основной базы не больше REPLICA_MAX_LAG секунд"""
+
+    try:
+        connection = connections[alias]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # без новых записей replay_timestamp не меняется: реплика, применившая весь WAL, не отстает
+                cursor.execute('SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+                               'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END')
+                lag = cursor.fetchone()[0] or 0
+                if lag > settings.REPLICA_MAX_LAG:
+                    logger.warning('Реплика %s отстает на %.1f с', alias, lag)
+                    return False
+            else:
+                cursor.execute('SELECT 1')
+    except Exception as exc:
+        logger.warning('Реплика %s недоступна: %s', alias, exc)
+        return False
+    return True
+
+
+def replica_healthy(alias: str) -> bool:
+    """Результат проверки реплики, не чаще раза в REPLICA_HEALTH_INTERVAL секунд на процесс"""
+
+    healthy, checked = _health.get(alias, (False, None))
+    now = time.monotonic()
+    if checked is None or now - checked >= settings.REPLICA_HEALTH_INTERVAL:
+        healthy = check_replica(alias)
+        if healthy != _health.get(alias, (True, None))[0]:
+            logger.info('Реплика %s %s', alias, 'снова доступна' if healthy else 'исключена из чтения')
+        _health[alias] = (healthy, now)
+    return healthy
+
+
+class ReplicaRouter:
+    """
+    Чтение в HTTP-запросах - из реплик DATABASE_REPLICAS, запись - в основную базу. Из основной базы читают:
+    запросы с методами кроме GET/HEAD/OPTIONS, запросы после записи в них и запросы клиента в течение
+    REPLICA_PIN_SECONDS после его записи (read-your-writes), чтение внутри транзакции и primary_reads(),
+    задачи Celery и команды. Недоступные или отстающие реплики пропускаются до следующей проверки.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not settings.DATABASE_REPLICAS:
+            return None
+        if state.pinned or state.wrote or _primary.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            # одна реплика на весь запрос: у разных реплик может быть разное отставание
+            healthy = [alias for alias in settings.DATABASE_REPLICAS if replica_healthy(alias)]
+            state.replica = random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # схема приходит в реплики репликацией из основной базы
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Закрепление клиента за основной базой: после записи в ответ ставится cookie REPLICA_PIN_COOKIE
+    на REPLICA_PIN_SECONDS, и пока она есть, запросы клиента читают из основной базы.
+    Стоит до SessionMiddleware, чтобы учитывалась и запись сессии.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def start(self, request):
+        pinned = request.method not in SAFE_METHODS or settings.REPLICA_PIN_COOKIE in request.COOKIES
+        state = RoutingState(pinned)
+        return state, _state.set(state)
+
+    def finish(self, response, state: RoutingState):
+        if state.wrote:
+            response.set_cookie(settings.REPLICA_PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        state, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(response, state)
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        state, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(response, state)
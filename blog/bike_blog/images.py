@@ -0,0 +1,153 @@
+import io
+import os
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils.module_loading import import_string
+from PIL import Image, ImageOps
+
+# формат файла -> (формат Pillow, параметры сохранения); EXIF и прочие метаданные не передаются и не сохраняются
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+MIME_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+
+def variant_name(name: str, variant: str, width: int, extension: str) -> str:
+    """Путь файла варианта рядом с оригиналом: pictures/x.jpg -> pictures/x__card_320.webp"""
+
+    base, _ = os.path.splitext(name)
+    return f'{base}__{variant}_{width}.{extension}'
+
+
+def _open(storage, name: str) -> Image.Image:
+    """Открывает оригинал с учетом ориентации из EXIF и приводит к RGB/RGBA"""
+
+    with storage.open(name) as file:
+        image = Image.open(file)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        has_alpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+    return image
+
+
+def _encode(image: Image.Image, extension: str) -> bytes:
+    image_format, options = FORMATS[extension]
+    if image_format == 'JPEG' and image.mode == 'RGBA':
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def render_variants(storage, name: str, spec: dict) -> dict:
+    """
+    Создает уменьшенные копии изображения для каждого варианта и ширины из spec ({'card': [320, 640]})
+    в WebP и JPEG. Изображения не увеличиваются. Возвращает описание для поля *_variants.
+    """
+
+    image = _open(storage, name)
+    sizes = {}
+    for variant, widths in spec.items():
+        entries = []
+        for width in sorted({min(width, image.width) for width in widths}):
+            height = max(round(image.height * width / image.width), 1)
+            resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+            entry = {'width': width, 'height': height}
+            for extension in FORMATS:
+                path = variant_name(name, variant, width, extension)
+                storage.delete(path)
+                entry[extension] = storage.save(path, ContentFile(_encode(resized, extension)))
+            entries.append(entry)
+        sizes[variant] = entries
+    return {'source': name, 'width': image.width, 'height': image.height, 'sizes': sizes}
+
+
+def variant_files(variants: dict) -> set:
+    return {entry[extension] for entries in (variants or {}).get('sizes', {}).values()
+            for entry in entries for extension in FORMATS if extension in entry}
+
+
+def save_variants(model, pk: int, field_name: str, variants: dict) -> bool:
+    """
+    Записывает варианты в поле <field_name>_variants, если изображение не успели заменить,
+    и удаляет файлы прежних вариантов. В хранилище с дедупликацией файлы могут быть общими,
+    их удаляет сборка мусора.
+    """
+
+    manager = model._default_manager
+    variants_field = f'{field_name}_variants'
+    previous = manager.filter(pk=pk).values_list(variants_field, flat=True).first()
+    updated = manager.filter(pk=pk, **{field_name: variants['source']}).update(**{variants_field: variants})
+    if updated:
+        stale = variant_files(previous) - variant_files(variants)
+    else:
+        stale = variant_files(variants)
+    storage = model._meta.get_field(field_name).storage
+    if not getattr(storage, 'deduplicates', False):
+        for path in stale:
+            storage.delete(path)
+    return bool(updated)
+
+
+def build_variants(model, pk: int, field_name: str, name: str, spec: dict) -> bool:
+    """Создание и запись вариантов изображения объекта, False - если изображение уже заменено"""
+
+    storage = model._meta.get_field(field_name).storage
+    return save_variants(model, pk, field_name, render_variants(storage, name, spec))
+
+
+def schedule_image_variants(task_path: str, pk: int, name: str) -> None:
+    """Постановка задачи Celery на создание вариантов после коммита транзакции, в которой загружено изображение"""
+
+    transaction.on_commit(lambda: import_string(task_path).delay(pk, name))
+
+
+def variants_are_current(field_file, variants: dict) -> bool:
+    return bool(field_file) and bool(variants) and variants.get('source') == field_file.name
+
+
+def variant_urls(field_file, variants: dict, build_url=None) -> dict:
+    """URL вариантов изображения: {'card': [{'width', 'height', 'webp', 'jpeg'}]}, пусто для устаревших вариантов"""
+
+    if not variants_are_current(field_file, variants):
+        return {}
+
+    def url(path: str) -> str:
+        path = field_file.storage.url(path)
+        return build_url(path) if build_url is not None else path
+
+    return {
+        variant: [{**entry, **{extension: url(entry[extension]) for extension in FORMATS}} for entry in entries]
+        for variant, entries in variants['sizes'].items()
+    }
+
+
+def srcset(entries: list, extension: str) -> str:
+    return ', '.join(f"{entry[extension]} {entry['width']}w" for entry in entries)
+
+
+def setup_worker() -> None:
+    """Инициализация процесса пула для платформ, где дочерние процессы запускаются заново (spawn)"""
+
+    if not apps.ready:
+        import django
+
+        django.setup()
+
+
+def render_job(job: tuple) -> tuple:
+    """Задача пула процессов для дозаполнения: (модель, pk, поле, файл, spec) -> (pk, варианты, ошибка)"""
+
+    label, pk, field_name, name, spec = job
+    storage = apps.get_model(label)._meta.get_field(field_name).storage
+    try:
+        return pk, render_variants(storage, name, spec), None
+    except (OSError, ValueError) as error:
+        return pk, None, str(error)
@@ -0,0 +1,242 @@
+import functools
+import logging
+import os
+import random
+import sys
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as django_backend
+from django.utils.functional import empty
+
+from bike_blog.metrics import observe_request
+
+logger = logging.getLogger(__name__)
+
+# методы кэша, время которых учитывается; get и get_many дополнительно считают попадания и промахи
+CACHE_METHODS = ('get', 'get_many', 'set', 'set_many', 'add', 'delete', 'delete_many', 'incr', 'decr', 'touch',
+                 'has_key')
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Счетчики одного запроса: база, кэш и шаблоны. Доступны через contextvar и в потоках sync_to_async"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_count = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_time = 0.0
+        self.template_time = 0.0
+        self.in_cache = False
+        # список (начало, длительность, SQL) запросов к базе - только когда запрос профилируется
+        self.timeline = None
+
+    def server_timing(self, total: float) -> str:
+        return ', '.join((
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.db_count} queries"',
+            f'cache;dur={self.cache_time * 1000:.1f};desc="{self.cache_hits} hits / {self.cache_misses} misses"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ))
+
+
+def current_metrics():
+    """Метрики обрабатываемого запроса или None вне InstrumentationMiddleware"""
+
+    return _current.get()
+
+
+def query_origin(limit: int = 3) -> str:
+    """Ближайшие к запросу кадры стека из кода проекта: 'bike_app/views.py:42 in get_queryset < ...'"""
+
+    base_dir = str(settings.BASE_DIR) + os.sep
+    origin = []
+    frame = sys._getframe(1)
+    while frame is not None and len(origin) < limit:
+        filename = frame.f_code.co_filename
+        if filename.startswith(base_dir) and filename != __file__ and 'site-packages' not in filename:
+            origin.append(f'{os.path.relpath(filename, base_dir)}:{frame.f_lineno} in {frame.f_code.co_name}')
+        frame = frame.f_back
+    return ' < '.join(origin) or '<вне кода проекта>'
+
+
+def _execute(execute, sql, params, many, context):
+    """Обертка выполнения запросов: время и число запросов, медленные - в лог с местом вызова"""
+
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.db_count += 1
+        metrics.db_time += elapsed
+        if metrics.timeline is not None:
+            metrics.timeline.append((started - metrics.started, elapsed, sql))
+        if elapsed * 1000 >= settings.SLOW_QUERY_THRESHOLD_MS and random.random() < settings.SLOW_QUERY_SAMPLE_RATE:
+            logger.warning('Медленный запрос %.1f мс (%s): %s', elapsed * 1000, query_origin(), sql[:2000])
+
+
+def instrument_connection(connection, **kwargs) -> None:
+    # первой в списке: execute_wrapper() снимает со списка последнюю обертку
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _execute)
+
+
+connection_created.connect(instrument_connection)
+
+
+def _cache_method(cache, name: str):
+    method = getattr(cache, name)
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        metrics = _current.get()
+        # get_many и get_or_set по умолчанию вызывают get: учитывается только внешний вызов
+        if metrics is None or metrics.in_cache:
+            return method(*args, **kwargs)
+        if name == 'get_many':
+            args = (list(args[0]), *args[1:])
+        metrics.in_cache = True
+        started = time.perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        finally:
+            metrics.cache_time += time.perf_counter() - started
+            metrics.in_cache = False
+        if name == 'get':
+            default = args[1] if len(args) > 1 else kwargs.get('default')
+            hit = result is not default
+            metrics.cache_hits += hit
+            metrics.cache_misses += not hit
+        elif name == 'get_many':
+            metrics.cache_hits += len(result)
+            metrics.cache_misses += len(args[0]) - len(result)
+        return result
+
+    return wrapper
+
+
+def instrument_cache(cache) -> None:
+    """Обертки методов экземпляра кэша; экземпляры создаются на поток (контекст), поэтому проверка на каждый запрос"""
+
+    if cache.__dict__.get('_instrumented'):
+        return
+    for name in CACHE_METHODS:
+        setattr(cache, name, _cache_method(cache, name))
+    cache._instrumented = True
+
+
+class Template(django_backend.Template):
+    """Шаблон, время отрисовки которого добавляется к метрикам запроса"""
+
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - started
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """Шаблонизатор Django, учитывающий время отрисовки шаблонов в метриках запроса"""
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
+
+
+def _loaded_user(request):
+    """Пользователь запроса, если уже загружен: ленивый объект не загружается (под ASGI это запрос к базе)"""
+
+    user = getattr(request, 'user', None)
+    user = getattr(user, '_wrapped', user)
+    return None if user is empty else user
+
+
+class InstrumentationMiddleware:
+    """
+    Метрики каждого запроса: число и время запросов к базе, попадания, промахи и время кэша, время шаблонов и
+    общее время. Пишутся строкой key=value в лог bike_blog.instrumentation (уровень DEBUG, запросы дольше
+    SLOW_REQUEST_THRESHOLD_MS - WARNING) и в заголовок Server-Timing (при SERVER_TIMING или для staff).
+    Запросы к базе дольше SLOW_QUERY_THRESHOLD_MS с долей SLOW_QUERY_SAMPLE_RATE пишутся в лог с местом вызова
+    в коде проекта.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def start(self):
+        for connection in connections.all():
+            instrument_connection(connection)
+        for cache in caches.all():
+            instrument_cache(cache)
+        metrics = RequestMetrics()
+        return metrics, _current.set(metrics)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics, token = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics, token = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics: RequestMetrics):
+        total = time.perf_counter() - metrics.started
+        if settings.SERVER_TIMING or getattr(_loaded_user(request), 'is_staff', False):
+            response['Server-Timing'] = metrics.server_timing(total)
+        match = request.resolver_match
+        fields = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match is not None else None,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'db_count': metrics.db_count,
+            'db_ms': round(metrics.db_time * 1000, 1),
+            'cache_hits': metrics.cache_hits,
+            'cache_misses': metrics.cache_misses,
+            'cache_ms': round(metrics.cache_time * 1000, 1),
+            'template_ms': round(metrics.template_time * 1000, 1),
+        }
+        observe_request(fields['view'], request.method, response.status_code, total, metrics)
+        level = logging.WARNING if fields['total_ms'] >= settings.SLOW_REQUEST_THRESHOLD_MS else logging.DEBUG
+        logger.log(level, 'request %s', ' '.join(f'{name}={value}' for name, value in fields.items()),
+                    extra={'metrics': fields})
+        return response
@@ -0,0 +1,144 @@
+import base64
+import logging
+import smtplib
+import threading
+import time
+
+from celery import shared_task
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def serialize_message(message) -> dict:
+    """Письмо в словарь для передачи задаче Celery в JSON; вложения - только (имя, содержимое, тип)"""
+
+    attachments = []
+    for attachment in message.attachments:
+        if not isinstance(attachment, tuple):
+            raise ValueError('Вложения MIMEBase не поддерживаются очередью писем')
+        filename, content, mimetype = attachment
+        if isinstance(content, bytes):
+            attachments.append([filename, base64.b64encode(content).decode(), mimetype, True])
+        else:
+            attachments.append([filename, content, mimetype, False])
+    return {
+        'subject': str(message.subject),
+        'body': str(message.body),
+        'from_email': message.from_email,
+        'to': list(message.to),
+        'cc': list(message.cc),
+        'bcc': list(message.bcc),
+        'reply_to': list(message.reply_to),
+        'headers': {name: str(value) for name, value in message.extra_headers.items()},
+        'content_subtype': message.content_subtype,
+        'alternatives': [list(alternative) for alternative in getattr(message, 'alternatives', ())],
+        'attachments': attachments,
+    }
+
+
+def deserialize_message(data: dict) -> EmailMultiAlternatives:
+    message = EmailMultiAlternatives(
+        data['subject'], data['body'], data['from_email'], data['to'], data['bcc'],
+        cc=data['cc'], reply_to=data['reply_to'], headers=data['headers'],
+        alternatives=[tuple(alternative) for alternative in data['alternatives']],
+    )
+    message.content_subtype = data['content_subtype']
+    for filename, content, mimetype, encoded in data['attachments']:
+        message.attach(filename, base64.b64decode(content) if encoded else content, mimetype)
+    return message
+
+
+def delivery_connection():
+    """
+    Соединение с почтовым сервером, общее для задач процесса (потока) воркера: пачки писем подряд отправляются
+    без повторного подключения и авторизации. Простоявшее дольше EMAIL_CONNECTION_MAX_IDLE соединение
+    закрывается - сервер мог сам разорвать его.
+    """
+
+    connection = getattr(_local, 'connection', None)
+    if connection is not None and time.monotonic() - _local.last_used > settings.EMAIL_CONNECTION_MAX_IDLE:
+        close_delivery_connection()
+        connection = None
+    if connection is None:
+        connection = get_connection(settings.EMAIL_DELIVERY_BACKEND, fail_silently=False)
+        connection.open()
+        _local.connection = connection
+    _local.last_used = time.monotonic()
+    return connection
+
+
+def close_delivery_connection(**kwargs) -> None:
+    connection = getattr(_local, 'connection', None)
+    _local.connection = None
+    if connection is not None:
+        try:
+            connection.close()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+
+worker_process_shutdown.connect(close_delivery_connection)
+
+
+def _is_permanent(exc: Exception) -> bool:
+    """
+    Отказ в самом письме, который не исправится повтором: все получатели отклонены или ответ 5xx на DATA.
+    Ошибки подключения, авторизации (535) и отказ отправителю относятся ко всем письмам пачки - их повторяем.
+    """
+
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(exc, smtplib.SMTPDataError) and exc.smtp_code >= 500
+
+
+@shared_task(bind=True)
+def send_emails(self, messages: list) -> int:
+    """
+    Отправляет пачку писем через одно соединение. При временной ошибке соединение закрывается, а еще не
+    отправленные письма уходят в повтор задачи с нарастающей задержкой. Письма с постоянным отказом пропускаются.
+    """
+
+    sent = 0
+    for index, data in enumerate(messages):
+        try:
+            sent += delivery_connection().send_messages([deserialize_message(data)])
+        except (smtplib.SMTPException, OSError) as exc:
+            if _is_permanent(exc):
+                # smtplib сбрасывает транзакцию после отказа, соединение остается рабочим
+                logger.error('Письмо "%s" для %s отклонено: %s', data['subject'], data['to'], exc)
+                continue
+            close_delivery_connection()
+            countdown = settings.EMAIL_RETRY_BACKOFF * 2 ** self.request.retries
+            logger.warning('Ошибка отправки писем, повтор %s через %s с: %s', self.request.retries + 1, countdown, exc)
+            raise self.retry(args=(messages[index:],), exc=exc, countdown=countdown,
+                             max_retries=settings.EMAIL_MAX_RETRIES)
+    return sent
+
+
+class CeleryEmailBackend(BaseEmailBackend):
+    """
+    Почтовый бэкенд, ставящий письма в очередь Celery пачками по EMAIL_BATCH_SIZE после коммита транзакции:
+    запрос не ждет почтовый сервер. Письма отправляет задача send_emails через EMAIL_DELIVERY_BACKEND.
+    """
+
+    def send_messages(self, email_messages) -> int:
+        messages = [serialize_message(message) for message in email_messages if message.recipients()]
+        for start in range(0, len(messages), settings.EMAIL_BATCH_SIZE):
+            batch = messages[start:start + settings.EMAIL_BATCH_SIZE]
+            transaction.on_commit(lambda batch=batch: self._enqueue(batch))
+        return len(messages)
+
+    def _enqueue(self, batch: list) -> None:
+        try:
+            send_emails.delay(batch)
+        except Exception:
+            if not self.fail_silently:
+                raise
+            logger.exception('Не удалось поставить письма в очередь')
@@ -0,0 +1,163 @@
+import logging
+import os
+import time
+
+from celery.signals import before_task_publish, task_postrun, task_prerun, worker_init, worker_process_shutdown
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from kombu.exceptions import ChannelError
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess, start_http_server)
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+REQUEST_LATENCY = Histogram('bike_http_request_duration_seconds', 'Время ответа по представлениям',
+                            ['view', 'method', 'status'])
+DB_QUERIES = Counter('bike_db_queries_total', 'Запросы к базе при обработке HTTP-запросов', ['view'])
+DB_TIME = Counter('bike_db_query_seconds_total', 'Время запросов к базе при обработке HTTP-запросов', ['view'])
+CACHE_REQUESTS = Counter('bike_cache_requests_total', 'Чтения из кэша при обработке HTTP-запросов', ['result'])
+CACHE_TIME = Counter('bike_cache_seconds_total', 'Время операций с кэшем при обработке HTTP-запросов', ['view'])
+LIST_CACHE_REQUESTS = Counter('bike_list_cache_requests_total', 'Обращения к кэшу страниц списков постов',
+                              ['list', 'result'])
+RELATION_WRITES = Counter('bike_relation_writes_total', 'Записи лайков и оценок', ['kind', 'mode'])
+TASK_RUNS = Counter('bike_celery_task_runs_total', 'Выполнения задач Celery по итогу', ['task', 'state'])
+TASK_LATENCY = Histogram('bike_celery_task_duration_seconds', 'Время выполнения задач Celery', ['task'])
+TASK_QUEUE_TIME = Histogram('bike_celery_task_queue_seconds', 'Время от постановки задачи до начала выполнения',
+                            ['task'])
+
+_task_started = {}
+
+
+def is_multiprocess() -> bool:
+    """Значения пишутся в файлы PROMETHEUS_MULTIPROC_DIR и суммируются по процессам gunicorn и воркера при сборе"""
+
+    return 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+
+def collector_registry():
+    if not is_multiprocess():
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def reset_multiprocess_dir() -> None:
+    """
+    Удаление файлов прошлого запуска главным процессом до запуска рабочих. Свои файлы процесса остаются,
+    если он уже что-то записал. У всех метрик есть метки, поэтому импорт модуля файлов не создает
+    и не требует существующего PROMETHEUS_MULTIPROC_DIR - каталог создается здесь и в entrypoint.prod.sh.
+    """
+
+    if not is_multiprocess():
+        return
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        if not name.endswith(f'_{os.getpid()}.db'):
+            os.remove(os.path.join(path, name))
+
+
+def mark_process_dead(pid: int) -> None:
+    if is_multiprocess():
+        multiprocess.mark_process_dead(pid)
+
+
+def observe_request(view: str, method: str, status: int, total: float, request_metrics) -> None:
+    """Метрики HTTP-запроса по уже собранным InstrumentationMiddleware счетчикам"""
+
+    view = view or '<unresolved>'
+    REQUEST_LATENCY.labels(view, method, f'{status // 100}xx').observe(total)
+    if request_metrics.db_count:
+        DB_QUERIES.labels(view).inc(request_metrics.db_count)
+        DB_TIME.labels(view).inc(request_metrics.db_time)
+    if request_metrics.cache_hits:
+        CACHE_REQUESTS.labels('hit').inc(request_metrics.cache_hits)
+    if request_metrics.cache_misses:
+        CACHE_REQUESTS.labels('miss').inc(request_metrics.cache_misses)
+    if request_metrics.cache_time:
+        CACHE_TIME.labels(view).inc(request_metrics.cache_time)
+
+
+def observe_list_cache(list_name: str, hit: bool) -> None:
+    LIST_CACHE_REQUESTS.labels(list_name, 'hit' if hit else 'miss').inc()
+
+
+def observe_relation_write(kind: str, mode: str, count: int = 1) -> None:
+    """kind - like/rate, mode - sync (сразу в базу), buffered (в буфер), flush (из буфера в базу), bulk (пакет API)"""
+
+    if count:
+        RELATION_WRITES.labels(kind, mode).inc(count)
+
+
+@before_task_publish.connect
+def _mark_published(headers=None, **kwargs) -> None:
+    if headers is not None:
+        headers['published_at'] = time.time()
+
+
+@task_prerun.connect
+def _task_prerun(task_id=None, task=None, **kwargs) -> None:
+    _task_started[task_id] = time.perf_counter()
+    published = getattr(task.request, 'published_at', None)
+    if published:
+        TASK_QUEUE_TIME.labels(task.name).observe(max(time.time() - published, 0))
+
+
+@task_postrun.connect
+def _task_postrun(task_id=None, task=None, state=None, **kwargs) -> None:
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        TASK_LATENCY.labels(task.name).observe(time.perf_counter() - started)
+    TASK_RUNS.labels(task.name, (state or 'unknown').lower()).inc()
+
+
+@worker_init.connect
+def _start_worker_endpoint(**kwargs) -> None:
+    """Главный процесс воркера отдает метрики своих дочерних процессов на CELERY_METRICS_PORT"""
+
+    reset_multiprocess_dir()
+    if settings.CELERY_METRICS_PORT:
+        start_http_server(settings.CELERY_METRICS_PORT, registry=collector_registry())
+
+
+@worker_process_shutdown.connect
+def _worker_process_shutdown(pid=None, **kwargs) -> None:
+    mark_process_dead(pid or os.getpid())
+
+
+class QueueLengthCollector:
+    """Длина очередей брокера Celery на момент сбора метрик"""
+
+    def collect(self):
+        from bike_blog import celery_app
+
+        gauge = GaugeMetricFamily('bike_celery_queue_length', 'Задач в очереди брокера', labels=['queue'])
+        try:
+            with celery_app.connection_for_read() as connection:
+                connection.ensure_connection(max_retries=1)
+                for queue in settings.METRICS_CELERY_QUEUES:
+                    try:
+                        length = connection.default_channel.queue_declare(queue, passive=True).message_count
+                    except ChannelError:
+                        # очередь создается при первой публикации или запуске воркера
+                        length = 0
+                    gauge.add_metric([queue], length)
+        except Exception as exc:
+            # недоступный брокер не должен ломать остальные метрики
+            logger.warning('Не удалось получить длину очередей Celery: %s', exc)
+        yield gauge
+
+
+def metrics_view(request):
+    """Метрики в текстовом формате Prometheus; при METRICS_TOKEN - только с заголовком Authorization: Bearer"""
+
+    token = settings.METRICS_TOKEN
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+    queues = CollectorRegistry()
+    queues.register(QueueLengthCollector())
+    return HttpResponse(generate_latest(collector_registry()) + generate_latest(queues),
+                        content_type=CONTENT_TYPE_LATEST)
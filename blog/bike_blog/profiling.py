@@ -0,0 +1,269 @@
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404, HttpResponse
+from django.shortcuts import render
+from django.urls import reverse
+from django.utils import timezone
+
+from bike_blog.instrumentation import current_metrics
+
+INDEX_KEY = 'profiles:index'
+# глубже стек обрезается, чтобы рекурсия не раздувала профиль
+MAX_STACK_DEPTH = 200
+# узлы меньше этой доли выборок не выводятся в графе и дереве вызовов
+MIN_SHARE = 0.005
+
+
+def _profile_key(profile_id: str) -> str:
+    return f'profiles:{profile_id}'
+
+
+def _short_path(filename: str) -> str:
+    if 'site-packages' in filename:
+        return filename.rsplit('site-packages' + os.sep, 1)[-1]
+    base_dir = str(settings.BASE_DIR) + os.sep
+    if filename.startswith(base_dir):
+        return filename[len(base_dir):]
+    return os.path.basename(filename)
+
+
+def frame_name(code) -> str:
+    """Функция и место ее объявления: одинаковые вызовы с разных строк попадают в один узел"""
+
+    return f'{getattr(code, "co_qualname", code.co_name)} ({_short_path(code.co_filename)}:{code.co_firstlineno})'
+
+
+class Sampler(threading.Thread):
+    """
+    Статистический профиль: раз в interval секунд снимается стек потока запроса через sys._current_frames().
+    Профилируемый код не замедляется трассировкой, стек обрезается кадром root - вызовом middleware.
+    """
+
+    def __init__(self, thread_id: int, root, interval: float):
+        super().__init__(daemon=True, name='profile-sampler')
+        self.thread_id = thread_id
+        self.root = root
+        self.interval = interval
+        self.stacks = Counter()
+        self.done = threading.Event()
+
+    def sample(self) -> None:
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None and frame is not self.root:
+            stack.append(frame_name(frame.f_code))
+            frame = frame.f_back
+        # без кадра root поток занят другим: под ASGI цикл событий выполняет чужие запросы
+        if frame is self.root and stack:
+            self.stacks[tuple(reversed(stack[-MAX_STACK_DEPTH:]))] += 1
+
+    def run(self) -> None:
+        while not self.done.wait(self.interval):
+            self.sample()
+
+    def stop(self) -> Counter:
+        self.done.set()
+        self.join()
+        return self.stacks
+
+
+def save_profile(profile: dict) -> None:
+    """Профиль в кэш на PROFILING_RETENTION, в списке - только последние PROFILING_MAX_PROFILES"""
+
+    cache.set(_profile_key(profile['id']), profile, timeout=settings.PROFILING_RETENTION)
+    summary = {name: profile[name] for name in ('id', 'method', 'path', 'status', 'user', 'created', 'duration',
+                                                  'samples', 'trigger')}
+    summary['queries'] = len(profile['queries'])
+    index = [summary] + (cache.get(INDEX_KEY) or [])
+    cache.set(INDEX_KEY, index[:settings.PROFILING_MAX_PROFILES], timeout=settings.PROFILING_RETENTION)
+
+
+def get_profile(profile_id: str):
+    return cache.get(_profile_key(profile_id))
+
+
+class ProfilingMiddleware:
+    """
+    Профилирование отдельных запросов: staff - с параметром ?_profile=1 или заголовком X-Profile: 1,
+    остальные запросы - с долей PROFILING_SAMPLE_RATE. Сохраняются профиль CPU и хронология SQL, в ответе -
+    заголовок X-Profile-Id. Без профилирования на запрос приходится только проверка строки запроса и заголовка.
+    Под ASGI выборки снимаются с потока цикла событий: код в sync_to_async в профиль не попадает.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def trigger(self, request):
+        """'sample' - случайная выборка, 'staff' - флаг в запросе, None - без профилирования"""
+
+        if settings.PROFILING_SAMPLE_RATE and random.random() < settings.PROFILING_SAMPLE_RATE:
+            return 'sample'
+        if '_profile=' in request.META.get('QUERY_STRING', '') or 'HTTP_X_PROFILE' in request.META:
+            return 'staff'
+        return None
+
+    def start(self, root):
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.timeline = []
+        sampler = Sampler(threading.get_ident(), root, settings.PROFILING_INTERVAL)
+        sampler.start()
+        return sampler, time.perf_counter()
+
+    def finish(self, request, response, trigger: str, sampler: Sampler, started: float):
+        duration = time.perf_counter() - started
+        stacks = sampler.stop()
+        metrics = current_metrics()
+        timeline = metrics.timeline if metrics is not None and metrics.timeline is not None else []
+        offset = started - metrics.started if metrics is not None else 0
+        profile = {
+            'id': uuid.uuid4().hex,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'user': request.user.get_username() if request.user.is_authenticated else '',
+            'created': timezone.now().isoformat(),
+            'trigger': trigger,
+            'duration': round(duration * 1000, 1),
+            'interval': settings.PROFILING_INTERVAL,
+            'samples': sum(stacks.values()),
+            'stacks': [[list(stack), count] for stack, count in stacks.most_common()],
+            'queries': [[round((start - offset) * 1000, 2), round(elapsed * 1000, 2), sql[:2000]]
+                        for start, elapsed, sql in timeline],
+        }
+        save_profile(profile)
+        response['X-Profile-Id'] = profile['id']
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        trigger = self.trigger(request)
+        # пользователь загружается только для запросов с флагом профилирования
+        if trigger == 'staff' and not request.user.is_staff:
+            trigger = None
+        if trigger is None:
+            return self.get_response(request)
+        sampler, started = self.start(sys._getframe())
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            sampler.stop()
+            raise
+        return self.finish(request, response, trigger, sampler, started)
+
+    async def __acall__(self, request):
+        trigger = self.trigger(request)
+        if trigger == 'staff' and not await sync_to_async(lambda: request.user.is_staff)():
+            trigger = None
+        if trigger is None:
+            return await self.get_response(request)
+        sampler, started = self.start(sys._getframe())
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            sampler.stop()
+            raise
+        return await sync_to_async(self.finish)(request, response, trigger, sampler, started)
+
+
+def call_tree(stacks: list) -> dict:
+    """Дерево вызовов из выборок: узел - {'name', 'total', 'self', 'children': {имя: узел}}"""
+
+    root = {'name': 'all', 'total': 0, 'self': 0, 'children': {}}
+    for stack, count in stacks:
+        node = root
+        node['total'] += count
+        for name in stack:
+            node = node['children'].setdefault(name, {'name': name, 'total': 0, 'self': 0, 'children': {}})
+            node['total'] += count
+        node['self'] += count
+    return root
+
+
+def flame_boxes(root: dict) -> list:
+    """Прямоугольники графа: {'name', 'depth', 'left', 'width' (в % от всех выборок), 'samples'}"""
+
+    boxes = []
+    total = root['total'] or 1
+
+    def walk(node: dict, depth: int, left: int) -> None:
+        if node['total'] / total < MIN_SHARE:
+            return
+        boxes.append({'name': node['name'], 'depth': depth, 'left': left / total * 100,
+                      'width': node['total'] / total * 100, 'samples': node['total']})
+        for child in sorted(node['children'].values(), key=lambda child: child['name']):
+            walk(child, depth + 1, left)
+            left += child['total']
+
+    walk(root, 0, 0)
+    return boxes
+
+
+def tree_rows(root: dict) -> list:
+    """Строки дерева вызовов по убыванию времени: {'name', 'depth', 'total', 'self'} (в % от всех выборок)"""
+
+    rows = []
+    total = root['total'] or 1
+
+    def walk(node: dict, depth: int) -> None:
+        for child in sorted(node['children'].values(), key=lambda child: -child['total']):
+            if child['total'] / total < MIN_SHARE:
+                continue
+            rows.append({'name': child['name'], 'depth': depth, 'total': child['total'] / total * 100,
+                         'self': child['self'] / total * 100})
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    return rows
+
+
+def profile_list(request):
+    """Последние профили запросов в админке"""
+
+    return render(request, 'admin/profiles/list.html', {
+        'title': 'Профили запросов',
+        'profiles': cache.get(INDEX_KEY) or [],
+        'sample_rate': settings.PROFILING_SAMPLE_RATE,
+    })
+
+
+def profile_detail(request, profile_id: str):
+    """Граф пламени, дерево вызовов и хронология SQL профиля; ?format=folded - стеки для flamegraph.pl/speedscope"""
+
+    profile = get_profile(profile_id)
+    if profile is None:
+        raise Http404('Профиль не найден или устарел')
+    if request.GET.get('format') == 'folded':
+        lines = (f"{';'.join(stack)} {count}\n" for stack, count in profile['stacks'])
+        return HttpResponse(''.join(lines), content_type='text/plain; charset=utf-8')
+
+    tree = call_tree(profile['stacks'])
+    boxes = flame_boxes(tree)
+    duration = max(profile['duration'], 1e-3)
+    queries = [{'start': start, 'duration': elapsed, 'sql': sql, 'left': min(start / duration * 100, 100),
+                'width': max(elapsed / duration * 100, 0.2)} for start, elapsed, sql in profile['queries']]
+    return render(request, 'admin/profiles/detail.html', {
+        'title': f'Профиль {profile["method"]} {profile["path"]}',
+        'profile': profile,
+        'boxes': boxes,
+        'depth': max((box['depth'] for box in boxes), default=0) + 1,
+        'rows': tree_rows(tree),
+        'queries': queries,
+        'sql_time': sum(query['duration'] for query in queries),
+        'list_url': reverse('admin_profiles'),
+    })
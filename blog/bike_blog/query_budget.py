@@ -0,0 +1,78 @@
+import logging
+import random
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# имя URL (с пространством имен, как в resolver_match.view_name) -> наибольшее число запросов на ответ
+BUDGETS = {}
+
+
+def query_budget(url_name: str, queries: int):
+    """
+    Декоратор представления, объявляющий бюджет запросов к базе для URL.
+    Бюджет не должен зависеть от числа строк: тесты проверяют это на наборах данных разного размера.
+    """
+
+    def decorator(view):
+        BUDGETS[url_name] = queries
+        return view
+
+    return decorator
+
+
+class QueryCounter:
+    """Обертка выполнения запросов, считающая их без DEBUG и connection.queries"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_queries():
+    """Подсчет запросов ко всем базам внутри блока"""
+
+    counter = QueryCounter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+        yield counter
+
+
+class QueryBudgetMiddleware:
+    """
+    Проверка бюджетов в работающем приложении: для доли запросов QUERY_BUDGET_SAMPLE_RATE
+    считаются запросы к базе и превышение бюджета пишется в лог.
+    Под ASGI запросы асинхронных представлений выполняются в других потоках и не считаются,
+    их бюджеты проверяют тесты.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.get_response(request)
+        if random.random() >= settings.QUERY_BUDGET_SAMPLE_RATE:
+            return self.get_response(request)
+        with count_queries() as counter:
+            response = self.get_response(request)
+        match = request.resolver_match
+        budget = BUDGETS.get(match.view_name) if match is not None else None
+        if budget is not None and counter.count > budget:
+            logger.warning('Превышен бюджет запросов %s: %d из %d (%s %s)', match.view_name, counter.count, budget,
+                           request.method, request.get_full_path())
+        return response
@@ -28,7 +28,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = str(os.getenv('SECRET_KEY'))
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = str(os.getenv('DEBUG'))
+DEBUG = os.getenv('DEBUG', 'False') == 'True'
 
 ALLOWED_HOSTS = str(os.getenv('ALLOWED_HOSTS')).split(" ")
 INTERNAL_IPS = str(os.getenv('INTERNAL_IPS')).split(" ")
@@ -51,7 +51,6 @@ INSTALLED_APPS = [
     'djoser',
     'captcha',
     'django_extensions',
-    "debug_toolbar",
     'drf_spectacular',
 
     'bike_app.apps.Bike_AppConfig',
@@ -62,25 +61,32 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
+    "bike_blog.instrumentation.InstrumentationMiddleware",
+    "bike_blog.db_router.ReplicaRoutingMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "bike_blog.query_budget.QueryBudgetMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     # "django.middleware.cache.UpdateCacheMiddleware",  # cache Redis venv all site
     "django.middleware.common.CommonMiddleware",
     # "django.middleware.cache.FetchFromCacheMiddleware",  # cache Redis venv all site
     "django.middleware.csrf.CsrfViewMiddleware",
-    "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "users.authentication.CachedAuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    'django_currentuser.middleware.ThreadLocalUserMiddleware',
+    "bike_blog.profiling.ProfilingMiddleware",
 
 ]
 
+# панель отладки с журналом SQL - только при разработке, в работе метрики пишет InstrumentationMiddleware
+if DEBUG:
+    INSTALLED_APPS.append("debug_toolbar")
+    MIDDLEWARE.insert(1, "debug_toolbar.middleware.DebugToolbarMiddleware")
+
 ROOT_URLCONF = 'bike_blog.urls'
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "BACKEND": "bike_blog.instrumentation.DjangoTemplates",
         "DIRS": [
             BASE_DIR / 'templates'
         ],
@@ -117,6 +123,34 @@ DATABASES = {
 
 }
 
+# тестовая база SQLite - в файле, а не в памяти: параллельные потоки ConcurrentRelationTestCase
+# должны писать в одну базу
+if 'sqlite3' in DATABASES['default']['ENGINE']:
+    DATABASES['default']['TEST'] = {'NAME': str(BASE_DIR / 'test_db.sqlite3')}
+
+# реплики только для чтения: адреса host[:port] через пробел (для SQLite - пути к копиям файла базы),
+# без DB_REPLICAS все запросы идут в default. В тестах реплики - зеркала default
+DATABASE_REPLICAS = []
+for number, address in enumerate(os.getenv('DB_REPLICAS', '').split(), start=1):
+    replica = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    if 'sqlite3' in replica['ENGINE']:
+        replica['NAME'] = address
+    else:
+        replica['HOST'], _, port = address.partition(':')
+        replica['PORT'] = port or replica['PORT']
+        # недоступная реплика не должна надолго задерживать проверку
+        replica['OPTIONS'] = {'connect_timeout': 2}
+    DATABASES[f'replica{number}'] = replica
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['bike_blog.db_router.ReplicaRouter']
+# после записи клиент читает из основной базы столько секунд (должно быть больше REPLICA_MAX_LAG);
+# реплики проверяются раз в REPLICA_HEALTH_INTERVAL секунд, отстающие больше REPLICA_MAX_LAG секунд пропускаются
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 15))
+REPLICA_PIN_COOKIE = 'primary_pin'
+REPLICA_HEALTH_INTERVAL = float(os.getenv('REPLICA_HEALTH_INTERVAL', 5))
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 10))
+
 SOCIAL_AUTH_JSONFIELD_ENABLED = True
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -164,6 +198,12 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 MEDIA_ROOT = BASE_DIR / 'media'
 MEDIA_URL = '/media/'
 
+# загруженные файлы хранятся под именами по хэшу содержимого, одинаковые файлы не дублируются
+STORAGES = {
+    'default': {'BACKEND': 'bike_blog.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
 LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'home'
 LOGIN_URL = 'users:login'
@@ -182,6 +222,12 @@ AUTH_USER_MODEL = 'users.User'
 DEFAULT_USER_IMAGE = MEDIA_URL + 'users/default_user.jpeg'
 DEFAULT_POST_IMAGE = MEDIA_URL + 'users/no_pic.png'
 
+# уменьшенные копии загруженных изображений: вариант -> ширины для srcset
+IMAGE_VARIANTS = {
+    'post': {'card': [320, 640], 'detail': [800, 1600]},
+    'avatar': {'avatar': [250, 500]},
+}
+
 
 CACHES = {
 
@@ -191,11 +237,73 @@ CACHES = {
     }
 }
 
+# время жизни закэшированных страниц списков постов, инвалидация - сменой поколения
+BIKE_LIST_CACHE_TIMEOUT = 60 * 5
+# время жизни закэшированного приблизительного количества постов в списках
+APPROXIMATE_COUNT_TIMEOUT = 60 * 10
+# время жизни счетчиков постов по категориям и тегам в боковой панели, инвалидация - при записи
+SIDEBAR_CACHE_TIMEOUT = 60 * 60 * 24
+# множество лайкнутых пользователем постов: время жизни и ограничение размера для очень активных пользователей
+LIKED_SET_TIMEOUT = 60 * 60 * 24
+LIKED_SET_MAX_SIZE = 5000
+
+# реестр slug -> id: фильтр Блума для быстрых 404, общий кэш и словарь в процессе
+SLUG_BLOOM_ERROR_RATE = 0.01
+SLUG_REGISTRY_TIMEOUT = 86400
+SLUG_REGISTRY_LOCAL_SIZE = 10000
+
+# полнотекстовый поиск: конфигурация стемминга PostgreSQL и максимум результатов на странице поиска
+SEARCH_CONFIG = 'russian'
+SEARCH_RESULTS_LIMIT = 50
+
+# пользователь и токен -> пользователь для аутентификации без запросов к базе, инвалидация - при сохранении
+AUTH_USER_CACHE_TIMEOUT = 60 * 5
+
+# асинхронные представления горячих путей чтения, включаются при запуске под ASGI (bike_blog/asgi.py)
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
+
+# доля запросов, для которых считаются обращения к базе и в лог пишется превышение бюджета (0 - выключено)
+QUERY_BUDGET_SAMPLE_RATE = float(os.getenv('QUERY_BUDGET_SAMPLE_RATE', 0.01))
+# заголовок Server-Timing с метриками запроса для всех (иначе - только для staff)
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'False') == 'True'
+# запросы к базе дольше порога (мс) пишутся в лог с местом вызова для такой доли случаев
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 200))
+SLOW_QUERY_SAMPLE_RATE = float(os.getenv('SLOW_QUERY_SAMPLE_RATE', 1))
+# строка метрик запроса пишется с уровнем WARNING для запросов дольше порога (мс), для остальных - DEBUG
+SLOW_REQUEST_THRESHOLD_MS = float(os.getenv('SLOW_REQUEST_THRESHOLD_MS', 1000))
+
+# метрики Prometheus: /metrics веб-процесса (с METRICS_TOKEN - только с заголовком Authorization: Bearer),
+# порт метрик воркера Celery (0 - не запускать) и очереди брокера, длина которых отдается при сборе
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+CELERY_METRICS_PORT = int(os.getenv('CELERY_METRICS_PORT', 0))
+METRICS_CELERY_QUEUES = os.getenv('METRICS_CELERY_QUEUES', 'celery').split()
+
+# профилирование запросов: доля профилируемых запросов всех пользователей (staff - по ?_profile=1),
+# интервал выборки стека (с), сколько последних профилей показывать в админке и сколько хранить (с)
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0))
+PROFILING_INTERVAL = float(os.getenv('PROFILING_INTERVAL', 0.005))
+PROFILING_MAX_PROFILES = 50
+PROFILING_RETENTION = 60 * 60 * 24
+
 # celery
 
 CELERY_BROKER_URL = str(os.getenv('CELERY_BROKER_URL'))
 CELERY_RESULT_BACKENDS = str(os.getenv('CELERY_RESULT_BACKENDS'))
 
+# лайки: 'sync' - запись сразу в базу, 'buffered' - через буфер в Redis с периодической записью задачей Celery
+LIKES_WRITE_MODE = os.getenv('LIKES_WRITE_MODE', 'sync')
+LIKES_FLUSH_INTERVAL = 5
+LIKES_FLUSH_BATCH_SIZE = 1000
+# захваченные сбросом лайки возвращаются в буфер, если за столько секунд сброс не подтвердил запись (упал воркер)
+LIKES_CLAIM_TIMEOUT = 60 * 5
+
+# пакетная запись через API: наибольшее число постов и оценок в одном запросе
+BULK_MAX_POSTS = 100
+BULK_MAX_RELATIONS = 500
+
+# потоковая выгрузка постов и оценок: строк в одной порции курсора на сервере
+EXPORT_CHUNK_SIZE = 2000
+
 # drf
 
 REST_FRAMEWORK = {
@@ -203,14 +311,14 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 5,
 
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
 
     ),
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'api.v1.renderers.ORJSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
 
 ],
@@ -269,8 +377,16 @@ SIMPLE_JWT = {
 
 
 
-# EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
-
+# письма уходят задачей Celery пачками; EMAIL_DELIVERY_BACKEND - бэкенд, которым их отправляет воркер
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'bike_blog.mail.CeleryEmailBackend')
+EMAIL_DELIVERY_BACKEND = os.getenv('EMAIL_DELIVERY_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_BATCH_SIZE = 50
+# повтор отправки: EMAIL_RETRY_BACKOFF * 2 ** номер попытки секунд, не больше EMAIL_MAX_RETRIES раз
+EMAIL_MAX_RETRIES = 5
+EMAIL_RETRY_BACKOFF = 30
+# соединение воркера с почтовым сервером переиспользуется, если простаивало не дольше стольких секунд
+EMAIL_CONNECTION_MAX_IDLE = 30
+EMAIL_TIMEOUT = 30
 
 EMAIL_HOST = str(os.getenv('EMAIL_HOST'))
 EMAIL_PORT = str(os.getenv('EMAIL_PORT'))
@@ -282,7 +398,8 @@ DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 SERVER_EMAIL = EMAIL_HOST_USER
 EMAIL_ADMIN = EMAIL_HOST_USER
 
-#  debug inside docker
+# адрес сайта для ссылок в письмах, которые формируются вне запроса
+SITE_URL = os.getenv('SITE_URL', f'http://{ALLOWED_HOSTS[0]}')
 
 LOGGING = {
     'version': 1,
@@ -290,9 +407,18 @@ LOGGING = {
         'console': {'class': 'logging.StreamHandler'}
     },
     'loggers': {
-        'django.db.backends': {
+        # строка метрик на каждый запрос (INFO) и медленные запросы к базе (WARNING)
+        'bike_blog.instrumentation': {
+            'handlers': ['console'],
+            'level': os.getenv('INSTRUMENTATION_LOG_LEVEL', 'INFO')
+        },
+        'bike_blog.query_budget': {
+            'handlers': ['console'],
+            'level': 'WARNING'
+        },
+        'bike_blog.mail': {
             'handlers': ['console'],
-            'level': 'DEBUG'
+            'level': 'WARNING'
         }
     }
 }
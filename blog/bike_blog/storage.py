@@ -0,0 +1,82 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_NAME_RE = re.compile(r'^[0-9a-f]{64}(\.\w+)?$')
+TEMP_PREFIX = '.upload-'
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Файловое хранилище, именующее файлы по SHA-256 содержимого: <каталог>/ab/cd/<sha256><расширение>.
+    Одинаковые загрузки хранятся один раз, подбор свободного имени не нужен.
+    Файлы могут быть общими для нескольких объектов, поэтому удаляются только сборкой мусора (collect_media_garbage).
+    """
+
+    deduplicates = True
+    chunk_size = 64 * 1024
+
+    def content_name(self, name: str, digest: str) -> str:
+        """Имя по хэшу; первый каталог из upload_to (pictures, users) сохраняется, даты в пути не нужны"""
+
+        directory = name.replace('\\', '/').split('/', 1)[0] if '/' in name else ''
+        extension = os.path.splitext(name)[1].lower()
+        return '/'.join(part for part in (directory, digest[:2], digest[2:4], digest + extension) if part)
+
+    def get_available_name(self, name, max_length=None):
+        # имя определяется содержимым в _save, поиск свободного имени с проверкой exists() не выполняется
+        return name
+
+    def _save(self, name, content):
+        """Потоковая запись во временный файл с подсчетом хэша и переименование в имя по хэшу"""
+
+        os.makedirs(self.location, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.location, prefix=TEMP_PREFIX)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                for chunk in content.chunks(self.chunk_size):
+                    digest.update(chunk)
+                    file.write(chunk)
+            name = self.content_name(name, digest.hexdigest())
+            full_path = self.path(name)
+            try:
+                # новое время изменения: файл-сирота не попадет в сборку мусора, пока ссылка на него не сохранена
+                os.utime(full_path)
+            except FileNotFoundError:
+                pass
+            else:
+                os.remove(temp_path)
+                return name
+            os.makedirs(os.path.dirname(full_path), mode=self.directory_permissions_mode or 0o777, exist_ok=True)
+            # одинаковое содержимое, поэтому параллельная загрузка того же файла перезапишет его без потерь
+            file_move_safe(temp_path, full_path, allow_overwrite=True)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return name
+
+    def is_content_name(self, name: str) -> bool:
+        return bool(HASH_NAME_RE.match(os.path.basename(name)))
+
+    def walk(self, directory: str = ''):
+        """Имена всех файлов с именем по хэшу внутри каталога"""
+
+        if not self.exists(directory):
+            return
+        directories, files = self.listdir(directory)
+        for file in files:
+            name = f'{directory}/{file}' if directory else file
+            if self.is_content_name(name):
+                yield name
+        for child in directories:
+            yield from self.walk(f'{directory}/{child}' if directory else child)
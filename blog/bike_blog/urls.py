@@ -3,8 +3,12 @@ from django.contrib import admin
 from django.urls import include, path
 
 from bike_app.views import *
+from bike_blog.metrics import metrics_view
+from bike_blog.profiling import profile_detail, profile_list
 
 urlpatterns = [
+    path('admin/profiles/', admin.site.admin_view(profile_list), name='admin_profiles'),
+    path('admin/profiles/<str:profile_id>/', admin.site.admin_view(profile_detail), name='admin_profile'),
     path("admin/", admin.site.urls),
 
     path('captcha/', include('captcha.urls')),
@@ -12,6 +16,7 @@ urlpatterns = [
     path('users/', include('users.urls', namespace='users')),
     path('api/', include('api.v1.urls')),
     path('social-auth/', include('social_django.urls', namespace='social')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 if settings.DEBUG:
     urlpatterns = [
@@ -11,6 +11,13 @@ app = Celery('bike_blog')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.conf.broker_url = settings.CELERY_BROKER_URL
 app.autodiscover_tasks()
+app.conf.imports = ('bike_blog.mail', 'bike_blog.metrics')
 app.conf.broker_connection_retry_on_startup = True
+app.conf.beat_schedule = {
+    'flush-likes': {
+        'task': 'bike_app.tasks.flush_likes',
+        'schedule': settings.LIKES_FLUSH_INTERVAL,
+    },
+}
 
 
@@ -12,5 +12,11 @@ then
     echo "PostgreSQL запущен"
 fi
 
+# файлы метрик процессов gunicorn и воркера Celery
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]
+then
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
 exec "$@"
 
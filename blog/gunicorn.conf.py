@@ -0,0 +1,16 @@
+# gunicorn читает этот файл из рабочего каталога автоматически
+
+def on_starting(server):
+    """Файлы метрик прошлого запуска удаляются до запуска рабочих процессов"""
+
+    from bike_blog.metrics import reset_multiprocess_dir
+
+    reset_multiprocess_dir()
+
+
+def child_exit(server, worker):
+    """Метрики завершившегося рабочего процесса больше не учитываются в текущих значениях"""
+
+    from bike_blog.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
@@ -1,7 +1,18 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
     verbose_name = 'Пользователи'
+
+    def ready(self):
+        from django.contrib.auth import get_user_model
+        from rest_framework.authtoken.models import Token
+
+        from users.authentication import invalidate_token, invalidate_user
+
+        for signal in (post_save, post_delete):
+            signal.connect(invalidate_user, sender=get_user_model())
+            signal.connect(invalidate_token, sender=Token)
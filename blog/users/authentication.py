@@ -1,7 +1,142 @@
+import hashlib
+from functools import partial
 from typing import Optional
 
-from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.contrib.auth import (BACKEND_SESSION_KEY, HASH_SESSION_KEY,
+                                 SESSION_KEY, get_user, get_user_model)
 from django.contrib.auth.backends import BaseBackend
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from bike_blog.db_router import primary_reads
+
+
+def user_cache_key(user_id) -> str:
+    return f'auth:user:{user_id}'
+
+
+def token_cache_key(key: str) -> str:
+    # ключ токена - секрет, в кэш попадает только его хэш
+    return f'auth:token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def get_cached_user(user_id):
+    """
+    Пользователь по id из кэша, при промахе - из основной базы: пользователь из отстающей реплики (со старым паролем
+    или до отключения) остался бы в кэше на AUTH_USER_CACHE_TIMEOUT. None - пользователь не найден
+    """
+
+    key = user_cache_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        with primary_reads():
+            user = get_user_model().objects.filter(pk=user_id).first()
+        if user is not None:
+            cache.set(key, user, timeout=settings.AUTH_USER_CACHE_TIMEOUT)
+    return user
+
+
+def _delete_now_and_on_commit(key: str, using: str = None) -> None:
+    """
+    Сброс ключа сразу и еще раз после коммита транзакции: параллельный запрос, прочитавший строку до коммита,
+    иначе вернул бы ее в кэш на AUTH_USER_CACHE_TIMEOUT
+    """
+
+    cache.delete(key)
+    transaction.on_commit(partial(cache.delete, key), using=using)
+
+
+def invalidate_user(sender, instance, using=None, **kwargs) -> None:
+    """Сброс кэша пользователя при сохранении (в том числе смене пароля и отключении) и удалении"""
+
+    _delete_now_and_on_commit(user_cache_key(instance.pk), using)
+
+
+def invalidate_token(sender, instance, using=None, **kwargs) -> None:
+    """Сброс кэша токена при отзыве"""
+
+    _delete_now_and_on_commit(token_cache_key(instance.key), using)
+
+
+def get_session_user(request):
+    """
+    Пользователь сессии из кэша с той же проверкой хэша сессии, что и в django.contrib.auth.get_user.
+    Если проверка не прошла (сменился пароль, пользователь отключен), решение принимает django.contrib.auth.get_user.
+    """
+
+    try:
+        user_id = get_user_model()._meta.pk.to_python(request.session[SESSION_KEY])
+        backend_path = request.session[BACKEND_SESSION_KEY]
+    except KeyError:
+        return AnonymousUser()
+    session_hash = request.session.get(HASH_SESSION_KEY)
+    if backend_path in settings.AUTHENTICATION_BACKENDS and session_hash:
+        user = get_cached_user(user_id)
+        if user is not None and user.is_active \
+                and constant_time_compare(session_hash, user.get_session_auth_hash()):
+            return user
+    return get_user(request)
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """AuthenticationMiddleware, загружающий request.user из кэша, а не запросом к базе на каждой странице"""
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_session_user(request))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication с кэшем токен -> id пользователя. request.auth - несохраненный Token с ключом и пользователем.
+    """
+
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        user_id = cache.get(cache_key)
+        if user_id is None:
+            # отозванный токен еще может быть в отстающей реплике
+            with primary_reads():
+                user, token = super().authenticate_credentials(key)
+            cache.set(cache_key, user.pk, timeout=settings.AUTH_USER_CACHE_TIMEOUT)
+            cache.set(user_cache_key(user.pk), user, timeout=settings.AUTH_USER_CACHE_TIMEOUT)
+            return user, token
+        user = get_cached_user(user_id)
+        if user is None or not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return user, self.get_model()(key=key, user=user)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication, загружающий пользователя из кэша"""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        user = get_cached_user(user_id)
+        if user is None:
+            raise exceptions.AuthenticationFailed(_('User not found'), code='user_not_found')
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if jwt_settings.CHECK_REVOKE_TOKEN and \
+                validated_token.get(jwt_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+            raise exceptions.AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        return user
 
 
 class EmailAuthBackend(BaseBackend):
@@ -19,7 +154,4 @@ class EmailAuthBackend(BaseBackend):
             return None
 
     def get_user(self, user_id) -> Optional[get_user_model()]:
-        try:
-            return self.users_model.objects.get(pk=user_id)
-        except self.users_model.DoesNotExist:
-            return None
+        return get_cached_user(user_id)
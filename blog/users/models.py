@@ -1,3 +1,5 @@
+from urllib.parse import urljoin
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractUser
@@ -6,16 +8,31 @@ from django.db import models
 from django.urls import reverse
 from django.utils.timezone import now
 
-from users.utils import CustomStorage
+from bike_blog.images import schedule_image_variants
 
 
 class User(AbstractUser):
     """Расширенная модель User"""
 
-    photo = models.ImageField(upload_to="users/%Y/%m/%d/", blank=True, null=True, verbose_name="Фотография", storage=CustomStorage())
+    photo = models.ImageField(upload_to="users/%Y/%m/%d/", blank=True, null=True, verbose_name="Фотография")
+    photo_variants = models.JSONField(default=dict, blank=True, editable=False, verbose_name="Варианты фотографии")
     date_birth = models.DateTimeField(blank=True, null=True, verbose_name="Дата рождения")
     is_verified_email = models.BooleanField(default=False)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Запоминаем фотографию, чтобы создавать варианты размеров только после загрузки новой"""
+
+        instance = super().from_db(db, field_names, values)
+        instance._stored_photo = instance.__dict__.get('photo')
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if self.photo and self.photo.name != getattr(self, '_stored_photo', None):
+            schedule_image_variants('users.tasks.build_avatar_variants', self.pk, self.photo.name)
+            self._stored_photo = self.photo.name
+
 
 class EmailVerification(models.Model):
     """Модель верификации пользователя чераз email"""
@@ -32,7 +49,7 @@ class EmailVerification(models.Model):
         """Формирование письма для подтверждения учетной записи"""
 
         link = reverse('users:email_verification', kwargs={'email': self.user.email, 'code': self.code})
-        verification_link = self.request.build_absolute_uri(link)
+        verification_link = urljoin(settings.SITE_URL, link)
         subject = f'Подтверждение учетной записи для {self.user.username}'
         message = f'Для подтверждения учетной записи для {self.user.email} перейдите по ссылке: {verification_link}'
 
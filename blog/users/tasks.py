@@ -2,9 +2,11 @@ import uuid
 from datetime import timedelta
 
 from celery import shared_task
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.utils.timezone import now
 
+from bike_blog.images import build_variants
 from users.models import EmailVerification
 
 
@@ -15,3 +17,9 @@ def send_email_verification(user_id: int) -> None:
     expiration = now() + timedelta(hours=48)
     record = EmailVerification.objects.create(code=uuid.uuid4(), user=user, expiration=expiration)
     record.send_verification_email()
+
+
+@shared_task
+def build_avatar_variants(user_id: int, name: str) -> None:
+    """Создает уменьшенные копии загруженной фотографии пользователя"""
+    build_variants(get_user_model(), user_id, 'photo', name, settings.IMAGE_VARIANTS['avatar'])
@@ -1,8 +1,28 @@
+import os
+import socketserver
+import tempfile
+import threading
+import uuid
+from datetime import timedelta
 from http import HTTPStatus
+from unittest import mock
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase, override_settings
+from django.core import mail
+from django.core.cache import cache
+from django.db import connections
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
+from django.utils.timezone import now
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from bike_blog import db_router
+from bike_blog.mail import close_delivery_connection, send_emails, serialize_message
+from users.authentication import CachedTokenAuthentication, get_cached_user, get_session_user
+from users.authentication import token_cache_key, user_cache_key
+from users.models import EmailVerification
 
 
 class RegisterUserTestCase(TestCase):
@@ -56,4 +76,239 @@ class RegisterUserTestCase(TestCase):
         self.assertContains(response, "Пользователь с таким именем уже существует.")
 
 
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Минимальный SMTP-сервер для тестов: принимает письма, приветствие и ответы на AUTH и DATA можно подменить"""
+
+    def reply(self, line: str) -> None:
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.reply(server.greeting)
+        while line := self.rfile.readline():
+            command = line.decode().strip().upper()
+            if command.startswith('EHLO'):
+                self.reply('250-localhost')
+                self.reply('250 AUTH PLAIN')
+            elif command.startswith('AUTH'):
+                self.reply(server.auth_reply)
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                if server.data_replies:
+                    self.reply(server.data_replies.pop(0))
+                else:
+                    server.messages += 1
+                    self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+@override_settings(EMAIL_DELIVERY_BACKEND='django.core.mail.backends.smtp.EmailBackend', EMAIL_HOST='127.0.0.1',
+                   EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='', EMAIL_USE_SSL=False, EMAIL_USE_TLS=False)
+class EmailTestCase(TestCase):
+    """Тест очереди писем и отправки пачками"""
+
+    def setUp(self):
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPHandler)
+        self.server.daemon_threads = True
+        self.server.connections = self.server.messages = 0
+        self.server.data_replies = []
+        self.server.greeting, self.server.auth_reply = '220 localhost', '235 OK'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.settings_override = override_settings(EMAIL_PORT=self.server.server_address[1])
+        self.settings_override.enable()
+
+    def tearDown(self):
+        close_delivery_connection()
+        self.settings_override.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def batch(self, count: int) -> list:
+        return [serialize_message(mail.EmailMessage(f'Письмо {i}', 'текст', 'blog@test.ru', [f'user{i}@test.ru']))
+                for i in range(count)]
+
+    def test_batches_share_connection(self):
+        """Тест отправки нескольких пачек через одно соединение"""
+
+        send_emails.apply(args=[self.batch(3)])
+        send_emails.apply(args=[self.batch(2)])
+        self.assertEqual((1, 5), (self.server.connections, self.server.messages))
+
+    def test_retry_unsent(self):
+        """Тест повтора только неотправленных писем после временной ошибки и пропуска отклоненных"""
+
+        self.server.data_replies = ['550 Mailbox unavailable', '451 Try again later']
+        with mock.patch.object(send_emails, 'retry', wraps=send_emails.retry) as retry, \
+                self.assertLogs('bike_blog.mail', 'WARNING'):
+            send_emails.apply(args=[self.batch(4)])
+        self.assertEqual(3, len(retry.call_args.kwargs['args'][0]))
+        self.assertEqual((2, 3), (self.server.connections, self.server.messages))
+
+    def test_retry_connection_errors(self):
+        """Тест повтора всей пачки при отказе в подключении или авторизации: письма не считаются отклоненными"""
+
+        for greeting, auth_reply in (('554 No service', '235 OK'), ('220 localhost', '535 Authentication failed')):
+            with self.subTest(greeting=greeting, auth_reply=auth_reply):
+                self.server.greeting, self.server.auth_reply = greeting, auth_reply
+                with self.settings(EMAIL_HOST_USER='blog', EMAIL_HOST_PASSWORD='secret'), \
+                        mock.patch.object(send_emails, 'retry', wraps=send_emails.retry) as retry, \
+                        self.assertLogs('bike_blog.mail', 'WARNING') as logs:
+                    send_emails.apply(args=[self.batch(2)])
+                self.assertEqual(2, len(retry.call_args.kwargs['args'][0]))
+                self.assertEqual(['WARNING'], sorted({record.levelname for record in logs.records}))
+
+    @override_settings(EMAIL_BACKEND='bike_blog.mail.CeleryEmailBackend', EMAIL_BATCH_SIZE=2)
+    def test_backend_enqueues_after_commit(self):
+        """Тест постановки писем в очередь пачками после коммита без обращения к почтовому серверу"""
+
+        message = mail.EmailMultiAlternatives('Тема', 'текст', 'blog@test.ru', ['user@test.ru'],
+                                              reply_to=['guest@test.ru'], alternatives=[('<p>текст</p>', 'text/html')])
+        message.attach('data.bin', b'\x00\x01', 'application/octet-stream')
+        with mock.patch('bike_blog.mail.send_emails.delay') as delay:
+            with self.captureOnCommitCallbacks() as callbacks:
+                mail.get_connection().send_messages([message] * 3)
+            delay.assert_not_called()
+            for callback in callbacks:
+                callback()
+        self.assertEqual([2, 1], [len(call.args[0]) for call in delay.call_args_list])
+        self.assertEqual(0, self.server.connections)
+
+        send_emails.apply(args=[delay.call_args.args[0]])
+        self.assertEqual(1, self.server.messages)
+
+    def test_verification_email_link(self):
+        """Тест письма подтверждения email, формируемого в задаче без запроса"""
+
+        user = get_user_model().objects.create(username='user1', email='user@user.ru')
+        record = EmailVerification.objects.create(user=user, code=uuid.uuid4(), expiration=now() + timedelta(hours=48))
+        with override_settings(SITE_URL='https://bikes.example'):
+            record.send_verification_email()
+        self.assertIn(f'https://bikes.example/users/verify/user@user.ru/{record.code}', mail.outbox[0].body)
+
+
+class AuthCacheTestCase(TestCase):
+    """Тест загрузки пользователя сессии и токена из кэша"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='user1', password='12345678Aa-')
+        self.client.force_login(self.user)
+        self.request = RequestFactory().get('/')
+        self.request.session = self.client.session
+
+    def test_session_user(self):
+        """Тест пользователя сессии без запросов к базе и сброса кэша при сохранении и смене пароля"""
+
+        get_session_user(self.request)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.user, get_session_user(self.request))
+
+        self.user.first_name = 'Иван'
+        self.user.save()
+        self.assertEqual('Иван', get_session_user(self.request).first_name)
+
+        self.user.set_password('87654321Aa-')
+        self.user.save()
+        self.assertFalse(get_session_user(self.request).is_authenticated)
+
+    def test_token_revoked(self):
+        """Тест токена без запросов к базе до отзыва"""
+
+        token = Token.objects.create(user=self.user)
+        authentication = CachedTokenAuthentication()
+        authentication.authenticate_credentials(token.key)
+        with self.assertNumQueries(0):
+            user, auth = authentication.authenticate_credentials(token.key)
+        self.assertEqual((self.user, token.key), (user, auth.key))
+
+        Token.objects.filter(user=self.user).delete()
+        with self.assertRaises(AuthenticationFailed):
+            authentication.authenticate_credentials(token.key)
+
+    def test_recached_before_commit(self):
+        """Тест сброса кэша после коммита: параллельный запрос успел вернуть в кэш прежние строки до коммита"""
+
+        key = Token.objects.create(user=self.user).key
+        stale_user = get_cached_user(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+            Token.objects.get(key=key).delete()
+            cache.set(user_cache_key(self.user.pk), stale_user)
+            cache.set(token_cache_key(key), self.user.pk)
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+        self.assertIsNone(cache.get(token_cache_key(key)))
+        self.assertFalse(get_cached_user(self.user.pk).is_active)
+
+
+@override_settings(DATABASE_REPLICAS=['stale_replica'])
+class ReplicaAuthCacheTestCase(TransactionTestCase):
+    """
+    Тест кэшей пользователя и токена при отстающей реплике: отдельная база SQLite с прежними строками.
+    TransactionTestCase - внутри транзакции теста маршрутизатор читает только из основной базы.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """Реплика с таблицами пользователей и токенов; в databases - только здесь, проверки при запуске ее не знают"""
+
+        cls.databases = {'default', 'stale_replica'}
+        cls.replica_path = os.path.join(tempfile.mkdtemp(), 'replica.sqlite3')
+        connections.settings['stale_replica'] = dict(connections.settings['default'], NAME=cls.replica_path)
+        with connections['stale_replica'].schema_editor() as editor:
+            editor.create_model(get_user_model())
+            editor.create_model(Token)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['stale_replica'].close()
+        del connections.settings['stale_replica']
+        os.remove(cls.replica_path)
+
+    def setUp(self):
+        """Пользователь и токен, скопированные в реплику"""
+
+        # flush после теста реплику не очищает: маршрутизатор запрещает в ней миграции
+        with connections['stale_replica'].cursor() as cursor:
+            for model in (Token, get_user_model()):
+                cursor.execute(f'DELETE FROM {model._meta.db_table}')
+        cache.clear()
+        db_router._health.clear()
+        self.user = get_user_model().objects.create_user('user1', 'user@user.ru', '12345678Aa-')
+        self.token = Token.objects.create(user=self.user)
+        self.user.save(using='stale_replica')
+        Token.objects.using('stale_replica').create(key=self.token.key, user_id=self.user.pk)
+
+    def in_request(self, load):
+        """Результат load() внутри GET-запроса клиента, не закрепленного за основной базой"""
+
+        result = []
+        db_router.ReplicaRoutingMiddleware(lambda request: result.append(load()) or HttpResponse())(
+            RequestFactory().get('/'))
+        return result[0]
+
+    def test_revoked_token(self):
+        """Тест отозванного токена, который еще есть в реплике"""
+
+        key = self.token.key
+        self.token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.in_request(lambda: CachedTokenAuthentication().authenticate_credentials(key))
+
+    def test_changed_password(self):
+        """Тест пользователя со старым паролем в реплике"""
 
+        self.assertEqual('user1', self.in_request(lambda: get_user_model().objects.get(pk=self.user.pk).username))
+        self.user.set_password('87654321Aa-')
+        self.user.save()
+        user = self.in_request(lambda: get_cached_user(self.user.pk))
+        self.assertTrue(user.check_password('87654321Aa-'))
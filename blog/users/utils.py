@@ -1,13 +1,5 @@
-import os
+from bike_blog.storage import ContentAddressedStorage
 
-from django.core.files.storage import FileSystemStorage
 
-
-class CustomStorage(FileSystemStorage):
-    def get_available_name(self, name, max_length=None):
-        base_name, extension = os.path.splitext(name)
-        counter = 1
-        while self.exists(name):
-            name = f"{base_name}_{counter}{extension}"
-            counter += 1
-        return name
+class CustomStorage(ContentAddressedStorage):
+    """Прежнее хранилище фотографий пользователей, оставлено для уже созданных миграций"""
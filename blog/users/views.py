@@ -7,11 +7,14 @@ from django.shortcuts import redirect
 from django.urls import reverse_lazy
 from django.views.generic import CreateView, TemplateView, UpdateView
 
+from bike_blog.query_budget import query_budget
+
 from .forms import (LoginUserForm, ProfileUserForm, RegisterUserForm,
                     UserPasswordChangeForm)
 from .models import EmailVerification
 
 
+@query_budget('users:login', 4)
 class LoginUser(LoginView):
     """Класс представления страницы авторизации"""
 
@@ -20,6 +23,7 @@ class LoginUser(LoginView):
     extra_context = {'title': 'Авторизация'}
 
 
+@query_budget('users:register', 4)
 class RegisterUser(CreateView):
     """Класс представления страницы регистрации"""
 
@@ -29,6 +33,7 @@ class RegisterUser(CreateView):
     success_url = reverse_lazy('users:login')
 
 
+@query_budget('users:profile', 4)
 class Profile(LoginRequiredMixin, UpdateView):
     """Класс представления страницы профиля пользователя"""
 